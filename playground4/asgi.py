@@ -13,4 +13,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'playground4.settings')
 
+# Under ASGI every request gets its own connection context, so persistent connections would
+# never be reused and pile up instead. Unless the environment says otherwise, keep one
+# connection per request here and leave pooling to a pooler such as PgBouncer in front of
+# Postgres.
+os.environ.setdefault('DATABASE_CONN_MAX_AGE', '0')
+
+# Serve the hot read views as async views (see web/async_views.py) unless ASYNC_VIEWS is set
+os.environ.setdefault('ASYNC_VIEWS', '1')
+
 application = get_asgi_application()
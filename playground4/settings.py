@@ -37,25 +37,30 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'playground4.web',
     'bootstrap_datepicker_plus',
 ]
 
 MIDDLEWARE = [
+    'playground4.web.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'playground4.web.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'playground4.web.replicas.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'playground4.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates with render timing for the request metrics
+        'BACKEND': 'playground4.web.metrics.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
 	    ,
         'APP_DIRS': True,
@@ -85,9 +90,75 @@ DATABASES = {
         "PASSWORD": "postgres",
         "HOST": "127.0.0.1",
         "PORT": "5432",
+        # Persistent connections: every worker thread keeps its connection this many seconds and
+        # checks it still works before reusing it in a new request. asgi.py turns them off.
+        "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Read replicas (see web/replicas.py): DATABASE_REPLICAS=host[:port],... adds the aliases replica1,
+# replica2, ... with the default credentials. Leave it unset for the test suite, ReplicaRoutingTest
+# brings its own stand-in replicas.
+for number, address in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'OPTIONS': {'connect_timeout': 2},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['playground4.web.replicas.ReplicaRouter']
+
+# Read-only catalog views served from a replica
+REPLICA_VIEWS = ['field_list', 'field_list_by_sport', 'reviews', 'all_events_list', 'events_list']
+
+# After writing, a user reads from the primary this long; replicas are expected to lag less
+READ_YOUR_WRITES_SECONDS = 10
+
+# Seconds a replica that failed is skipped
+REPLICA_RETRY_SECONDS = 30
+
+# Route the hot read views to their async versions (web/async_views.py); asgi.py turns it on
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+
+# Live slot updates on the reservation form (see web/live_slots.py): an idle stream sends a
+# heartbeat every SLOT_EVENTS_HEARTBEAT seconds and ends after SLOT_EVENTS_STREAM_SECONDS,
+# when the browser opens a new one
+SLOT_EVENTS_HEARTBEAT = 15
+SLOT_EVENTS_STREAM_SECONDS = 300
+
+# Seconds a slot stays held for the user filling in the reservation form (see web/holds.py).
+# Run the sweep_slot_holds command every minute or so to delete expired holds.
+SLOT_HOLD_SECONDS = 300
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Per-process memory by default; point at a shared backend such as
+# 'django.core.cache.backends.filebased.FileBasedCache' with a LOCATION directory
+# so all workers see the same pages and invalidations.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "4play",
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    }
+}
+
+# Request metrics (see web/metrics.py). With several worker processes, set METRICS_DIR to a
+# directory they share; each worker writes its totals there every METRICS_FLUSH_INTERVAL seconds
+# and the /metrics/ endpoint adds them up.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 10
+
+# Seconds a cached catalog page lives when no edit invalidates it earlier (see web/page_cache.py)
+CATALOG_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -1,15 +1,37 @@
 from django.contrib import admin
 from django.contrib.admin import AdminSite
+from django.contrib.postgres.search import SearchQuery
 
-from .models import User, Field, Event, Review, Reservation
+from . import exports
+from .models import User, Field, Event, Review, Reservation, OpeningHours, OpeningException
+from .search import SEARCH_CONFIG
+
+
+class OpeningHoursInline(admin.TabularInline):
+    model = OpeningHours
+    extra = 0
+    max_num = 7
+
+
+class OpeningExceptionInline(admin.TabularInline):
+    model = OpeningException
+    extra = 0
 
 
 class FieldAdmin(admin.ModelAdmin):
+    # Saving the inlines recompiles the field's opening hours (signals.py)
+    inlines = [OpeningHoursInline, OpeningExceptionInline]
     list_display = ('name', 'location', 'sport', 'price_per_hour', 'field_owner')
     list_filter = ('sport', 'price_per_hour', 'field_owner', 'location')
     ordering = ('name',)
     search_fields = ('name', 'location')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of ILIKE scans over name and location
+        if not search_term:
+            return queryset, False
+        return queryset.filter(search_vector=SearchQuery(search_term, search_type='websearch', config=SEARCH_CONFIG)), False
+
 class UserAdmin(admin.ModelAdmin):
     list_display = ('username', 'email', 'field_owner')
     list_filter = ('age', 'groups')
@@ -28,6 +50,13 @@ class ReservationAdmin(admin.ModelAdmin):
     list_filter = ('user', 'field')
     ordering = ('-reservation_date',)
     search_fields = ('user', 'field')
+    date_hierarchy = 'reservation_date'
+    actions = ['export_as_csv']
+
+    @admin.action(description='Export selected reservations as CSV')
+    def export_as_csv(self, request, queryset):
+        # Streams, so "select all" over a year of reservations doesn't build the file in memory
+        return exports.reservations_csv_response(queryset, 'reservations.csv')
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('user', 'field',  'created_at')
     list_filter = ('field', 'user')
@@ -5,5 +5,8 @@ class WebConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'playground4.web'
 
+    def ready(self):
+        from . import signals  # noqa: F401
+
 
 
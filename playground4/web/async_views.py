@@ -0,0 +1,163 @@
+import asyncio
+import datetime
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponseNotAllowed, StreamingHttpResponse
+from django.shortcuts import render
+
+from . import live_slots
+from .forms import ReviewForm
+from .models import Event, Field, Review
+from .page_cache import cache_catalog_page
+from .pagination import akeyset_paginate
+from .views import FieldDetailView
+
+# Async versions of the hot read views, served by urls.py when ASYNC_VIEWS is on (asgi.py turns
+# it on). They render the same templates with the same queries as their sync versions in
+# views.py. With Django 4.2 the queries still run one after the other on the request's
+# connection; gather() lets them overlap once the ORM runs them on an async driver.
+#
+# Templates must not touch the database from async code, so request.user is resolved first:
+# cache_catalog_page does it while building the page key, the other views call get_user().
+
+
+def require_safe(view):
+    # django.views.decorators.http only wraps sync views in Django 4.2
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _load_user(request):
+    # Resolves the lazy request.user (session and user queries), so rendering needs no database
+    request.user.is_authenticated
+    return request.user
+
+
+get_user = sync_to_async(_load_user)
+
+
+def not_found(model):
+    return Http404(f'No {model._meta.object_name} matches the given query.')
+
+
+@require_safe
+@cache_catalog_page('field', 'review')
+async def field_list(request):
+    fields = await akeyset_paginate(request, Field.objects.all(), ['id'])
+    return render(request, 'field/field_list.html', {'fields': fields, 'page': fields})
+
+
+field_detail_post = sync_to_async(FieldDetailView.as_view())
+
+
+async def field_detail(request, pk):
+    if request.method == 'POST':
+        return await field_detail_post(request, pk=pk)
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD', 'POST'])
+
+    async def reviewed():
+        user = await get_user(request)
+        return user.is_authenticated and await Review.objects.filter(user=user, field_id=pk).aexists()
+
+    field, has_reviewed = await asyncio.gather(
+        Field.objects.select_related('field_owner').filter(pk=pk).afirst(),
+        reviewed(),
+    )
+    if field is None:
+        raise not_found(Field)
+
+    is_authenticated = request.user.is_authenticated
+    context = {
+        'field': field,
+        # Anonymous users get no review form
+        'review_form': ReviewForm() if is_authenticated else None,
+        'has_reviewed': has_reviewed,
+        'is_authenticated': is_authenticated,
+        'field_owner': field.field_owner,
+    }
+    return render(request, FieldDetailView.template_name, context)
+
+
+@require_safe
+@cache_catalog_page('field:{pk}', 'review:{pk}')
+async def reviews(request, pk):
+    field, reviews = await asyncio.gather(
+        Field.objects.filter(pk=pk).afirst(),
+        akeyset_paginate(request, Review.objects.filter(field_id=pk).select_related('user'), ['-created_at', '-id']),
+    )
+    if field is None:
+        raise not_found(Field)
+    return render(request, 'review/reviews.html', {'field': field, 'reviews': reviews, 'page': reviews})
+
+
+@require_safe
+@cache_catalog_page('field:{pk}', 'event:{pk}')
+async def events_list(request, pk):
+    field, events_list = await asyncio.gather(
+        Field.objects.filter(pk=pk).afirst(),
+        akeyset_paginate(request, Event.objects.filter(field_id=pk), ['-date_published', '-id']),
+    )
+    if field is None:
+        raise not_found(Field)
+    return render(request, 'events/events_list.html', {'field': field, 'events_list': events_list, 'page': events_list})
+
+
+@require_safe
+@cache_catalog_page('field', 'event')
+async def all_events_list(request):
+    page = await akeyset_paginate(request, Event.objects.select_related('field'), ['-date_published', '-id'])
+    context = {'events_list': page.items, 'object_list': page.items, 'page': page, 'is_paginated': False}
+    return render(request, 'events/all_events_list.html', context)
+
+
+@require_safe
+@cache_catalog_page('field', 'review')
+async def field_list_by_sport(request, sport=None):
+    if sport:
+        # Match the stored spelling exactly so the (sport, id) index can be used
+        sport_value = {value.lower(): value for value, label in Field.SPORT_CHOICES}.get(sport.lower(), sport)
+        queryset = Field.objects.filter(sport=sport_value)
+    else:
+        queryset = Field.objects.all()
+    fields = await akeyset_paginate(request, queryset, ['id'])
+    context = {
+        'fields': fields,
+        'page': fields,
+        'selected_sport': sport,
+    }
+    return render(request, 'field/field_list_by_sport.html', context)
+
+
+@require_safe
+async def slot_events(request, pk, date):
+    # Server-sent events for the reservation form: the free hours of the field on the date,
+    # then every hour taken or freed (see live_slots.py)
+    try:
+        date = datetime.date.fromisoformat(date)
+    except ValueError:
+        raise Http404('Dates must be in YYYY-MM-DD format.')
+
+    hub = live_slots.get_hub()
+    # Subscribed before reading the free hours, so no change falls in between
+    queue = hub.subscribe(pk, date)
+    try:
+        hours = await live_slots.free_hours(pk, date)
+    except BaseException:
+        hub.unsubscribe(pk, date, queue)
+        raise
+    if hours is None:
+        hub.unsubscribe(pk, date, queue)
+        raise not_found(Field)
+
+    response = StreamingHttpResponse(live_slots.stream(hub, queue, pk, date, hours), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
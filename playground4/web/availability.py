@@ -0,0 +1,119 @@
+import datetime
+
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import FieldAvailability, SlotHold
+
+# Bookable hours are 16:00 - 21:00, every hour is one bit of FieldAvailability.booked_mask
+FIRST_HOUR = 16
+LAST_HOUR = 21
+HOURS = range(FIRST_HOUR, LAST_HOUR + 1)
+FULL_MASK = (1 << len(HOURS)) - 1
+
+
+def hour_bit(hour):
+    return 1 << (hour - FIRST_HOUR)
+
+
+def hours_mask(hours):
+    mask = 0
+    for hour in hours:
+        mask |= hour_bit(hour)
+    return mask
+
+
+def span_mask(hour, duration):
+    # Bits of the hours a booking of `duration` hours starting at `hour` takes
+    return hours_mask(range(hour, hour + duration))
+
+
+def mask_hours(mask):
+    return [hour for hour in HOURS if mask & hour_bit(hour)]
+
+
+def is_working_slot(field, date, hour, duration=1):
+    mask = span_mask(hour, duration)
+    return working_mask(field, date) & mask == mask
+
+
+def working_mask(field, date):
+    # Hours the field is open on the given date, from the schedule compiled onto the field
+    # (see opening_hours.py)
+    exception = field.opening_exception_masks.get(date.isoformat())
+    if exception is not None:
+        return exception
+    return (field.opening_mask >> date.weekday() * len(HOURS)) & FULL_MASK
+
+
+def mark_booked(field_id, date, hour, duration=1):
+    mark_booked_many(field_id, [(date, hour + offset) for offset in range(duration)])
+
+
+def mark_booked_many(field_id, slots):
+    masks = {}
+    for date, hour in slots:
+        masks[date] = masks.get(date, 0) | hour_bit(hour)
+    # Two queries for any number of dates: make sure the rows exist, then set the bits
+    FieldAvailability.objects.bulk_create(
+        [FieldAvailability(field_id=field_id, date=date) for date in masks],
+        ignore_conflicts=True,
+    )
+    FieldAvailability.objects.filter(field_id=field_id, date__in=masks).update(
+        booked_mask=Case(
+            *[When(date=date, then=F('booked_mask').bitor(mask)) for date, mask in masks.items()],
+            default=F('booked_mask'),
+            output_field=FieldAvailability._meta.get_field('booked_mask'),
+        )
+    )
+
+
+def mark_freed(field_id, date, hour, duration=1):
+    FieldAvailability.objects.filter(field_id=field_id, date=date).update(
+        booked_mask=F('booked_mask').bitand(FULL_MASK ^ span_mask(hour, duration))
+    )
+
+
+def booked_masks(field, start_date, end_date):
+    # One query for the whole range, dates without a row have nothing booked
+    return dict(
+        FieldAvailability.objects.filter(
+            field=field,
+            date__range=(start_date, end_date),
+        ).values_list('date', 'booked_mask')
+    )
+
+
+def taken_masks(field, start_date, end_date, user=None):
+    # booked_masks() plus the slots held by users other than `user` (see holds.py), still one query
+    held = SlotHold.objects.filter(field=field, hold_date__range=(start_date, end_date), expires_at__gt=timezone.now())
+    if user is not None and user.pk is not None:
+        held = held.exclude(user=user)
+    rows = FieldAvailability.objects.filter(
+        field=field,
+        date__range=(start_date, end_date),
+    ).values_list('date', 'booked_mask').union(
+        held.annotate(mask=Value(1).bitleftshift(F('hold_hour') - FIRST_HOUR)).values_list('hold_date', 'mask'),
+        all=True,
+    )
+    masks = {}
+    for date, mask in rows:
+        masks[date] = masks.get(date, 0) | mask
+    return masks
+
+
+def is_slot_free(field, date, hour):
+    booked = FieldAvailability.objects.filter(field=field, date=date).values_list('booked_mask', flat=True).first()
+    return not (booked or 0) & hour_bit(hour)
+
+
+def free_slots(field, start_date, end_date, user=None):
+    # Held slots aren't free, except for the user holding them
+    booked = taken_masks(field, start_date, end_date, user)
+    slots = []
+    date = start_date
+    while date <= end_date:
+        free_mask = working_mask(field, date) & ~booked.get(date, 0)
+        slots.append({'date': date, 'free_hours': mask_hours(free_mask)})
+        date += datetime.timedelta(days=1)
+    return slots
@@ -0,0 +1,130 @@
+from django.contrib.postgres.fields import BigIntegerRangeField
+from django.db import IntegrityError, transaction
+from django.db.models import F, Func, Q, Value
+from django.utils import timezone
+
+from . import availability, holds, live_slots, rollups
+from .models import Reservation, SlotHold, reservation_period
+
+MAX_SLOTS_PER_BOOKING = 60
+RESERVED = "This hour is already reserved."
+
+
+def one_value_range(value):
+    # Field ids are compared as int8range(id, id, '[]') in the exclusion constraints, as there
+    # is no btree_gist for plain integers
+    return Func(value, value, Value('[]'), function='int8range', output_field=BigIntegerRangeField())
+
+
+# Leads each partition's exclusion constraint. Filtering on it, the date and the period makes
+# an overlap check one probe of that constraint's GiST index in a single partition, however
+# long the bookings are.
+FIELD_RANGE = one_value_range(F('field_id'))
+
+
+class SlotAlreadyReserved(Exception):
+    pass
+
+
+class SlotConflicts(Exception):
+    def __init__(self, conflicts):
+        # {(date, hour): reason} for every slot that can't be booked
+        self.conflicts = conflicts
+        super().__init__(conflicts)
+
+
+def overlapping(field_id, date, hour, duration=1):
+    # Reservations taking any of the hours
+    return Reservation.objects.annotate(field_range=FIELD_RANGE).filter(
+        field_range__overlap=one_value_range(Value(field_id)),
+        reservation_date=date,
+        period__overlap=reservation_period(date, hour, duration),
+    )
+
+
+def spans(slots):
+    # [(date, first hour, duration)] of the runs of consecutive hours in [(date, hour)]
+    result = []
+    for date, hour in sorted(set(slots)):
+        if result and result[-1][0] == date and result[-1][1] + result[-1][2] == hour:
+            result[-1] = (date, result[-1][1], result[-1][2] + 1)
+        else:
+            result.append((date, hour, 1))
+    return result
+
+
+def book_slot(reservation, held=False):
+    # The exclusion constraint decides between concurrent bookings, so there is no
+    # check-then-insert window and no lock held longer than the insert itself.
+    # `held`: the user holds the hours, the hold turns into the reservation atomically.
+    try:
+        with transaction.atomic():
+            reservation.save()
+            if held:
+                holds.release_hold(
+                    reservation.user_id, reservation.field_id, reservation.reservation_date,
+                    reservation.reservation_hour, reservation.duration,
+                )
+    except IntegrityError:
+        if overlapping(
+            reservation.field_id, reservation.reservation_date, reservation.reservation_hour, reservation.duration,
+        ).exists():
+            raise SlotAlreadyReserved
+        raise
+    return reservation
+
+
+def taken_slots(field, slots, user):
+    # {(date, hour): reason} of the requested slots that are reserved or held by another user,
+    # one set-based query for all of them
+    reserved, held = Q(), Q()
+    for date, hour, duration in spans(slots):
+        reserved |= Q(reservation_date=date, period__overlap=reservation_period(date, hour, duration))
+        held |= Q(hold_date=date, hold_hour__range=(hour, hour + duration - 1))
+    rows = Reservation.objects.annotate(field_range=FIELD_RANGE).filter(
+        reserved, field_range__overlap=one_value_range(Value(field.pk)),
+    ).values_list(
+        'reservation_date', 'reservation_hour', 'duration', Value(RESERVED),
+    ).union(
+        SlotHold.objects.filter(held, field=field, expires_at__gt=timezone.now()).exclude(user=user).values_list(
+            'hold_date', 'hold_hour', Value(1), Value("Somebody else is booking this hour."),
+        ),
+        all=True,
+    )
+    requested = set(slots)
+    taken = {}
+    for date, first_hour, duration, reason in rows:
+        for hour in range(first_hour, first_hour + duration):
+            # A reservation outranks a hold that was left behind on the slot
+            if (date, hour) in requested and taken.get((date, hour)) != RESERVED:
+                taken[(date, hour)] = reason
+    return taken
+
+
+def book_slots(user, field, slots):
+    # All slots are booked or none is, every failing slot is reported in SlotConflicts
+    slots = sorted(set(slots))
+    conflicts = {
+        slot: "Reservations are only allowed during working days and hours."
+        for slot in slots if not availability.is_working_slot(field, *slot)
+    }
+    conflicts.update(taken_slots(field, slots, user))
+    if conflicts:
+        raise SlotConflicts(conflicts)
+
+    # Consecutive hours on a date become one reservation
+    reservations = [
+        Reservation(user=user, field=field, reservation_date=date, reservation_hour=hour, duration=duration)
+        for date, hour, duration in spans(slots)
+    ]
+    try:
+        with transaction.atomic():
+            Reservation.objects.bulk_create(reservations)
+            # bulk_create skips the post_save signals that maintain the index and rollups
+            availability.mark_booked_many(field.pk, slots)
+            rollups.add_bookings(field.pk, [date for date, hour in slots])
+            live_slots.publish(field.pk, live_slots.TAKEN, slots)
+    except IntegrityError:
+        # Lost a race for some of the slots
+        raise SlotConflicts(taken_slots(field, slots, user))
+    return reservations
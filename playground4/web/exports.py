@@ -0,0 +1,47 @@
+import csv
+
+from django.http import StreamingHttpResponse
+
+from .models import Reservation
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 2000
+
+RESERVATION_COLUMNS = ['reservation', 'field', 'user', 'date', 'hour', 'duration', 'price_per_hour']
+
+
+class Echo:
+    # csv.writer needs a file; this one hands every formatted line back instead of storing it
+    def write(self, value):
+        return value
+
+
+def reservation_rows(reservations):
+    # Plain tuples straight from a server-side cursor, so memory stays flat however many rows there are
+    return reservations.order_by('reservation_date', 'reservation_hour', 'id').values_list(
+        'pk', 'field__name', 'user__username', 'reservation_date', 'reservation_hour', 'duration', 'field__price_per_hour',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def owner_reservations(owner, start_date, end_date, field=None):
+    reservations = Reservation.objects.filter(
+        field__field_owner=owner,
+        reservation_date__range=(start_date, end_date),
+    )
+    if field is not None:
+        reservations = reservations.filter(field=field)
+    return reservations
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def reservations_csv_response(reservations, filename):
+    # The first bytes go out before the query has even run
+    response = StreamingHttpResponse(csv_lines(RESERVATION_COLUMNS, reservation_rows(reservations)), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
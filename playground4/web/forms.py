@@ -1,7 +1,10 @@
 
+import datetime
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
-from .models import User, Field, Reservation, Review, Event
+from . import booking
+from .models import User, Field, Reservation, Review, Event, OpeningHours, OpeningException
 
 
 class RegistrationForm(UserCreationForm):
@@ -31,14 +34,122 @@ class FieldForm(forms.ModelForm):
         fields = ['name', 'location', 'sport', 'description', 'image_url', 'start_working_day', 'start_working_hour', 'end_working_day', 'end_working_hour']
 
 
+# The hours of weekdays that differ from the field's usual week, and of single dates; leaving
+# both hours empty closes the field that day
+OpeningHoursFormSet = forms.inlineformset_factory(
+    Field, OpeningHours, fields=['weekday', 'start_hour', 'end_hour'], extra=1, max_num=7,
+)
+OpeningExceptionFormSet = forms.inlineformset_factory(
+    Field, OpeningException, fields=['date', 'start_hour', 'end_hour', 'reason'], extra=1,
+    widgets={'date': forms.DateInput(attrs={'type': 'date'})},
+)
+
+
 class ReservationForm(forms.ModelForm):
     class Meta:
         model = Reservation
-        fields = ['reservation_date', 'reservation_hour']
+        fields = ['reservation_date', 'reservation_hour', 'duration']
         widgets = {
             'reservation_date': forms.DateInput(attrs={'type': 'date'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # One hour unless chosen otherwise
+        self.fields['duration'].required = False
+
+    def clean_duration(self):
+        return self.cleaned_data['duration'] or 1
+
+class RecurringReservationForm(forms.Form):
+    HOUR_CHOICES = [(hour, f'{hour}:00') for hour in range(16, 22)]
+
+    start_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    weeks = forms.IntegerField(min_value=1, max_value=52, initial=1, required=False, help_text='Repeat every week on the same day')
+    hours = forms.TypedMultipleChoiceField(choices=HOUR_CHOICES, coerce=int, required=False, widget=forms.CheckboxSelectMultiple)
+    slots = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'rows': 4, 'placeholder': '2023-07-25 18'}),
+        help_text='Or list one slot per line as "YYYY-MM-DD HH"',
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.errors:
+            return cleaned_data
+
+        if cleaned_data.get('slots'):
+            slots = self.parse_slots(cleaned_data['slots'])
+        elif cleaned_data.get('start_date') and cleaned_data.get('hours'):
+            slots = [
+                (cleaned_data['start_date'] + datetime.timedelta(weeks=week), hour)
+                for week in range((cleaned_data.get('weeks') or 1))
+                for hour in cleaned_data['hours']
+            ]
+        else:
+            raise forms.ValidationError('Pick a start date and hours, or list the slots to book.')
+
+        if len(set(slots)) > booking.MAX_SLOTS_PER_BOOKING:
+            raise forms.ValidationError(f'You can book up to {booking.MAX_SLOTS_PER_BOOKING} slots at once.')
+        cleaned_data['slot_list'] = slots
+        return cleaned_data
+
+    def parse_slots(self, text):
+        slots = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                date, hour = line.split()
+                slot = (datetime.date.fromisoformat(date), int(hour))
+            except ValueError:
+                raise forms.ValidationError(f'"{line.strip()}" is not a "YYYY-MM-DD HH" slot.')
+            if slot[1] not in range(16, 22):
+                raise forms.ValidationError(f'"{line.strip()}": hours go from 16 to 21.')
+            slots.append(slot)
+        return slots
+
+
+class FieldSearchForm(forms.Form):
+    q = forms.CharField(required=False, max_length=200, label='Search')
+    sport = forms.ChoiceField(choices=[('', 'Any sport')] + Field.SPORT_CHOICES, required=False)
+    min_price = forms.IntegerField(required=False, min_value=0, label='Min price per hour')
+    max_price = forms.IntegerField(required=False, min_value=0, label='Max price per hour')
+
+
+class FreeFieldSearchForm(forms.Form):
+    HOUR_CHOICES = [(hour, f'{hour}:00') for hour in range(16, 22)]
+
+    sport = forms.ChoiceField(choices=Field.SPORT_CHOICES)
+    date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    hour_from = forms.TypedChoiceField(choices=HOUR_CHOICES, coerce=int, label='From')
+    hour_to = forms.TypedChoiceField(choices=[('', 'One hour')] + HOUR_CHOICES, coerce=int, empty_value=None, required=False, label='To')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        hour_from, hour_to = cleaned_data.get('hour_from'), cleaned_data.get('hour_to')
+        if hour_from is not None and hour_to is not None and hour_to < hour_from:
+            raise forms.ValidationError('The last hour must not be before the first one.')
+        return cleaned_data
+
+
+class ReservationExportForm(forms.Form):
+    start_date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    end_date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    field = forms.ModelChoiceField(queryset=Field.objects.none(), required=False, empty_label='All my fields')
+
+    def __init__(self, owner, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['field'].queryset = Field.objects.filter(field_owner=owner).order_by('name')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date, end_date = cleaned_data.get('start_date'), cleaned_data.get('end_date')
+        if start_date and end_date and end_date < start_date:
+            raise forms.ValidationError('The end date must not be before the start date.')
+        return cleaned_data
+
+
 class ReviewForm(forms.ModelForm):
     class Meta:
         model = Review
@@ -47,5 +158,5 @@ class ReviewForm(forms.ModelForm):
 class EventForm(forms.ModelForm):
     class Meta:
         model = Event
-        fields = ['title', 'sport', 'content', 'image', 'event_date', 'entry_fee']
+        fields = ['title', 'sport', 'content', 'image', 'event_date', 'entry_fee', 'max_sign_ups']
 
@@ -0,0 +1,124 @@
+import datetime
+
+from django.conf import settings
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from . import availability, live_slots
+from .models import Field, FieldAvailability, SlotHold
+
+# A user leases the hours of one booking at a time for SLOT_HOLD_SECONDS while filling in the
+# reservation form. Other users can't book or hold them meanwhile; booking them turns the hold
+# into the reservation (booking.book_slot). Expired holds are ignored right away and deleted in
+# bulk by sweep().
+TABLE = SlotHold._meta.db_table
+AVAILABILITY_TABLE = FieldAvailability._meta.db_table
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+def slot_state(field, date, hour, duration=1, now=None):
+    # (any of the hours booked, ids of the users holding any of them) in one query probing the
+    # availability and hold unique indexes, so checking holds costs the booking path no extra
+    # round trip
+    now = now or timezone.now()
+    day_mask, holders = Field.objects.filter(pk=field.pk).annotate(
+        day_mask=Subquery(FieldAvailability.objects.filter(field=OuterRef('pk'), date=date).values('booked_mask')),
+        holders=ArraySubquery(
+            SlotHold.objects.filter(
+                field=OuterRef('pk'), hold_date=date, hold_hour__range=(hour, hour + duration - 1), expires_at__gt=now,
+            ).values('user')
+        ),
+    ).values_list('day_mask', 'holders').get()
+    return bool((day_mask or 0) & availability.span_mask(hour, duration)), set(holders)
+
+
+def publish_freed(slots):
+    # [(field_id, date, hour)]
+    by_field = {}
+    for field_id, date, hour in slots:
+        by_field.setdefault(field_id, []).append((date, hour))
+    for field_id, field_slots in by_field.items():
+        live_slots.publish(field_id, live_slots.FREED, field_slots)
+
+
+def hold_slot(user, field, date, hour, duration=1, now=None):
+    # Returns when the hold ends. Holding the hours again extends the hold, holding other ones
+    # releases those no longer wanted.
+    now = now or timezone.now()
+    if not availability.is_working_slot(field, date, hour, duration):
+        raise SlotUnavailable("Reservations are only allowed during working days and hours.")
+    expires_at = now + datetime.timedelta(seconds=settings.SLOT_HOLD_SECONDS)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {TABLE}
+            WHERE user_id = %s AND NOT (field_id = %s AND hold_date = %s AND hold_hour BETWEEN %s AND %s)
+            RETURNING field_id, hold_date, hold_hour, expires_at > %s
+            """,
+            [user.pk, field.pk, date, hour, hour + duration - 1, now],
+        )
+        released = [(field_id, date, hour) for field_id, date, hour, active in cursor.fetchall() if active]
+
+        # One statement decides between users holding or booking the hours at the same time:
+        # no row comes back for an hour somebody else's unexpired hold has, none at all when
+        # any of them is booked
+        cursor.execute(
+            f"""
+            INSERT INTO {TABLE} (field_id, hold_date, hold_hour, user_id, expires_at)
+            SELECT %s, %s, hour, %s, %s FROM generate_series(%s, %s) AS hour
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {AVAILABILITY_TABLE}
+                WHERE field_id = %s AND date = %s AND (booked_mask & %s) <> 0
+            )
+            ON CONFLICT (field_id, hold_date, hold_hour) DO UPDATE
+                SET user_id = EXCLUDED.user_id, expires_at = EXCLUDED.expires_at
+                WHERE {TABLE}.user_id = EXCLUDED.user_id OR {TABLE}.expires_at <= %s
+            RETURNING id
+            """,
+            [
+                field.pk, date, user.pk, expires_at, hour, hour + duration - 1,
+                field.pk, date, availability.span_mask(hour, duration), now,
+            ],
+        )
+        if len(cursor.fetchall()) < duration:
+            # Rolls back, which also keeps the previous hold
+            raise SlotUnavailable("This hour is already reserved or being booked by someone else.")
+
+        publish_freed(released)
+        live_slots.publish(field.pk, live_slots.TAKEN, [(date, hour + offset) for offset in range(duration)])
+    return expires_at
+
+
+def release_hold(user_id, field_id, date, hour, duration=1):
+    SlotHold.objects.filter(
+        user_id=user_id, field_id=field_id, hold_date=date, hold_hour__range=(hour, hour + duration - 1),
+    ).delete()
+
+
+def sweep(now=None):
+    # Deletes every expired hold in one statement and tells the open reservation forms about the
+    # slots that became free, i.e. weren't booked in the meantime. Returns the number deleted.
+    now = now or timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH expired AS (
+                DELETE FROM {TABLE} WHERE expires_at <= %s RETURNING field_id, hold_date, hold_hour
+            )
+            SELECT expired.field_id, expired.hold_date, expired.hold_hour,
+                (coalesce(availability.booked_mask, 0) & (1 << (expired.hold_hour - %s))) = 0
+            FROM expired
+            LEFT JOIN {AVAILABILITY_TABLE} availability
+                ON availability.field_id = expired.field_id AND availability.date = expired.hold_date
+            """,
+            [now, availability.FIRST_HOUR],
+        )
+        rows = cursor.fetchall()
+        publish_freed([(field_id, date, hour) for field_id, date, hour, free in rows if free])
+    return len(rows)
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections
+
+from . import availability
+from .models import Field
+
+logger = logging.getLogger(__name__)
+
+# Slot changes reach the reservation forms watching a field and date: every booking or
+# cancellation sends one NOTIFY on CHANNEL, each server process LISTENs on one connection and
+# fans the changes out to its open streams (async_views.slot_events).
+CHANNEL = 'slot_events'
+TAKEN = 'taken'
+FREED = 'freed'
+# Asks a stream to send the free hours again, after it may have missed changes
+RESYNC = 'resync'
+
+# Changes a stream may have waiting before it falls back to a resync
+QUEUE_SIZE = 32
+RECONNECT_SECONDS = 5
+# Milliseconds the browser waits before reconnecting a stream that ended
+RETRY_MS = 2000
+
+
+def publish(field_id, event, slots):
+    # Sent within the transaction: Postgres delivers it on commit and drops it on rollback
+    payload = {'field': field_id, 'event': event, 'slots': sorted([str(date), hour] for date, hour in slots)}
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, json.dumps(payload)])
+
+
+def open_listener():
+    # A connection of its own, outside Django's per-thread connections, as it outlives requests
+    wrapper = connections.create_connection(DEFAULT_DB_ALIAS)
+    with wrapper.wrap_database_errors:
+        listener = wrapper.get_new_connection(wrapper.get_connection_params())
+        listener.autocommit = True
+        with listener.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+    return listener
+
+
+class SlotHub:
+    # Streams of one event loop, i.e. one server process. A stream costs a queue, the process
+    # holds one LISTEN connection however many streams are open.
+    def __init__(self):
+        self.streams = {}  # (field_id, 'YYYY-MM-DD') -> set of queues
+        self.listener = None
+
+    def subscribe(self, field_id, date):
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(self.listen())
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self.streams.setdefault((field_id, date.isoformat()), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, field_id, date, queue):
+        key = (field_id, date.isoformat())
+        queues = self.streams.get(key, set())
+        queues.discard(queue)
+        if not queues:
+            self.streams.pop(key, None)
+
+    def put(self, queue, change):
+        try:
+            queue.put_nowait(change)
+        except asyncio.QueueFull:
+            # A stream this far behind starts over from the current free hours
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait((RESYNC, []))
+
+    def deliver(self, payload):
+        message = json.loads(payload)
+        hours_by_date = {}
+        for date, hour in message['slots']:
+            hours_by_date.setdefault(date, []).append(hour)
+        for date, hours in hours_by_date.items():
+            for queue in self.streams.get((message['field'], date), ()):
+                self.put(queue, (message['event'], hours))
+
+    def resync(self):
+        for queues in self.streams.values():
+            for queue in queues:
+                self.put(queue, (RESYNC, []))
+
+    async def listen(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                listener = await sync_to_async(open_listener, thread_sensitive=False)()
+            except DatabaseError:
+                logger.warning('Could not listen for slot events, retrying in %s seconds', RECONNECT_SECONDS)
+                await asyncio.sleep(RECONNECT_SECONDS)
+                continue
+
+            readable = asyncio.Event()
+            loop.add_reader(listener.fileno(), readable.set)
+            try:
+                # Covers the changes sent before the connection was listening
+                self.resync()
+                while True:
+                    await readable.wait()
+                    readable.clear()
+                    listener.poll()
+                    while listener.notifies:
+                        self.deliver(listener.notifies.pop(0).payload)
+            except connection.Database.Error:
+                logger.warning('Lost the slot events connection, reconnecting in %s seconds', RECONNECT_SECONDS)
+            finally:
+                loop.remove_reader(listener.fileno())
+                listener.close()
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+            self.listener = None
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = SlotHub()
+    return _hubs[loop]
+
+
+def _free_hours(field_id, date):
+    # None for an unknown field
+    try:
+        field = Field.objects.filter(pk=field_id).first()
+        return None if field is None else availability.free_slots(field, date, date)[0]['free_hours']
+    finally:
+        # Streams stay open for minutes, they must not hold a database connection meanwhile
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+free_hours = sync_to_async(_free_hours)
+
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def stream(hub, queue, field_id, date, hours):
+    # Django 4.2 doesn't tell a streaming view that the client left, so a stream ends after
+    # SLOT_EVENTS_STREAM_SECONDS and the browser opens a new one
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.SLOT_EVENTS_STREAM_SECONDS
+    try:
+        yield f'retry: {RETRY_MS}\n' + sse('free', {'hours': hours})
+        while loop.time() < deadline:
+            try:
+                event, hours = await asyncio.wait_for(queue.get(), min(settings.SLOT_EVENTS_HEARTBEAT, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield ': heartbeat\n\n'
+                continue
+            if event == RESYNC:
+                hours = await free_hours(field_id, date)
+                if hours is None:
+                    return
+                yield sse('free', {'hours': hours})
+            else:
+                yield sse(event, {'hours': hours})
+    finally:
+        hub.unsubscribe(field_id, date, queue)
@@ -0,0 +1,116 @@
+import datetime
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from playground4.web.models import Field
+from playground4.web.opening_hours import compile_field
+from playground4.web.rollups import rebuild_rollups
+from playground4.web.search import free_fields
+
+User = get_user_model()
+
+BENCH_OWNER = 'bench-owner'
+
+
+class Command(BaseCommand):
+    help = 'Times the "free at a given date and hour" field search, optionally seeding a large synthetic catalog first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Insert the synthetic catalog before measuring')
+        parser.add_argument('--fields', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=90, help='Days of reservations per field, starting today')
+        parser.add_argument('--fill', type=float, default=0.6, help='Share of slots that are reserved')
+        parser.add_argument('--runs', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The benchmark seeds data with PostgreSQL generate_series().')
+
+        if options['seed']:
+            self.seed(options['fields'], options['days'], options['fill'])
+
+        today = datetime.date.today()
+        sports = [value for value, label in Field.SPORT_CHOICES]
+        timings = []
+        for run in range(options['runs']):
+            sport = random.choice(sports)
+            date = today + datetime.timedelta(days=random.randrange(options['days']))
+            hour_from = random.randint(16, 21)
+            hour_to = random.randint(hour_from, 21)
+            started = time.perf_counter()
+            list(free_fields(sport, date, hour_from, hour_to).values_list('pk', flat=True)[:20])
+            timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        self.stdout.write(
+            f'{options["runs"]} searches: '
+            f'p50 {statistics.median(timings):.2f} ms, '
+            f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, '
+            f'max {timings[-1]:.2f} ms'
+        )
+        self.stdout.write(free_fields('Football', today, 18, 20).explain(analyze=True))
+
+    @transaction.atomic
+    def seed(self, field_count, days, fill):
+        owner, created = User.objects.get_or_create(username=BENCH_OWNER, defaults={'email': 'bench-owner@example.com'})
+        sports = [value for value, label in Field.SPORT_CHOICES]
+        fields = [
+            Field(
+                field_owner=owner,
+                name=f'Bench field {number}',
+                location=f'Town {number % 500}',
+                sport=sports[number % len(sports)],
+                description='Synthetic benchmark field',
+                price_per_hour=10 + number % 40,
+                start_working_day=1 + number % 3,
+                end_working_day=5 + number % 3,
+                start_working_hour=16 + number % 2,
+                end_working_hour=21 - number % 2,
+            )
+            for number in range(field_count)
+        ]
+        # bulk_create sends no pre_save signal
+        for field in fields:
+            compile_field(field)
+        Field.objects.bulk_create(fields, batch_size=2000)
+
+        with connection.cursor() as cursor:
+            # Set-based inserts, millions of reservations would take far too long through the ORM
+            cursor.execute(
+                """
+                INSERT INTO web_reservation (user_id, field_id, reservation_date, reservation_hour, duration, period)
+                SELECT %s, field.id, CURRENT_DATE + day, hour, 1, tstzrange(
+                    (CURRENT_DATE + day + make_interval(hours => hour)) AT TIME ZONE %s,
+                    (CURRENT_DATE + day + make_interval(hours => hour + 1)) AT TIME ZONE %s
+                )
+                FROM web_field field
+                CROSS JOIN generate_series(0, %s - 1) AS day
+                CROSS JOIN generate_series(16, 21) AS hour
+                WHERE field.field_owner_id = %s AND random() < %s
+                ON CONFLICT DO NOTHING
+                """,
+                [owner.pk, *[timezone.get_current_timezone_name()] * 2, days, owner.pk, fill],
+            )
+            reservations = cursor.rowcount
+            cursor.execute(
+                """
+                INSERT INTO web_fieldavailability (field_id, date, booked_mask)
+                SELECT reservation.field_id, reservation.reservation_date, bit_or(((1 << reservation.duration) - 1) << (reservation.reservation_hour - 16))
+                FROM web_reservation reservation
+                JOIN web_field field ON field.id = reservation.field_id
+                WHERE field.field_owner_id = %s
+                GROUP BY reservation.field_id, reservation.reservation_date
+                ON CONFLICT (field_id, date) DO UPDATE SET booked_mask = EXCLUDED.booked_mask
+                """,
+                [owner.pk],
+            )
+            cursor.execute('ANALYZE web_field; ANALYZE web_reservation;')
+        rebuild_rollups(Field.objects.filter(field_owner=owner))
+
+        self.stdout.write(f'Seeded {field_count} fields and {reservations} reservations.')
@@ -0,0 +1,189 @@
+import http.client
+import importlib.util
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from playground4.web.management.commands.benchmark_views import git_commit, percentile
+from playground4.web.models import Field
+
+User = get_user_model()
+
+HOST = '127.0.0.1'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f'The server exited with code {process.returncode} before accepting connections.')
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError(f'The server did not accept connections on port {port} within {timeout} seconds.')
+
+
+class Command(BaseCommand):
+    help = 'Compares requests per second and latency of the hot read views under gunicorn (WSGI) and uvicorn (ASGI) and writes a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='gen', help='Prefix the dataset was generated with')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per server')
+        parser.add_argument('--concurrency', type=int, default=16, help='Clients sending requests at the same time')
+        parser.add_argument('--workers', type=int, default=2, help='Server processes')
+        parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+        parser.add_argument('--warm-cache', action='store_true', help='Let the servers answer from cached catalog pages')
+        parser.add_argument('--output', default='benchmark-servers.json')
+
+    def handle(self, *args, **options):
+        for module in ('gunicorn', 'uvicorn'):
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f'{module} is not installed, see requirments.txt.')
+
+        prefix = options['prefix']
+        field = Field.objects.filter(field_owner__username__startswith=f'{prefix}-owner-').order_by('id').first()
+        player = User.objects.filter(username__startswith=f'{prefix}-user-').order_by('id').first()
+        if field is None or player is None:
+            raise CommandError(f'No dataset with prefix "{prefix}", run generate_dataset first.')
+
+        # The servers find the session in the database
+        client = Client()
+        client.force_login(player)
+        cookie = '; '.join(f'{morsel.key}={morsel.value}' for morsel in client.cookies.values())
+        urls = [
+            reverse('field_list'),
+            reverse('field_detail', kwargs={'pk': field.pk}),
+            reverse('reviews', kwargs={'pk': field.pk}),
+            reverse('events_list', kwargs={'pk': field.pk}),
+            reverse('all_events_list'),
+            reverse('field_list_by_sport', kwargs={'sport': field.sport.lower()}),
+        ]
+
+        self.options = options
+        results = {}
+        for name, command in (
+            ('wsgi', [
+                '-m', 'gunicorn', 'playground4.wsgi:application', '--bind', f'{HOST}:{{port}}',
+                '--workers', str(options['workers']), '--threads', str(options['threads']), '--log-level', 'warning',
+            ]),
+            ('asgi', [
+                '-m', 'uvicorn', 'playground4.asgi:application', '--host', HOST, '--port', '{port}',
+                '--workers', str(options['workers']), '--log-level', 'warning', '--no-access-log',
+            ]),
+        ):
+            results[name] = self.run_server(command, urls, cookie)
+            result = results[name]
+            self.stdout.write(
+                f'{name:<6} {result["requests_per_second"]:8.1f} req/s  p50 {result["p50_ms"]:8.2f} ms  '
+                f'p99 {result["p99_ms"]:8.2f} ms  errors {result["errors"]}'
+            )
+
+        report = {
+            'commit': git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'urls': urls,
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'workers': options['workers'],
+            'threads': options['threads'],
+            'warm_cache': options['warm_cache'],
+            'servers': results,
+        }
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}.'))
+
+    def run_server(self, command, urls, cookie):
+        port = free_port()
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='playground4.settings')
+        # asgi.py switches the async views on for uvicorn, gunicorn serves the sync ones
+        env.pop('ASYNC_VIEWS', None)
+        process = subprocess.Popen(
+            [sys.executable] + [part.format(port=port) for part in command], cwd=settings.BASE_DIR, env=env,
+        )
+        try:
+            wait_for_port(port, process)
+            # One pass over the URLs so every worker has imported and connected
+            self.load(port, urls, cookie, len(urls) * self.options['workers'], 1)
+            return self.load(port, urls, cookie, self.options['requests'], self.options['concurrency'])
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def load(self, port, urls, cookie, total, concurrency):
+        # Keep-alive clients taking the next URL until `total` requests were sent. Without
+        # --warm-cache every URL gets a unique query string, so the page cache never answers.
+        numbers = itertools.count()
+        lock = threading.Lock()
+        timings, errors = [], []
+        warm_cache = self.options['warm_cache']
+
+        def client():
+            connection = http.client.HTTPConnection(HOST, port, timeout=30)
+            try:
+                while True:
+                    with lock:
+                        number = next(numbers)
+                    if number >= total:
+                        return
+                    url = urls[number % len(urls)]
+                    if not warm_cache:
+                        url = f'{url}?r={number}'
+                    started = time.perf_counter()
+                    try:
+                        connection.request('GET', url, headers={'Cookie': cookie})
+                        response = connection.getresponse()
+                        response.read()
+                        status = response.status
+                    except (OSError, http.client.HTTPException):
+                        connection.close()
+                        status = None
+                    elapsed = (time.perf_counter() - started) * 1000
+                    with lock:
+                        if status == 200:
+                            timings.append(elapsed)
+                        else:
+                            errors.append(status)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+
+        timings.sort()
+        if not timings:
+            raise CommandError(f'Every request failed, statuses: {sorted(set(errors), key=str)}.')
+        return {
+            'requests': len(timings) + len(errors),
+            'errors': len(errors),
+            'seconds': round(duration, 3),
+            'requests_per_second': round(len(timings) / duration, 1),
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'max_ms': round(timings[-1], 3),
+        }
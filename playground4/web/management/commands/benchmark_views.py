@@ -0,0 +1,218 @@
+import datetime
+import json
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from playground4.web import availability
+from playground4.web.models import Event, Field, Reservation, Review, UserEventRegistration
+from playground4.web.query_budget import count_queries
+
+User = get_user_model()
+
+
+def percentile(ordered, share):
+    # Nearest rank
+    return ordered[max(int(round(share * len(ordered))) - 1, 0)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Measures latency percentiles and query counts of the hot views against a generate_dataset dataset and writes a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='gen', help='Prefix the dataset was generated with')
+        parser.add_argument('--runs', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--warm-cache', action='store_true', help='Keep cached catalog pages between runs')
+        parser.add_argument('--output', default='benchmark-report.json')
+        parser.add_argument('--compare', help='An earlier report to print the differences against')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        field = Field.objects.filter(field_owner__username__startswith=f'{prefix}-owner-').select_related('field_owner').order_by('id').first()
+        player = User.objects.filter(username__startswith=f'{prefix}-user-').order_by('id').first()
+        if field is None or player is None:
+            raise CommandError(f'No dataset with prefix "{prefix}", run generate_dataset first.')
+
+        self.options = options
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            results = {
+                'field_list': self.measure(player, lambda run: ('get', reverse('field_list'), None)),
+                'field_detail': self.measure(player, lambda run: ('get', reverse('field_detail', kwargs={'pk': field.pk}), None)),
+                'reservation_create': self.measure_booking(player, field),
+                'field_schedule': self.measure(field.field_owner, lambda run: ('get', reverse('field_schedule', kwargs={'field_id': field.pk}), None)),
+                'all_events_list': self.measure(player, lambda run: ('get', reverse('all_events_list'), None)),
+                'schedule': self.measure(player, lambda run: ('get', reverse('schedule'), None)),
+            }
+            if connection.in_atomic_block:
+                # Closing the connection after every request would end the transaction
+                self.stdout.write('Inside a transaction, skipping the connection reuse views.')
+            else:
+                results.update(self.measure_connection_reuse(player))
+
+        report = {
+            'commit': git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'database': {
+                'vendor': connection.vendor,
+                'rows': {
+                    model.__name__: model.objects.count()
+                    for model in (User, Field, Reservation, Review, Event, UserEventRegistration)
+                },
+            },
+            'runs': options['runs'],
+            'warm_cache': options['warm_cache'],
+            'views': results,
+        }
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<28} p50 {result["p50_ms"]:8.2f} ms  p95 {result["p95_ms"]:8.2f} ms  '
+                f'max {result["max_ms"]:8.2f} ms  queries {result["queries"]}'
+            )
+        if options['compare']:
+            self.compare(options['compare'], results)
+        self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}.'))
+
+    def measure(self, user, request_for, runs=None, send=None):
+        # request_for(run) -> (method, url, data); send(method, url, data) -> status code
+        runs = self.options['runs'] if runs is None else runs
+        if send is None:
+            client = Client()
+            client.force_login(user)
+
+            def send(method, url, data):
+                return getattr(client, method)(url, data).status_code
+
+        timings, queries, statuses = [], [], set()
+        for run in range(-self.options['warmup'], runs):
+            method, url, data = request_for(run)
+            if not self.options['warm_cache']:
+                cache.clear()
+            with count_queries() as counter:
+                started = time.perf_counter()
+                status = send(method, url, data)
+                elapsed = (time.perf_counter() - started) * 1000
+            if run >= 0:
+                timings.append(elapsed)
+                queries.append(counter.count)
+                statuses.add(status)
+
+        timings.sort()
+        return {
+            'runs': len(timings),
+            'statuses': sorted(statuses),
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'max_ms': round(timings[-1], 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'queries': max(queries),
+        }
+
+    def measure_booking(self, user, field):
+        # Every run books another slot of a field of its own and commits it, as the COMMIT and
+        # its WAL flush are most of what a booking costs; the field and its bookings are deleted
+        # afterwards
+        scratch = Field.objects.create(
+            field_owner=field.field_owner,
+            name=f'Benchmark bookings {timezone.now():%Y%m%d%H%M%S}',
+            location=field.location,
+            sport=field.sport,
+            description='Deleted when the benchmark ends',
+            price_per_hour=field.price_per_hour,
+            start_working_day=1,
+            end_working_day=7,
+            start_working_hour=availability.FIRST_HOUR,
+            end_working_hour=availability.LAST_HOUR,
+        )
+        try:
+            today = timezone.localdate()
+            slots = [
+                (today + datetime.timedelta(days=day), hour)
+                for day in range(1, 366) for hour in availability.HOURS
+            ]
+            runs = min(self.options['runs'], len(slots) - self.options['warmup'])
+
+            def request_for(run):
+                date, hour = slots[run + self.options['warmup']]
+                url = reverse('reservation_form', kwargs={'pk': scratch.pk})
+                return 'post', url, {'reservation_date': date.isoformat(), 'reservation_hour': hour}
+
+            result = self.measure(user, request_for, runs)
+            # Within an outer transaction (e.g. a test) the bookings only release savepoints
+            result['committed'] = not connection.in_atomic_block
+            return result
+        finally:
+            scratch.delete()
+
+    def measure_connection_reuse(self, user):
+        # Short views, where opening the database connection is most of the work, once with a
+        # new connection per request and once with persistent connections. They go through the
+        # WSGI handler, which closes or keeps connections like a server does; the test client
+        # always keeps them.
+        session = Client()
+        session.force_login(user)
+        cookie = '; '.join(f'{morsel.key}={morsel.value}' for morsel in session.cookies.values())
+        handler = WSGIHandler()
+        factory = RequestFactory()
+
+        def send(method, url, data):
+            status = []
+            response = handler(
+                getattr(factory, method)(url, data, HTTP_COOKIE=cookie).environ,
+                lambda code, headers, exc_info=None: status.append(int(code.split()[0])),
+            )
+            try:
+                b''.join(response)
+            finally:
+                response.close()
+            return status[0]
+
+        results = {}
+        max_age = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            for suffix, age in (('_new_connection', 0), ('', max_age or 60)):
+                connection.settings_dict['CONN_MAX_AGE'] = age
+                connection.close()
+                for name in ('home', 'login_success'):
+                    results[name + suffix] = self.measure(user, lambda run, name=name: ('get', reverse(name), None), send=send)
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
+        return results
+
+    def compare(self, path, results):
+        with open(path) as file:
+            previous = json.load(file)
+        self.stdout.write(f'Compared with {previous.get("commit") or path}:')
+        for name, result in results.items():
+            before = previous.get('views', {}).get(name)
+            if before is None:
+                continue
+            self.stdout.write(
+                f'{name:<28} p50 {result["p50_ms"] - before["p50_ms"]:+8.2f} ms  '
+                f'p95 {result["p95_ms"] - before["p95_ms"]:+8.2f} ms  '
+                f'queries {result["queries"] - before["queries"]:+d}'
+            )
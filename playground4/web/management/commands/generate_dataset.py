@@ -0,0 +1,204 @@
+import datetime
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from playground4.web.models import Event, Field, Review, UserEventRegistration
+from playground4.web.opening_hours import compile_field
+from playground4.web.page_cache import invalidate
+from playground4.web.partitions import ensure_partitions
+from playground4.web.ratings import rebuild_rating_stats
+from playground4.web.rollups import rebuild_rollups
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+COMMENTS = [
+    'Great pitch, well kept.',
+    'Lights were off for half an hour.',
+    'Friendly staff and clean changing rooms.',
+    'A bit pricey for the area.',
+    'Surface is worn near the goals.',
+    'Perfect for a weekly game.',
+]
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a synthetic production-sized dataset: owners, players, fields, years of reservations, reviews, events and sign-ups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='gen', help='Prefix of the generated usernames, a second dataset needs another one')
+        parser.add_argument('--owners', type=int, default=200)
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--fields', type=int, default=2000)
+        parser.add_argument('--years', type=int, default=3, help='Years of reservation history before today')
+        parser.add_argument('--ahead', type=int, default=60, help='Days of reservations after today')
+        parser.add_argument('--fill', type=float, default=0.5, help='Share of working slots that are reserved')
+        parser.add_argument('--reviews', type=int, default=20, help='Reviews per field')
+        parser.add_argument('--events', type=int, default=5, help='Events per field')
+        parser.add_argument('--registrations', type=int, default=30, help='Sign-ups per event')
+        parser.add_argument('--random-seed', type=int, default=4)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The reservations are generated with PostgreSQL generate_series().')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'A dataset with prefix "{prefix}" already exists, choose another --prefix.')
+        if options['users'] < options['registrations'] or options['users'] < options['reviews']:
+            raise CommandError('--users must be at least --reviews and --registrations.')
+
+        random.seed(options['random_seed'])
+        with transaction.atomic():
+            owners = self.create_users(f'{prefix}-owner', options['owners'], field_owner=True)
+            users = self.create_users(f'{prefix}-user', options['users'])
+            fields = self.create_fields(prefix, owners, options['fields'])
+            reservations = self.create_reservations(fields, users, options['years'], options['ahead'], options['fill'])
+            reviews = self.create_reviews(fields, users, options['reviews'])
+            events, registrations = self.create_events(prefix, fields, users, options['events'], options['registrations'])
+
+            # bulk_create sends no signals, so bring the derived data up to date in one pass
+            self.rebuild_availability(fields)
+            rebuild_rating_stats(Field.objects.filter(pk__in=fields))
+            rebuild_rollups(Field.objects.filter(pk__in=fields))
+            Event.objects.filter(pk__in=events).update(registered_count=Coalesce(Subquery(
+                UserEventRegistration.objects.filter(event=OuterRef('pk')).order_by().values('event')
+                .annotate(count=Count('id')).values('count')
+            ), 0))
+            invalidate('field', 'review', 'event')
+            # The history went into the default partition wherever its months had no partition yet
+            ensure_partitions(timezone.localdate())
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(owners)} owners, {len(users)} users, {len(fields)} fields, {reservations} reservations, '
+            f'{reviews} reviews, {len(events)} events and {registrations} sign-ups.'
+        ))
+
+    def create_users(self, username_prefix, count, field_owner=False):
+        # One unusable password for everybody, hashing per user would take longer than the rest
+        password = make_password(None)
+        users = User.objects.bulk_create(
+            [
+                User(
+                    username=f'{username_prefix}-{number}',
+                    email=f'{username_prefix}-{number}@example.com',
+                    password=password,
+                    field_owner=field_owner,
+                    company_name=f'Company {number}' if field_owner else '',
+                    preferred_sport='' if field_owner else random.choice(User.SPORT_CHOICES)[0],
+                )
+                for number in range(count)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        return [user.pk for user in users]
+
+    def create_fields(self, prefix, owners, count):
+        sports = [value for value, label in Field.SPORT_CHOICES]
+        fields = []
+        for number in range(count):
+            start_day = random.randint(1, 3)
+            start_hour = random.randint(16, 18)
+            fields.append(Field(
+                field_owner_id=random.choice(owners),
+                name=f'{random.choice(["Arena", "Park", "Court", "Stadium"])} {prefix}-{number}',
+                location=f'Town {random.randrange(300)}',
+                sport=sports[number % len(sports)],
+                description=f'{sports[number % len(sports)]} field with {random.choice(["artificial turf", "grass", "parquet", "clay"])}',
+                price_per_hour=random.randint(10, 60),
+                start_working_day=start_day,
+                end_working_day=random.randint(start_day + 2, 7),
+                start_working_hour=start_hour,
+                end_working_hour=random.randint(start_hour + 2, 21),
+            ))
+        # bulk_create sends no pre_save signal
+        for field in fields:
+            compile_field(field)
+        return [field.pk for field in Field.objects.bulk_create(fields, batch_size=BATCH_SIZE)]
+
+    def create_reservations(self, fields, users, years, ahead, fill):
+        with connection.cursor() as cursor:
+            # Set-based, millions of rows would take far too long through the ORM
+            cursor.execute(
+                """
+                INSERT INTO web_reservation (user_id, field_id, reservation_date, reservation_hour, duration, period)
+                SELECT (%s::bigint[])[1 + floor(random() * %s)::int], field.id, day::date, hour, 1, tstzrange(
+                    (day::date + make_interval(hours => hour)) AT TIME ZONE %s,
+                    (day::date + make_interval(hours => hour + 1)) AT TIME ZONE %s
+                )
+                FROM web_field field
+                CROSS JOIN generate_series(CURRENT_DATE - %s, CURRENT_DATE + %s, interval '1 day') AS day
+                CROSS JOIN generate_series(16, 21) AS hour
+                WHERE field.id = ANY(%s)
+                    AND extract(isodow FROM day) BETWEEN field.start_working_day AND field.end_working_day
+                    AND hour BETWEEN field.start_working_hour AND field.end_working_hour
+                    AND random() < %s
+                ON CONFLICT DO NOTHING
+                """,
+                [users, len(users), *[timezone.get_current_timezone_name()] * 2, years * 365, ahead, fields, fill],
+            )
+            return cursor.rowcount
+
+    def rebuild_availability(self, fields):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO web_fieldavailability (field_id, date, booked_mask)
+                SELECT field_id, reservation_date, bit_or(((1 << duration) - 1) << (reservation_hour - 16))
+                FROM web_reservation
+                WHERE field_id = ANY(%s)
+                GROUP BY field_id, reservation_date
+                ON CONFLICT (field_id, date) DO UPDATE SET booked_mask = EXCLUDED.booked_mask
+                """,
+                [fields],
+            )
+
+    def create_reviews(self, fields, users, per_field):
+        reviews = []
+        for field_id in fields:
+            for user_id in random.sample(users, per_field):
+                reviews.append(Review(
+                    user_id=user_id,
+                    field_id=field_id,
+                    # Mostly good ratings, like real reviews
+                    rating=random.choices([1, 2, 3, 4, 5], weights=[1, 1, 2, 4, 4])[0],
+                    comment=random.choice(COMMENTS),
+                ))
+        Review.objects.bulk_create(reviews, batch_size=BATCH_SIZE)
+        return len(reviews)
+
+    def create_events(self, prefix, fields, users, per_field, registrations_per_event):
+        events = []
+        now = timezone.now()
+        for field_id in fields:
+            for number in range(per_field):
+                title = f'{random.choice(["Cup", "League night", "Tournament", "Open day"])} {prefix} {field_id}-{number}'
+                events.append(Event(
+                    title=title,
+                    # bulk_create skips Event.save(), which sets the slug
+                    slug=f'{prefix}-{field_id}-{number}',
+                    content='Everybody is welcome.',
+                    field_id=field_id,
+                    sport=random.choice(Event.SPORT_CHOICES)[0],
+                    entry_fee=random.randint(0, 20),
+                    event_date=now + datetime.timedelta(days=random.randint(-365, 90)),
+                    max_sign_ups=random.choice([0, registrations_per_event, registrations_per_event * 2]),
+                ))
+        events = [event.pk for event in Event.objects.bulk_create(events, batch_size=BATCH_SIZE)]
+
+        registrations = [
+            UserEventRegistration(user_id=user_id, event_id=event_id)
+            for event_id in events
+            for user_id in random.sample(users, registrations_per_event)
+        ]
+        UserEventRegistration.objects.bulk_create(registrations, batch_size=BATCH_SIZE)
+        return events, len(registrations)
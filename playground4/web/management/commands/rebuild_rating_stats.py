@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from playground4.web.models import Field
+from playground4.web.page_cache import invalidate
+from playground4.web.ratings import rebuild_rating_stats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the rating count, sum and star histogram of every field from its reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('field_ids', nargs='*', type=int, help='Only rebuild these fields')
+
+    def handle(self, *args, **options):
+        fields = Field.objects.all()
+        if options['field_ids']:
+            fields = fields.filter(pk__in=options['field_ids'])
+
+        with transaction.atomic():
+            # Lock the rows so concurrent reviews wait instead of being overwritten
+            list(fields.select_for_update().values_list('pk', flat=True))
+            count = rebuild_rating_stats(fields)
+            invalidate('review')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating statistics for {count} fields.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from playground4.web.models import Field
+from playground4.web.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily and monthly booking rollups of every field from its reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('field_ids', nargs='*', type=int, help='Only rebuild these fields')
+
+    def handle(self, *args, **options):
+        fields = Field.objects.all()
+        if options['field_ids']:
+            fields = fields.filter(pk__in=options['field_ids'])
+
+        with transaction.atomic():
+            # Lock the fields so bookings made meanwhile wait instead of being counted twice or lost
+            count = len(fields.select_for_update().values_list('pk', flat=True))
+            rebuild_rollups(fields)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt booking rollups for {count} fields.'))
@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from playground4.web import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates the monthly reservation partitions ahead of time and archives old ones. '
+        'Run it daily, e.g. from cron, so bookings never pile up in the default partition.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=partitions.MONTHS_AHEAD, help='Months to create after the current one')
+        parser.add_argument(
+            '--archive-before',
+            metavar='YYYY-MM',
+            help=f'Detach the partitions of months before this one into the "{partitions.ARCHIVE_SCHEMA}" schema',
+        )
+        parser.add_argument('--list', action='store_true', help='Only list the partitions')
+
+    def handle(self, *args, **options):
+        if not options['list']:
+            for name in partitions.ensure_partitions(timezone.localdate(), options['ahead']):
+                self.stdout.write(f'Created {name}')
+
+            if options['archive_before']:
+                try:
+                    before = datetime.datetime.strptime(options['archive_before'], '%Y-%m').date()
+                except ValueError:
+                    raise CommandError('--archive-before must look like 2023-01.')
+                if before > timezone.localdate().replace(day=1):
+                    raise CommandError('Only past months can be archived.')
+                for name in partitions.archive_partitions(before):
+                    self.stdout.write(f'Archived {name} to {partitions.ARCHIVE_SCHEMA}.{name}')
+
+        for name, start, end in partitions.partitions():
+            bounds = 'default' if start is None else f'{start} - {end - datetime.timedelta(days=1)}'
+            self.stdout.write(f'{name}: {bounds}')
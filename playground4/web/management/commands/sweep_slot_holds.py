@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from playground4.web.holds import sweep
+
+
+class Command(BaseCommand):
+    help = 'Deletes the expired slot holds in one statement. Run it every minute or so, e.g. from cron.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Deleted {sweep()} expired holds.'))
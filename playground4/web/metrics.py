@@ -0,0 +1,364 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the request latency histogram buckets, +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Per view: [requests, latency sum, queries, SQL seconds, template seconds, *bucket counts incl. +Inf]
+REQUESTS, LATENCY_SUM, QUERIES, SQL_SECONDS, TEMPLATE_SECONDS = range(5)
+FIRST_BUCKET = 5
+ROW_SIZE = FIRST_BUCKET + len(LATENCY_BUCKETS) + 1
+
+UNRESOLVED = '<unresolved>'
+
+# Per database alias: [connections opened, requests that found the connection still open,
+# kept connections replaced during a request (failed health check or dropped by the server),
+# connections held between requests (a gauge, 0 or 1 per thread)]
+OPENED, REUSED, REPLACED, HELD = range(4)
+CONNECTION_ROW_SIZE = 4
+
+# Every thread writes only to its own dicts, readers add them up, so recording takes no lock
+_local = threading.local()
+_thread_stats = []
+_thread_connections = []
+
+# (pid, random token) naming this process's file; a new one after a fork, so a process never
+# writes over the file of an earlier one that had the same pid
+_process = None
+# The pid the flusher thread runs in, threads don't survive a fork
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        # Aliases that connected during the request
+        self.connected = set()
+
+    def query_done(self, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+
+
+# The query observers of the current context, e.g. the request's RequestTimings. Every
+# connection reports its queries to them (observe_queries()); a context variable, as under ASGI
+# the queries run in sync_to_async threads, on other connections than the request started on,
+# and those threads run in a copy of the request's context.
+_observers = contextvars.ContextVar('query_observers', default=())
+
+
+def _report_query(execute, sql, params, many, context):
+    observers = _observers.get()
+    if not observers:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - started
+        for observer in observers:
+            observer.query_done(seconds)
+
+
+def observe_queries(connection):
+    # connection_created receiver, see signals.py; a connection object keeps its wrappers when it
+    # reconnects
+    if _report_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_report_query)
+
+
+@contextmanager
+def observing(observer):
+    # observer.query_done(seconds) is called for every query run within the block, in any thread
+    token = _observers.set(_observers.get() + (observer,))
+    try:
+        yield observer
+    finally:
+        _observers.reset(token)
+
+
+def _stats():
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        stats = _local.stats = {}
+        _thread_stats.append(stats)
+    return stats
+
+
+def _connection_row(alias):
+    connections_stats = getattr(_local, 'connections', None)
+    if connections_stats is None:
+        connections_stats = _local.connections = {}
+        _thread_connections.append((threading.current_thread(), connections_stats))
+    row = connections_stats.get(alias)
+    if row is None:
+        row = connections_stats[alias] = [0] * CONNECTION_ROW_SIZE
+    return row
+
+
+def connection_opened(alias):
+    # connection_created receiver, see signals.py
+    _connection_row(alias)[OPENED] += 1
+    timings = _current.get()
+    if timings is not None:
+        timings.connected.add(alias)
+
+
+def record_connections(aliases, kept, timings):
+    # `kept`: the aliases whose connection was already open when the request started
+    for alias in aliases:
+        row = _connection_row(alias)
+        row[HELD] = int(alias in kept)
+        if alias in kept:
+            row[REUSED] += 1
+            if alias in timings.connected:
+                row[REPLACED] += 1
+
+
+def record(view, seconds, timings):
+    row = _stats().get(view)
+    if row is None:
+        row = _stats()[view] = [0] * ROW_SIZE
+    row[REQUESTS] += 1
+    row[LATENCY_SUM] += seconds
+    row[QUERIES] += timings.queries
+    row[SQL_SECONDS] += timings.sql_seconds
+    row[TEMPLATE_SECONDS] += timings.template_seconds
+    bucket = next((index for index, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+    row[FIRST_BUCKET + bucket] += 1
+
+
+def merge(totals, stats):
+    for view, row in stats.items():
+        total = totals.setdefault(view, [0] * ROW_SIZE)
+        for index, value in enumerate(row):
+            total[index] += value
+    return totals
+
+
+def collect():
+    # This process only
+    totals = {}
+    for stats in list(_thread_stats):
+        merge(totals, dict(stats))
+    return totals
+
+
+def _without_held(stats):
+    return {alias: row[:HELD] + [0] for alias, row in stats.items()}
+
+
+def collect_connections():
+    # Finished threads keep their counters but hold no connections any more
+    totals = {}
+    for thread, stats in list(_thread_connections):
+        merge(totals, dict(stats) if thread.is_alive() else _without_held(dict(stats)))
+    return totals
+
+
+def process_key():
+    global _process
+    if _process is None or _process[0] != os.getpid():
+        _process = (os.getpid(), uuid.uuid4().hex)
+    return _process
+
+
+def _process_file(pid, token):
+    return os.path.join(settings.METRICS_DIR, f'metrics-{pid}-{token}.json')
+
+
+def flush():
+    # Publishes this process's totals for the other workers; replace() keeps readers from
+    # seeing half-written files
+    path = _process_file(*process_key())
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump({'views': collect(), 'connections': collect_connections()}, file)
+    os.replace(temporary, path)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            if settings.METRICS_DIR:
+                flush()
+        except OSError:
+            logger.exception('Could not write the request metrics to %s', settings.METRICS_DIR)
+
+
+def start_flusher():
+    # Requests only start the thread that flushes this process every METRICS_FLUSH_INTERVAL
+    # seconds, they never write the file themselves
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_periodically, name='metrics-flush', daemon=True).start()
+
+
+@atexit.register
+def _flush_at_exit():
+    # The requests since the last interval
+    if settings.configured and settings.METRICS_DIR and _flusher_pid == os.getpid():
+        flush()
+
+
+def _other_workers():
+    # (flushed recently, flushed numbers) of every other worker that wrote a file. A worker that
+    # hasn't flushed for a few intervals has finished.
+    if not settings.METRICS_DIR:
+        return
+    own = 'metrics-{}-{}.json'.format(*process_key())
+    stale = time.time() - 3 * settings.METRICS_FLUSH_INTERVAL
+    for name in os.listdir(settings.METRICS_DIR):
+        if not name.startswith('metrics-') or not name.endswith('.json') or name == own:
+            continue
+        path = os.path.join(settings.METRICS_DIR, name)
+        try:
+            with open(path) as file:
+                yield os.path.getmtime(path) > stale, json.load(file)
+        except (OSError, ValueError):
+            continue
+
+
+def collect_all():
+    # Every worker: this process live, the others as of their last flush. Files of
+    # finished workers are kept, so counters never go backwards.
+    totals = collect()
+    for alive, numbers in _other_workers():
+        merge(totals, numbers.get('views', {}))
+    return totals
+
+
+def collect_all_connections():
+    # Like collect_all()
+    totals = collect_connections()
+    for alive, numbers in _other_workers():
+        stats = numbers.get('connections', {})
+        merge(totals, stats if alive else _without_held(stats))
+    return totals
+
+
+def render_prometheus(totals, connection_totals=None):
+    def label(view):
+        return view.replace('\\', '\\\\').replace('"', '\\"')
+
+    lines = [
+        '# HELP playground4_request_duration_seconds Request latency per view.',
+        '# TYPE playground4_request_duration_seconds histogram',
+    ]
+    for view, row in sorted(totals.items()):
+        cumulative = 0
+        for index, bound in enumerate(LATENCY_BUCKETS + ('+Inf',)):
+            cumulative += row[FIRST_BUCKET + index]
+            lines.append(f'playground4_request_duration_seconds_bucket{{view="{label(view)}",le="{bound}"}} {cumulative}')
+        lines.append(f'playground4_request_duration_seconds_sum{{view="{label(view)}"}} {row[LATENCY_SUM]}')
+        lines.append(f'playground4_request_duration_seconds_count{{view="{label(view)}"}} {row[REQUESTS]}')
+
+    for name, index, help_text in (
+        ('playground4_db_queries_total', QUERIES, 'Database queries per view.'),
+        ('playground4_db_seconds_total', SQL_SECONDS, 'Time spent in SQL per view.'),
+        ('playground4_template_seconds_total', TEMPLATE_SECONDS, 'Time spent rendering templates per view.'),
+    ):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for view, row in sorted(totals.items()):
+            lines.append(f'{name}{{view="{label(view)}"}} {row[index]}')
+
+    for name, metric_type, index, help_text in (
+        ('playground4_db_connections_opened_total', 'counter', OPENED, 'Database connections opened.'),
+        ('playground4_db_connections_reused_total', 'counter', REUSED, 'Requests that found their database connection open.'),
+        ('playground4_db_connections_replaced_total', 'counter', REPLACED, 'Kept connections that failed their health check.'),
+        ('playground4_db_connections_held', 'gauge', HELD, 'Database connections kept open between requests.'),
+    ):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for alias, row in sorted((connection_totals or {}).items()):
+            lines.append(f'{name}{{alias="{label(alias)}"}} {row[index]}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    # Outermost middleware, so the latency covers the whole request
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.measure(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with self.measure(request):
+            return await self.get_response(request)
+
+    @contextmanager
+    def measure(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        # Connections persist between requests when CONN_MAX_AGE allows it
+        kept = {connection.alias for connection in connections.all(initialized_only=True) if connection.connection is not None}
+        started = time.perf_counter()
+        try:
+            with observing(timings):
+                yield
+        finally:
+            _current.reset(token)
+            match = request.resolver_match
+            view = (match.url_name or match.view_name) if match else UNRESOLVED
+            record(view, time.perf_counter() - started, timings)
+            record_connections([connection.alias for connection in connections.all(initialized_only=True)], kept, timings)
+            if settings.METRICS_DIR:
+                start_flusher()
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings = _current.get()
+            if timings is not None:
+                timings.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    # The Django template backend, timing every render for MetricsMiddleware
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_availability(apps, schema_editor):
+    Reservation = apps.get_model('web', 'Reservation')
+    FieldAvailability = apps.get_model('web', 'FieldAvailability')
+
+    masks = {}
+    for field_id, date, hour in Reservation.objects.values_list('field_id', 'reservation_date', 'reservation_hour').iterator():
+        masks[(field_id, date)] = masks.get((field_id, date), 0) | 1 << (hour - 16)
+
+    FieldAvailability.objects.bulk_create(
+        [FieldAvailability(field_id=field_id, date=date, booked_mask=mask) for (field_id, date), mask in masks.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0029_alter_user_username'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FieldAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booked_mask', models.PositiveSmallIntegerField(default=0)),
+                ('field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='web.field')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='fieldavailability',
+            constraint=models.UniqueConstraint(fields=('field', 'date'), name='unique_field_availability_date'),
+        ),
+        migrations.RunPython(build_availability, migrations.RunPython.noop),
+    ]
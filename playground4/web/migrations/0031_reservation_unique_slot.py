@@ -0,0 +1,35 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:46
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_reservations(apps, schema_editor):
+    # Keep the earliest booking of every double-booked slot
+    Reservation = apps.get_model('web', 'Reservation')
+    duplicates = (
+        Reservation.objects.values('field_id', 'reservation_date', 'reservation_hour')
+        .annotate(first_id=Min('id'), bookings=Count('id'))
+        .filter(bookings__gt=1)
+    )
+    for slot in duplicates:
+        Reservation.objects.filter(
+            field_id=slot['field_id'],
+            reservation_date=slot['reservation_date'],
+            reservation_hour=slot['reservation_hour'],
+        ).exclude(id=slot['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0030_fieldavailability'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_reservations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(fields=('field', 'reservation_date', 'reservation_hour'), name='unique_reservation_slot'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:50
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_rating_stats(apps, schema_editor):
+    Field = apps.get_model('web', 'Field')
+    Review = apps.get_model('web', 'Review')
+    stats = Review.objects.values('field_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'rating_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)},
+    )
+    for row in stats:
+        Field.objects.filter(pk=row.pop('field_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0031_reservation_unique_slot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='field',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0032_field_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['-date_published', '-id'], name='event_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['field', '-date_published', '-id'], name='event_field_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='field',
+            index=models.Index(fields=['sport', 'id'], name='field_sport_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', 'reservation_date', 'reservation_hour', 'id'], name='reservation_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['field', '-created_at', '-id'], name='review_field_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usereventregistration',
+            index=models.Index(fields=['event', 'registration_date', 'id'], name='registration_event_date_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:53
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR_TRIGGER = """
+CREATE FUNCTION web_field_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.location, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER web_field_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, location, description ON web_field
+    FOR EACH ROW EXECUTE FUNCTION web_field_search_vector_update();
+
+UPDATE web_field SET name = name;
+"""
+
+DROP_SEARCH_VECTOR_TRIGGER = """
+DROP TRIGGER IF EXISTS web_field_search_vector_trigger ON web_field;
+DROP FUNCTION IF EXISTS web_field_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0033_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='field',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='field',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='field_search_vector_idx'),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:59
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def count_registrations(apps, schema_editor):
+    Event = apps.get_model('web', 'Event')
+    UserEventRegistration = apps.get_model('web', 'UserEventRegistration')
+
+    # Keep the first registration of users who signed up twice
+    duplicates = (
+        UserEventRegistration.objects.values('user_id', 'event_id')
+        .annotate(first_id=Min('id'), registrations=Count('id'))
+        .filter(registrations__gt=1)
+    )
+    for registration in duplicates:
+        UserEventRegistration.objects.filter(
+            user_id=registration['user_id'],
+            event_id=registration['event_id'],
+        ).exclude(id=registration['first_id']).delete()
+
+    counts = UserEventRegistration.objects.values('event_id').annotate(registrations=Count('id'))
+    for row in counts:
+        Event.objects.filter(pk=row['event_id']).update(registered_count=row['registrations'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0034_field_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='registered_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='max_sign_ups',
+            field=models.PositiveIntegerField(default=0, help_text='0 means no limit'),
+        ),
+        migrations.RunPython(count_registrations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='usereventregistration',
+            constraint=models.UniqueConstraint(fields=('user', 'event'), name='unique_event_registration'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0035_event_registered_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventWaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('joined_at', models.DateTimeField(auto_now_add=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='web.event')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['event', 'id'], name='waitlist_event_order_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='eventwaitlistentry',
+            constraint=models.UniqueConstraint(fields=('user', 'event'), name='unique_event_waitlist_entry'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+
+def build_rollups(apps, schema_editor):
+    Reservation = apps.get_model('web', 'Reservation')
+    FieldDailyStats = apps.get_model('web', 'FieldDailyStats')
+    FieldMonthlyStats = apps.get_model('web', 'FieldMonthlyStats')
+
+    reservations = Reservation.objects.order_by()
+    FieldDailyStats.objects.bulk_create(
+        (
+            FieldDailyStats(field_id=row['field_id'], date=row['reservation_date'], bookings=row['bookings'])
+            for row in reservations.values('field_id', 'reservation_date').annotate(bookings=Count('id')).iterator()
+        ),
+        batch_size=5000,
+    )
+    FieldMonthlyStats.objects.bulk_create(
+        [
+            FieldMonthlyStats(field_id=row['field_id'], month=row['month'], bookings=row['bookings'])
+            for row in reservations.annotate(month=TruncMonth('reservation_date')).values('field_id', 'month').annotate(bookings=Count('id'))
+        ],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0036_eventwaitlistentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FieldMonthlyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('bookings', models.PositiveIntegerField(default=0)),
+                ('field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='web.field')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FieldDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('bookings', models.PositiveSmallIntegerField(default=0)),
+                ('field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='web.field')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='fieldmonthlystats',
+            constraint=models.UniqueConstraint(fields=('field', 'month'), name='unique_field_monthly_stats'),
+        ),
+        migrations.AddConstraint(
+            model_name='fielddailystats',
+            constraint=models.UniqueConstraint(fields=('field', 'date'), name='unique_field_daily_stats'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+import datetime
+
+from django.db import migrations
+
+# Months of empty partitions created ahead of today; the reservation_partitions command keeps
+# adding them, the default partition takes anything booked further out in the meantime
+MONTHS_AHEAD = 12
+
+COLUMNS = 'id, reservation_date, reservation_hour, field_id, user_id'
+
+CONSTRAINTS = [
+    'ALTER TABLE web_reservation ADD CONSTRAINT web_reservation_pkey PRIMARY KEY ({primary_key})',
+    'ALTER TABLE web_reservation ADD CONSTRAINT unique_reservation_slot UNIQUE (field_id, reservation_date, reservation_hour)',
+    'CREATE INDEX reservation_user_date_idx ON web_reservation (user_id, reservation_date, reservation_hour, id)',
+    'CREATE INDEX web_reservation_field_id_3f47a976 ON web_reservation (field_id)',
+    'CREATE INDEX web_reservation_user_id_bd6433c3 ON web_reservation (user_id)',
+    'ALTER TABLE web_reservation ADD CONSTRAINT web_reservation_field_id_3f47a976_fk_web_field_id '
+    'FOREIGN KEY (field_id) REFERENCES web_field (id) DEFERRABLE INITIALLY DEFERRED',
+    'ALTER TABLE web_reservation ADD CONSTRAINT web_reservation_user_id_bd6433c3_fk_web_user_id '
+    'FOREIGN KEY (user_id) REFERENCES web_user (id) DEFERRABLE INITIALLY DEFERRED',
+]
+
+
+def next_month(month):
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def rebuild_table(schema_editor, partitioned):
+    # Copies the reservations into a new table and gives it the old table's constraint and
+    # index names, so later migrations find them where Django expects them
+    execute = schema_editor.execute
+    execute('ALTER TABLE web_reservation RENAME TO web_reservation_old')
+    execute(
+        'CREATE TABLE web_reservation ('
+        'id bigint GENERATED BY DEFAULT AS IDENTITY, reservation_date date NOT NULL, reservation_hour integer NOT NULL, '
+        'field_id bigint NOT NULL, user_id bigint NOT NULL)'
+        + (' PARTITION BY RANGE (reservation_date)' if partitioned else '')
+    )
+
+    if partitioned:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('SELECT min(reservation_date) FROM web_reservation_old')
+            oldest = cursor.fetchone()[0]
+        today = datetime.date.today()
+        month = min(oldest or today, today).replace(day=1)
+        last_month = today.replace(day=1)
+        for _ in range(MONTHS_AHEAD):
+            last_month = next_month(last_month)
+        while month <= last_month:
+            execute(
+                f'CREATE TABLE web_reservation_{month:%Y_%m} PARTITION OF web_reservation '
+                f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+            )
+            month = next_month(month)
+        execute('CREATE TABLE web_reservation_default PARTITION OF web_reservation DEFAULT')
+
+    execute(f'INSERT INTO web_reservation ({COLUMNS}) SELECT {COLUMNS} FROM web_reservation_old')
+    execute('DROP TABLE web_reservation_old')
+    execute(
+        "SELECT setval(pg_get_serial_sequence('web_reservation', 'id'), coalesce(max(id), 0) + 1, false) "
+        'FROM web_reservation'
+    )
+    # Unique keys of a partitioned table must contain the partition key
+    primary_key = 'id, reservation_date' if partitioned else 'id'
+    for statement in CONSTRAINTS:
+        execute(statement.format(primary_key=primary_key))
+    execute('ANALYZE web_reservation')
+
+
+def partition(apps, schema_editor):
+    rebuild_table(schema_editor, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    rebuild_table(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0037_field_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
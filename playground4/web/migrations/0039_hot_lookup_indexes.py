@@ -0,0 +1,110 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+import django.db.models.deletion
+
+
+def remove_duplicate_reviews(apps, schema_editor):
+    Field = apps.get_model('web', 'Field')
+    Review = apps.get_model('web', 'Review')
+
+    # Keep the latest review of users who reviewed a field more than once
+    duplicates = (
+        Review.objects.values('user_id', 'field_id')
+        .annotate(last_id=Max('id'), reviews=Count('id'))
+        .filter(reviews__gt=1)
+    )
+    fields = set()
+    for review in duplicates:
+        Review.objects.filter(
+            user_id=review['user_id'],
+            field_id=review['field_id'],
+        ).exclude(id=review['last_id']).delete()
+        fields.add(review['field_id'])
+
+    stats = Review.objects.filter(field_id__in=fields).values('field_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'rating_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)},
+    )
+    for row in stats:
+        Field.objects.filter(pk=row.pop('field_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0038_partition_reservations'),
+    ]
+
+    # The dropped single column indexes are covered by composite indexes and unique constraints
+    # starting with the same column
+    operations = [
+        migrations.RunPython(remove_duplicate_reviews, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='event',
+            name='field',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='web.field'),
+        ),
+        migrations.AlterField(
+            model_name='eventwaitlistentry',
+            name='event',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='web.event'),
+        ),
+        migrations.AlterField(
+            model_name='eventwaitlistentry',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='fieldavailability',
+            name='field',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='web.field'),
+        ),
+        migrations.AlterField(
+            model_name='fielddailystats',
+            name='field',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='web.field'),
+        ),
+        migrations.AlterField(
+            model_name='fieldmonthlystats',
+            name='field',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='web.field'),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='field',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='web.field'),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='field',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='web.field'),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='usereventregistration',
+            name='event',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='web.event'),
+        ),
+        migrations.AlterField(
+            model_name='usereventregistration',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='review',
+            constraint=models.UniqueConstraint(fields=('user', 'field'), name='unique_field_review'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0039_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hold_date', models.DateField()),
+                ('hold_hour', models.IntegerField(choices=[(16, '16:00'), (17, '17:00'), (18, '18:00'), (19, '19:00'), (20, '20:00'), (21, '21:00')])),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('field', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='web.field')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='slothold',
+            constraint=models.UniqueConstraint(fields=('field', 'hold_date', 'hold_hour'), name='unique_slot_hold'),
+        ),
+        # Holds live for minutes, losing them in a crash costs a user a retry; in exchange their
+        # writes skip the WAL. Unlogged tables aren't replicated, holds are only read on the primary.
+        migrations.RunSQL('ALTER TABLE web_slothold SET UNLOGGED', 'ALTER TABLE web_slothold SET LOGGED'),
+    ]
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.expressions
+import playground4.web.models
+
+# Postgres 16 has no exclusion constraints on partitioned tables, so every partition gets its
+# own; partitions.create_partition() adds it to the ones created later. A booking never leaves
+# its date (reservation_within_day), so no overlap can span two partitions. Without btree_gist
+# the field id is compared as a one-value range, which GiST indexes natively.
+OVERLAP_CONSTRAINT = (
+    "ALTER TABLE {partition} ADD CONSTRAINT {partition}_no_overlap "
+    "EXCLUDE USING gist (int8range(field_id, field_id, '[]') WITH &&, period WITH &&)"
+)
+
+
+def reservation_partitions(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = 'web_reservation'::regclass ORDER BY child.relname"
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+def add_overlap_constraints(apps, schema_editor):
+    for partition in reservation_partitions(schema_editor):
+        schema_editor.execute(OVERLAP_CONSTRAINT.format(partition=partition))
+
+
+def drop_overlap_constraints(apps, schema_editor):
+    for partition in reservation_partitions(schema_editor):
+        schema_editor.execute(f'ALTER TABLE {partition} DROP CONSTRAINT IF EXISTS {partition}_no_overlap')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0040_slot_holds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='duration',
+            field=models.PositiveSmallIntegerField(choices=[(1, '1 hour'), (2, '2 hours'), (3, '3 hours'), (4, '4 hours'), (5, '5 hours'), (6, '6 hours')], default=1),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='period',
+            field=playground4.web.models.ReservationPeriodField(editable=False, null=True),
+        ),
+        # Every existing reservation is one hour long
+        migrations.RunSQL(
+            [(
+                'UPDATE web_reservation SET period = tstzrange('
+                '(reservation_date + make_interval(hours => reservation_hour)) AT TIME ZONE %s, '
+                '(reservation_date + make_interval(hours => reservation_hour + duration)) AT TIME ZONE %s)',
+                [settings.TIME_ZONE, settings.TIME_ZONE],
+            )],
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='period',
+            field=playground4.web.models.ReservationPeriodField(editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.CheckConstraint(check=models.Q(('duration__gte', 1), ('duration__lte', django.db.models.expressions.CombinedExpression(models.Value(22), '-', models.F('reservation_hour')))), name='reservation_within_day', violation_error_message='Reservations must end by 22:00.'),
+        ),
+        migrations.RunPython(add_overlap_constraints, drop_overlap_constraints),
+    ]
@@ -0,0 +1,73 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Existing fields have no rows yet, so their week is their usual working days and hours: bit
+# (weekday - 1) * 6 + (hour - 16) for every day and hour in the ranges
+COMPILE_USUAL_WEEK = """
+UPDATE web_field SET opening_mask = (
+    SELECT coalesce(sum(1::bigint << ((day - 1) * 6 + hour - 16)), 0)
+    FROM generate_series(start_working_day, end_working_day) AS day,
+        generate_series(start_working_hour, end_working_hour) AS hour
+)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0041_reservation_periods'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='field',
+            name='opening_exception_masks',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='opening_mask',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='OpeningHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.IntegerField(choices=[(1, 'Monday'), (2, 'Tuesday'), (3, 'Wednesday'), (4, 'Thursday'), (5, 'Friday'), (6, 'Saturday'), (7, 'Sunday')])),
+                ('start_hour', models.IntegerField(blank=True, choices=[(16, '16:00'), (17, '17:00'), (18, '18:00'), (19, '19:00'), (20, '20:00'), (21, '21:00')], null=True)),
+                ('end_hour', models.IntegerField(blank=True, choices=[(16, '16:00'), (17, '17:00'), (18, '18:00'), (19, '19:00'), (20, '20:00'), (21, '21:00')], null=True)),
+                ('field', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='opening_hours', to='web.field')),
+            ],
+            options={
+                'verbose_name_plural': 'opening hours',
+            },
+        ),
+        migrations.CreateModel(
+            name='OpeningException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('start_hour', models.IntegerField(blank=True, choices=[(16, '16:00'), (17, '17:00'), (18, '18:00'), (19, '19:00'), (20, '20:00'), (21, '21:00')], null=True)),
+                ('end_hour', models.IntegerField(blank=True, choices=[(16, '16:00'), (17, '17:00'), (18, '18:00'), (19, '19:00'), (20, '20:00'), (21, '21:00')], null=True)),
+                ('reason', models.CharField(blank=True, max_length=100)),
+                ('field', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='opening_exceptions', to='web.field')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='openinghours',
+            constraint=models.UniqueConstraint(fields=('field', 'weekday'), name='unique_opening_hours_weekday'),
+        ),
+        migrations.AddConstraint(
+            model_name='openinghours',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('end_hour__isnull', True), ('start_hour__isnull', True)), models.Q(('end_hour__isnull', False), ('start_hour__isnull', False), ('start_hour__lte', models.F('end_hour'))), _connector='OR'), name='opening_hours_in_order', violation_error_message='Set both hours, the first one not after the last, or neither to close.'),
+        ),
+        migrations.AddConstraint(
+            model_name='openingexception',
+            constraint=models.UniqueConstraint(fields=('field', 'date'), name='unique_opening_exception_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='openingexception',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('end_hour__isnull', True), ('start_hour__isnull', True)), models.Q(('end_hour__isnull', False), ('start_hour__isnull', False), ('start_hour__lte', models.F('end_hour'))), _connector='OR'), name='opening_exception_in_order', violation_error_message='Set both hours, the first one not after the last, or neither to close.'),
+        ),
+        migrations.RunSQL(COMPILE_USUAL_WEEK, migrations.RunSQL.noop),
+    ]
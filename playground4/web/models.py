@@ -1,9 +1,14 @@
+import datetime
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.contrib.postgres.fields import DateTimeRangeField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator, MinLengthValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
 from django.conf import settings
-from django.db.models import Avg
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
@@ -73,6 +78,44 @@ class Field(models.Model):
     # End working hour (choices: 16-21)
     end_working_hour = models.IntegerField(choices=[(hour, hour) for hour in range(16, 22)], default=16)
 
+    # Review statistics kept up to date by ratings.py, so pages never aggregate reviews
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    # Weighted name / location / description lexemes, filled in by a database trigger (migration 0034)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # The working days and hours above are the usual week; OpeningHours and OpeningException rows
+    # change single weekdays and dates. opening_hours.py compiles all of them into these two
+    # whenever the field or its rows are saved, and booking checks and searches read only these:
+    # the open hours of the week, 6 bits per weekday from Monday, one per hour from 16:00
+    opening_mask = models.BigIntegerField(default=0, editable=False)
+    # 'YYYY-MM-DD' -> mask of the open hours, for the upcoming dates with exceptions
+    opening_exception_masks = models.JSONField(default=dict, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sport', 'id'], name='field_sport_id_idx'),
+            GinIndex(fields=['search_vector'], name='field_search_vector_idx'),
+        ]
+
+    RATING_FIELDS = ['rating_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+    DERIVED_FIELDS = RATING_FIELDS + ['search_vector']
+
+    def save(self, *args, **kwargs):
+        # Editing a field must never write back stale rating statistics or search data
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def get_start_working_day(self):
         return dict(self.DAY_CHOICES)[self.start_working_day]
 
@@ -85,34 +128,232 @@ class Field(models.Model):
     def get_end_working_hour(self):
         return f"{self.end_working_hour}:00"
 
+    def get_opening_days(self):
+        # [(weekday name, first hour, last hour)], the hours None on closed days
+        days = []
+        for weekday, name in self.DAY_CHOICES:
+            day_mask = (self.opening_mask >> (weekday - 1) * 6) & 0b111111
+            hours = [f"{hour}:00" for hour in range(16, 22) if day_mask & 1 << (hour - 16)]
+            days.append((name, hours[0], hours[-1]) if hours else (name, None, None))
+        return days
+
     def get_average_rating(self):
-        average_rating = self.review_set.aggregate(Avg('rating'))['rating__avg']
-        if average_rating:
-            return round(average_rating, 1)
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 1)
         return None
 
+    def get_rating_distribution(self):
+        # [(stars, count, percent)] from 5 stars down to 1
+        distribution = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}')
+            percent = round(count * 100 / self.rating_count) if self.rating_count else 0
+            distribution.append((stars, count, percent))
+        return distribution
+
     def __str__(self):
         return self.name
 
+def reservation_period(date, hour, duration):
+    # [start, end) of a booking in the current time zone. Reservations created with ISO strings
+    # keep them until they are reloaded.
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+    start = timezone.make_aware(datetime.datetime.combine(date, datetime.time(hour)))
+    return DateTimeTZRange(start, start + datetime.timedelta(hours=duration))
+
+
+class ReservationPeriodField(DateTimeRangeField):
+    # Worked out from the date, start hour and duration whenever a reservation is saved,
+    # bulk_create included, the way auto_now fields are
+    def pre_save(self, model_instance, add):
+        value = model_instance.get_period()
+        setattr(model_instance, self.attname, value)
+        return value
+
+
 class Reservation(models.Model):
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    field = models.ForeignKey(Field, on_delete=models.CASCADE)
+    DURATION_CHOICES = [(1, '1 hour')] + [(hours, f'{hours} hours') for hours in range(2, 7)]
+
+    # Foreign keys without their own index are served by a composite index or unique
+    # constraint that starts with them (migration 0039)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, db_index=False)
     reservation_date = models.DateField()
+    # The first hour booked
     reservation_hour = models.IntegerField(choices=[(hour, f'{hour}:00') for hour in range(16, 22)])
+    duration = models.PositiveSmallIntegerField(choices=DURATION_CHOICES, default=1)
+    # Every partition has an exclusion constraint on (field, period) that rejects overlapping
+    # bookings (migration 0041, partitions.py); Postgres 16 can't put it on the partitioned table
+    period = ReservationPeriodField(editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'reservation_date', 'reservation_hour'], name='unique_reservation_slot'),
+            # A booking ends by 22:00 on its own date, so it never overlaps one in another partition
+            models.CheckConstraint(
+                check=models.Q(duration__gte=1, duration__lte=22 - models.F('reservation_hour')),
+                name='reservation_within_day',
+                violation_error_message='Reservations must end by 22:00.',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'reservation_date', 'reservation_hour', 'id'], name='reservation_user_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keeps the availability index update (see signals.py) in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    @property
+    def end_hour(self):
+        return self.reservation_hour + self.duration
+
+    def get_period(self):
+        return reservation_period(self.reservation_date, int(self.reservation_hour), int(self.duration))
 
     def __str__(self):
         return f"Reservation for {self.field.name} by {self.user.username}"
 
 
+class SlotHold(models.Model):
+    # A short lease on a slot while its user fills in the reservation form (see holds.py). Holds
+    # past expires_at are ignored everywhere and deleted by the sweep_slot_holds command.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, db_index=False)
+    hold_date = models.DateField()
+    hold_hour = models.IntegerField(choices=[(hour, f'{hour}:00') for hour in range(16, 22)])
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'hold_date', 'hold_hour'], name='unique_slot_hold'),
+        ]
+
+    def __str__(self):
+        return f"Hold on {self.field.name} {self.hold_date} {self.hold_hour}:00 by {self.user.username}"
+
+
+class OpeningHours(models.Model):
+    # The hours of one weekday that differ from the field's usual week, none when it is closed
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, related_name='opening_hours', db_index=False)
+    weekday = models.IntegerField(choices=Field.DAY_CHOICES)
+    start_hour = models.IntegerField(choices=[(hour, f'{hour}:00') for hour in range(16, 22)], null=True, blank=True)
+    end_hour = models.IntegerField(choices=[(hour, f'{hour}:00') for hour in range(16, 22)], null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'opening hours'
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'weekday'], name='unique_opening_hours_weekday'),
+            models.CheckConstraint(
+                check=(
+                    models.Q(start_hour__isnull=True, end_hour__isnull=True)
+                    | models.Q(start_hour__isnull=False, end_hour__isnull=False, start_hour__lte=models.F('end_hour'))
+                ),
+                name='opening_hours_in_order',
+                violation_error_message='Set both hours, the first one not after the last, or neither to close.',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_weekday_display()} hours of {self.field.name}"
+
+
+class OpeningException(models.Model):
+    # Other hours on one date, e.g. a holiday closure or maintenance; none when it is closed
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, related_name='opening_exceptions', db_index=False)
+    date = models.DateField()
+    start_hour = models.IntegerField(choices=[(hour, f'{hour}:00') for hour in range(16, 22)], null=True, blank=True)
+    end_hour = models.IntegerField(choices=[(hour, f'{hour}:00') for hour in range(16, 22)], null=True, blank=True)
+    reason = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'date'], name='unique_opening_exception_date'),
+            models.CheckConstraint(
+                check=(
+                    models.Q(start_hour__isnull=True, end_hour__isnull=True)
+                    | models.Q(start_hour__isnull=False, end_hour__isnull=False, start_hour__lte=models.F('end_hour'))
+                ),
+                name='opening_exception_in_order',
+                violation_error_message='Set both hours, the first one not after the last, or neither to close.',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.field.name} hours on {self.date}"
+
+
+class FieldAvailability(models.Model):
+    # Booked 16:00 - 21:00 slots of a field on one date, one bit per hour (see availability.py)
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField()
+    booked_mask = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'date'], name='unique_field_availability_date'),
+        ]
+
+    def __str__(self):
+        return f"Availability for {self.field.name} on {self.date}"
+
+
+class FieldDailyStats(models.Model):
+    # Booked hours of a field per day and per month, kept up to date by rollups.py so the owner
+    # dashboard never counts reservations; revenue is bookings x the field's price per hour
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField()
+    bookings = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'date'], name='unique_field_daily_stats'),
+        ]
+
+    def __str__(self):
+        return f"{self.bookings} bookings for {self.field.name} on {self.date}"
+
+
+class FieldMonthlyStats(models.Model):
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, db_index=False)
+    # First day of the month
+    month = models.DateField()
+    bookings = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'month'], name='unique_field_monthly_stats'),
+        ]
+
+    def __str__(self):
+        return f"{self.bookings} bookings for {self.field.name} in {self.month:%Y-%m}"
+
+
 class Review(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    field = models.ForeignKey(Field, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, db_index=False)
     rating = models.IntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # One review per player and field, also the has_reviewed lookup
+            models.UniqueConstraint(fields=['user', 'field'], name='unique_field_review'),
+        ]
+        indexes = [
+            models.Index(fields=['field', '-created_at', '-id'], name='review_field_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keeps the field rating statistics (see signals.py) in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Review for {self.field.name} by {self.user.username}"
 
@@ -128,29 +369,83 @@ class Event(models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
     date_published = models.DateTimeField(auto_now_add=True)
-    field = models.ForeignKey(Field, on_delete=models.CASCADE, blank=True, null=True)
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, blank=True, null=True, db_index=False)
     image = models.URLField(blank=True, null=True)
     sport = models.CharField(max_length=100, choices=SPORT_CHOICES)
     entry_fee=models.PositiveIntegerField(blank=False, default=0)
     event_date = models.DateTimeField(blank=False, default=timezone.now)
     slug = models.SlugField(unique=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date_published', '-id'], name='event_published_idx'),
+            models.Index(fields=['field', '-date_published', '-id'], name='event_field_published_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.title)
+        # registered_count is only changed by signups.py, never written back from an edit form
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'registered_count'
+            ]
         super().save(*args, **kwargs)
 
     def get_absolute_url(self):
         return reverse('event_detail', kwargs={'slug': self.slug})
 
-    max_sign_ups = models.PositiveIntegerField(default=0)
+    max_sign_ups = models.PositiveIntegerField(default=0, help_text='0 means no limit')
+    registered_count = models.PositiveIntegerField(default=0, editable=False)
+
+    @property
+    def has_limit(self):
+        return self.max_sign_ups > 0
+
+    @property
+    def spots_left(self):
+        if not self.has_limit:
+            return None
+        return max(self.max_sign_ups - self.registered_count, 0)
+
+    @property
+    def is_full(self):
+        return self.has_limit and self.registered_count >= self.max_sign_ups
+
     def __str__(self):
         return self.title
 
 class UserEventRegistration(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    event = models.ForeignKey(Event, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, db_index=False)
     registration_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'event'], name='unique_event_registration'),
+        ]
+        indexes = [
+            models.Index(fields=['event', 'registration_date', 'id'], name='registration_event_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.event.title}"
+
+
+class EventWaitlistEntry(models.Model):
+    # Entries are served in id order; a position is the number of earlier entries of the event,
+    # so joining or leaving never renumbers other rows
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, db_index=False)
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'event'], name='unique_event_waitlist_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['event', 'id'], name='waitlist_event_order_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} waiting for {self.event.title}"
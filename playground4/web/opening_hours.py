@@ -0,0 +1,62 @@
+from django.utils import timezone
+
+from . import availability
+from .models import Field, OpeningException, OpeningHours
+
+# A field is open on its usual working days and hours unless an OpeningHours row gives a weekday
+# other hours, or an OpeningException row a date. compile_field() turns them into
+# Field.opening_mask, one day mask (see availability.py) per weekday from Monday, and
+# Field.opening_exception_masks for the upcoming dates. A signal compiles them on every save of
+# the field or of its rows, so reading them costs no query and is never stale.
+DAY_BITS = len(availability.HOURS)
+
+
+def hours_mask(start_hour, end_hour):
+    # Both inclusive, None when closed
+    if start_hour is None:
+        return 0
+    return availability.hours_mask(range(start_hour, end_hour + 1))
+
+
+def week_shift(weekday):
+    # weekday 1-7, Monday-Sunday
+    return (weekday - 1) * DAY_BITS
+
+
+def usual_day_mask(field, weekday):
+    if field.start_working_day <= weekday <= field.end_working_day:
+        return hours_mask(field.start_working_hour, field.end_working_hour)
+    return 0
+
+
+def compile_field(field, today=None):
+    # Reads the rows of a saved field (two queries), a new one has none yet. Past exceptions are
+    # left out, those dates can't be booked any more.
+    weekdays, exceptions = {}, {}
+    if not field._state.adding:
+        today = today or timezone.localdate()
+        weekdays = {
+            weekday: hours_mask(start_hour, end_hour)
+            for weekday, start_hour, end_hour in OpeningHours.objects.filter(field=field).values_list(
+                'weekday', 'start_hour', 'end_hour'
+            )
+        }
+        exceptions = {
+            date.isoformat(): hours_mask(start_hour, end_hour)
+            for date, start_hour, end_hour in OpeningException.objects.filter(field=field, date__gte=today).values_list(
+                'date', 'start_hour', 'end_hour'
+            )
+        }
+
+    mask = 0
+    for weekday, name in Field.DAY_CHOICES:
+        mask |= weekdays.get(weekday, usual_day_mask(field, weekday)) << week_shift(weekday)
+    field.opening_mask = mask
+    field.opening_exception_masks = exceptions
+
+
+def refresh(field_id):
+    # After the rows of a field changed; saving compiles them (signals.py)
+    field = Field.objects.filter(pk=field_id).first()
+    if field is not None:
+        field.save(update_fields=['opening_mask', 'opening_exception_masks'])
@@ -0,0 +1,118 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+
+from . import replicas
+
+VERSION_KEY = 'page-cache-version:{}'
+
+
+def _new_version():
+    # Time based, so a version key evicted from the cache never comes back with an old value
+    return time.time_ns()
+
+
+def get_versions(scopes):
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = VERSION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), timeout=None)
+
+
+def invalidate(*scopes):
+    # Once now, so pages rendered inside the transaction aren't reused, and once after commit,
+    # so a page rendered by another request between the two isn't kept either
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def page_key(request, scopes):
+    user = request.user
+    auth_state = f'user:{user.pk}' if user.is_authenticated else 'anon'
+    parts = [request.get_full_path(), auth_state] + [str(version) for version in get_versions(scopes)]
+    return 'page-cache:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def cache_catalog_page(*scopes, timeout=None):
+    # Caches GET responses per URL and user. `scopes` name the data the page shows, e.g. 'field'
+    # for every field or 'review:{pk}' for the reviews of the field in the URL; saving or deleting
+    # such rows calls invalidate() for the matching scopes (see signals.py).
+    def decorator(view):
+        def page_timeout():
+            page_timeout = settings.CATALOG_CACHE_TIMEOUT if timeout is None else timeout
+            if replicas.reading_from_replica():
+                # A lagging replica may have missed the write behind the last invalidation
+                page_timeout = min(page_timeout, settings.READ_YOUR_WRITES_SECONDS)
+            return page_timeout
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+
+                # The key needs request.user, which may still have to be loaded from the database
+                key = await sync_to_async(page_key)(request, [scope.format(**kwargs) for scope in scopes])
+                response = await cache.aget(key)
+                if response is not None:
+                    return response
+
+                response = await view(request, *args, **kwargs)
+                patch_vary_headers(response, ('Cookie',))
+                # Async views return rendered responses; pages with a CSRF token are tied to the
+                # session that rendered them
+                if response.status_code == 200 and not response.streaming and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+                    await cache.aset(key, response, page_timeout())
+                return response
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            key = page_key(request, [scope.format(**kwargs) for scope in scopes])
+            response = cache.get(key)
+            if response is not None:
+                return response
+
+            response = view(request, *args, **kwargs)
+            patch_vary_headers(response, ('Cookie',))
+            if response.status_code != 200 or response.streaming:
+                return response
+
+            timeout_seconds = page_timeout()
+
+            def store(rendered):
+                # Pages with a CSRF token are tied to the session that rendered them
+                if not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+                    cache.set(key, rendered, timeout_seconds)
+
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,167 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Field, Func, Value
+
+PER_PAGE = 20
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder drops microseconds, which would skip rows that share a millisecond
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    def __init__(self, items, next_url=None, previous_url=None):
+        self.items = items
+        self.next_url = next_url
+        self.previous_url = previous_url
+
+    @property
+    def has_next(self):
+        return self.next_url is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_url is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'v': values, 'd': direction}, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(queryset, ordering, cursor):
+    # Returns (values, direction) or None for a missing or tampered cursor
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values, direction = payload['v'], payload['d']
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        return None
+    if direction not in ('next', 'previous') or not isinstance(values, list) or len(values) != len(ordering):
+        return None
+
+    decoded = []
+    for name, value in zip(field_names(ordering), values):
+        try:
+            decoded.append(queryset.model._meta.get_field(name).to_python(value))
+        except FieldDoesNotExist:
+            # Annotations such as a search rank are stored as plain JSON values
+            decoded.append(value)
+        except ValidationError:
+            return None
+    return decoded, direction
+
+
+def field_names(ordering):
+    return [name.lstrip('-') for name in ordering]
+
+
+def reverse_ordering(ordering):
+    return [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+
+
+class RowValue(Func):
+    # A row constructor, (a, b, ...): Postgres compares rows column by column, and a comparison
+    # of indexed columns to a row of values is an index range condition
+    template = '(%(expressions)s)'
+    output_field = Field()
+
+
+def check_ordering(ordering):
+    # A row comparison only matches the ordering when every column sorts the same way
+    if len({name.startswith('-') for name in ordering}) != 1:
+        raise ValueError(f'Keyset orderings must sort every column in the same direction: {ordering}')
+
+
+def after(queryset, ordering, values):
+    # Rows strictly after `values` in `ordering`, as (a, b) > (x, y), or < for a descending one
+    lookup = 'lt' if ordering[0].startswith('-') else 'gt'
+    key = RowValue(*[F(name) for name in field_names(ordering)])
+    return queryset.alias(keyset_key=key).filter(**{f'keyset_key__{lookup}': RowValue(*[Value(value) for value in values])})
+
+
+def page_url(request, cursor):
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return f'?{query.urlencode()}'
+
+
+def keyset_paginate(request, queryset, ordering, per_page=PER_PAGE):
+    # `ordering` must end with a unique column (usually id) so every row has a distinct key, and
+    # sort all columns the same way; the database then reads per_page + 1 entries of an index on
+    # those columns, however deep the page is.
+    ordering = list(ordering)
+    check_ordering(ordering)
+    cursor = decode_cursor(queryset, ordering, request.GET.get('cursor', ''))
+    rows = list(page_queryset(queryset, ordering, cursor, per_page))
+    return keyset_page(request, rows, ordering, cursor, per_page)
+
+
+async def akeyset_paginate(request, queryset, ordering, per_page=PER_PAGE):
+    # keyset_paginate() for async views
+    ordering = list(ordering)
+    check_ordering(ordering)
+    cursor = decode_cursor(queryset, ordering, request.GET.get('cursor', ''))
+    rows = [row async for row in page_queryset(queryset, ordering, cursor, per_page)]
+    return keyset_page(request, rows, ordering, cursor, per_page)
+
+
+def page_queryset(queryset, ordering, cursor, per_page):
+    # The rows of the page plus one, which tells whether another page follows
+    if cursor is None:
+        return queryset.order_by(*ordering)[:per_page + 1]
+    if cursor[1] == 'next':
+        return after(queryset, ordering, cursor[0]).order_by(*ordering)[:per_page + 1]
+    backwards = reverse_ordering(ordering)
+    return after(queryset, backwards, cursor[0]).order_by(*backwards)[:per_page + 1]
+
+
+def keyset_page(request, rows, ordering, cursor, per_page):
+    if cursor is None:
+        has_more, has_before = len(rows) > per_page, False
+        items = rows[:per_page]
+    elif cursor[1] == 'next':
+        has_more, has_before = len(rows) > per_page, True
+        items = rows[:per_page]
+    else:
+        has_more, has_before = True, len(rows) > per_page
+        items = rows[:per_page][::-1]
+
+    names = field_names(ordering)
+
+    def key(item):
+        return [getattr(item, name) for name in names]
+
+    next_url = page_url(request, encode_cursor(key(items[-1]), 'next')) if items and has_more else None
+    previous_url = page_url(request, encode_cursor(key(items[0]), 'previous')) if items and has_before else None
+    return KeysetPage(items, next_url, previous_url)
+
+
+class KeysetPaginationMixin:
+    # For ListViews: replaces the object list with one keyset page and adds `page` to the context
+    keyset_ordering = ['id']
+    keyset_per_page = PER_PAGE
+
+    def get_context_data(self, **kwargs):
+        page = keyset_paginate(self.request, self.object_list, self.keyset_ordering, self.keyset_per_page)
+        kwargs['object_list'] = page.items
+        kwargs['page'] = page
+        return super().get_context_data(**kwargs)
@@ -0,0 +1,124 @@
+import datetime
+import re
+
+from django.db import connection, transaction
+
+from .models import Reservation
+
+# Reservation is range partitioned by reservation_date month (migration 0038). Months without
+# a partition land in the default one, so create_partition() moves such rows over.
+TABLE = Reservation._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+ARCHIVE_SCHEMA = 'archive'
+MONTHS_AHEAD = 12
+
+# Postgres 16 has no exclusion constraints on partitioned tables, every partition gets this one
+# (see Reservation.period)
+OVERLAP_CONSTRAINT = (
+    "ALTER TABLE {partition} ADD CONSTRAINT {partition}_no_overlap "
+    "EXCLUDE USING gist (int8range(field_id, field_id, '[]') WITH &&, period WITH &&)"
+)
+
+BOUNDS = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})'\) TO \('(\d{4}-\d{2}-\d{2})'\)")
+
+
+def next_month(month):
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month):
+    return f'{TABLE}_{month:%Y_%m}'
+
+
+def partitions():
+    # [(name, first day, day after the last day)]; the default partition has no bounds
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            ORDER BY child.relname
+            """,
+            [TABLE],
+        )
+        rows = cursor.fetchall()
+
+    result = []
+    for name, bound in rows:
+        match = BOUNDS.search(bound)
+        if match:
+            result.append((name, datetime.date.fromisoformat(match[1]), datetime.date.fromisoformat(match[2])))
+        else:
+            result.append((name, None, None))
+    return result
+
+
+def waiting_months():
+    # First days of the months with rows in the default partition, e.g. history inserted with raw
+    # SQL before its month had a partition
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT DISTINCT date_trunc('month', reservation_date)::date FROM {DEFAULT_PARTITION} ORDER BY 1")
+        return [month for month, in cursor.fetchall()]
+
+
+def create_partitions(months):
+    # Returns the names of the partitions created; months that already have one are skipped
+    existing = {name for name, start, end in partitions()}
+    months = sorted({month for month in months if partition_name(month) not in existing})
+    if not months:
+        return []
+
+    waiting = set(waiting_months())
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Postgres refuses a new partition while the default one holds rows of its range; it is
+        # detached once however many months it holds rows of
+        moving = waiting.intersection(months)
+        if moving:
+            cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+        for month in months:
+            name = partition_name(month)
+            bounds = [month, next_month(month)]
+            cursor.execute(f'CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)', bounds)
+            cursor.execute(OVERLAP_CONSTRAINT.format(partition=name))
+            if month in moving:
+                cursor.execute(
+                    f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE reservation_date >= %s AND reservation_date < %s RETURNING *) '
+                    f'INSERT INTO {name} SELECT * FROM moved',
+                    bounds,
+                )
+        if moving:
+            cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    return [partition_name(month) for month in months]
+
+
+def create_partition(month):
+    # Returns False if the month already has a partition
+    return bool(create_partitions([month]))
+
+
+def ensure_partitions(today, months_ahead=MONTHS_AHEAD):
+    # Partitions from this month up to `months_ahead` months later, and for every other month
+    # with rows waiting in the default partition, so those can be archived and the history
+    # view scans only its months; returns the created names
+    months = [today.replace(day=1)]
+    for _ in range(months_ahead):
+        months.append(next_month(months[-1]))
+    return create_partitions(months + waiting_months())
+
+
+def archive_partitions(before):
+    # Detaches the partitions of months before `before` and moves them to the archive schema,
+    # where they stay queryable by hand but no longer weigh on the app's queries. The booking
+    # rollups of those months are kept; rebuild_rollups would forget them.
+    archived = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}')
+        for name, start, end in partitions():
+            if end is None or end > before:
+                continue
+            cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+            cursor.execute(f'ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}')
+            archived.append(name)
+    return archived
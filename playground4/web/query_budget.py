@@ -0,0 +1,106 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Most queries a GET of each named URL may run, counting the session and user lookups.
+# A budget holds for any number of rows on the page, QueryBudgetTest renders every URL
+# with few and with many rows to keep it that way.
+QUERY_BUDGETS = {
+    'register': 2,
+    'login_success': 2,
+    'login': 2,
+    'home': 2,
+    'logout': 4,
+    'profile': 2,
+    'profile_edit': 3,
+    'profile_delete': 3,
+    'add_field': 2,
+    'update_field': 5,  # The field and its opening hours and upcoming exceptions
+    'delete_field': 3,
+    'field_list': 3,
+    'my_fields': 3,
+    'owner_dashboard': 5,
+    'field_search': 3,
+    'free_field_search': 3,
+    'field_detail': 4,
+    'reservation_form': 4,
+    'recurring_reservation_form': 3,
+    'slot_hold': 0,  # POST only
+    'slot_events': 2,  # The free hours when the stream opens
+    'field_availability': 2,
+    'reservation_confirmation': 3,
+    'schedule': 3,
+    'schedule_history': 3,
+    'field_schedule': 4,
+    'reservation_cancel': 0,  # POST only
+    'export_reservations': 3,
+    'add_review': 2,
+    'reviews': 4,
+    'field_owner_reviews': 4,
+    'add_event': 3,
+    'events_list': 4,
+    'all_events_list': 3,
+    'field_list_by_sport': 3,
+    'event_detail': 4,
+    'registered_users_list': 4,
+    'my_signed_up_events': 4,
+    'cancel_sign_up': 13,  # Cancels on GET and promotes the first waiting user
+    'leave_waitlist': 2,
+    'change_password': 2,
+    'metrics': 2,
+}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def query_done(self, seconds):
+        self.count += 1
+
+
+def count_queries():
+    # Counts the queries of the block on every connection, also those of sync_to_async threads
+    return metrics.observing(QueryCounter())
+
+
+class QueryBudgetMiddleware:
+    # Development aid: logs GET requests that ran more queries than their URL's budget
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with count_queries() as counter:
+            response = self.get_response(request)
+        self.check(request, counter)
+        return response
+
+    async def __acall__(self, request):
+        with count_queries() as counter:
+            response = await self.get_response(request)
+        self.check(request, counter)
+        return response
+
+    def check(self, request, counter):
+        match = request.resolver_match
+        budget = QUERY_BUDGETS.get(match.url_name) if match else None
+        if request.method in ('GET', 'HEAD') and budget is not None and counter.count > budget:
+            logger.warning(
+                'Query budget exceeded: %s %s ran %d queries, the budget for %r is %d',
+                request.method, request.path, counter.count, match.url_name, budget,
+            )
@@ -0,0 +1,35 @@
+from django.db.models import Count, F, Q, Sum
+
+from .models import Field, Review
+
+
+def add_rating(field_id, rating, count=1):
+    Field.objects.filter(pk=field_id).update(**{
+        'rating_count': F('rating_count') + count,
+        'rating_sum': F('rating_sum') + rating * count,
+        f'rating_{rating}': F(f'rating_{rating}') + count,
+    })
+
+
+def remove_rating(field_id, rating):
+    add_rating(field_id, rating, count=-1)
+
+
+def rebuild_rating_stats(fields=None):
+    # Recomputes the statistics from the reviews, one aggregate query for all fields
+    fields = Field.objects.all() if fields is None else fields
+    stats = Review.objects.filter(field__in=fields).values('field_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'rating_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)},
+    )
+    stats = {row.pop('field_id'): row for row in stats}
+    empty = {name: 0 for name in Field.RATING_FIELDS}
+
+    updated = []
+    for field in fields.only('pk'):
+        for name, value in stats.get(field.pk, empty).items():
+            setattr(field, name, value)
+        updated.append(field)
+    Field.objects.bulk_update(updated, Field.RATING_FIELDS, batch_size=500)
+    return len(updated)
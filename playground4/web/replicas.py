@@ -0,0 +1,132 @@
+import contextvars
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+
+logger = logging.getLogger(__name__)
+
+# Set for READ_YOUR_WRITES_SECONDS after a request that wrote, so the user's next requests read
+# their own booking, review or sign-up from the primary
+PIN_COOKIE = 'read_primary'
+
+_routing = contextvars.ContextVar('replica_routing', default=None)
+
+# alias -> time.monotonic() until which a failed replica is skipped
+_down_until = {}
+
+
+class Routing:
+    # Per request: the replica to read from, if any, and whether the request wrote
+    def __init__(self):
+        self.read_alias = None
+        self.wrote = False
+
+
+def mark_down(alias):
+    logger.warning('Database replica %s failed, reading from the primary for %s seconds', alias, settings.REPLICA_RETRY_SECONDS)
+    _down_until[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+    try:
+        connections[alias].close()
+    except DatabaseError:
+        pass
+
+
+def available_replica():
+    # A random replica that accepts connections, None when all of them are down
+    now = time.monotonic()
+    replicas = [alias for alias in settings.DATABASE_REPLICAS if _down_until.get(alias, 0) <= now]
+    random.shuffle(replicas)
+    for alias in replicas:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            mark_down(alias)
+        else:
+            return alias
+    return None
+
+
+def reading_from_replica():
+    routing = _routing.get()
+    return routing is not None and routing.read_alias is not None and not routing.wrote
+
+
+class ReplicaRouter:
+    # Reads go to a replica only inside requests ReplicaMiddleware picked one for; everything
+    # else, writes, sessions, slot holds and migrations stay on the primary
+    def db_for_read(self, model, **hints):
+        # Slot holds are an unlogged table, which replicas don't have the rows of
+        if model._meta.app_label == 'sessions' or model._meta.label == 'web.SlotHold' or not reading_from_replica():
+            return None
+        return _routing.get().read_alias
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    # Innermost middleware: sessions are saved after it returns, so they never count as writes
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = Routing()
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin(routing, response)
+
+    async def __acall__(self, request):
+        routing = Routing()
+        token = _routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin(routing, response)
+
+    def pin(self, routing, response):
+        if routing.wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.READ_YOUR_WRITES_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method in ('GET', 'HEAD')
+            and request.resolver_match.url_name in settings.REPLICA_VIEWS
+            and PIN_COOKIE not in request.COOKIES
+        ):
+            _routing.get().read_alias = available_replica()
+
+    def process_exception(self, request, exception):
+        # A replica lost mid-request fails that request, the following ones read from the
+        # primary until the replica is retried
+        routing = _routing.get()
+        if routing is not None and routing.read_alias is not None and isinstance(exception, (OperationalError, InterfaceError)):
+            mark_down(routing.read_alias)
@@ -0,0 +1,128 @@
+import calendar
+import datetime
+from collections import Counter
+
+from django.db.models import Case, F, Sum, When
+from django.db.models.functions import TruncMonth
+
+from . import availability
+from .models import Field, FieldDailyStats, FieldMonthlyStats, Reservation
+
+PERIODS = ('day', 'week', 'month')
+
+
+def add_bookings(field_id, dates, count=1):
+    # `dates` has one entry per booked hour; two queries per table for any number of dates
+    # Reservations created with ISO strings keep them until they are reloaded
+    dates = [FieldDailyStats._meta.get_field('date').to_python(date) for date in dates]
+    _add(FieldDailyStats, 'date', field_id, Counter(dates), count)
+    _add(FieldMonthlyStats, 'month', field_id, Counter(date.replace(day=1) for date in dates), count)
+
+
+def remove_bookings(field_id, dates):
+    add_bookings(field_id, dates, count=-1)
+
+
+def _add(model, key, field_id, counts, sign):
+    # Removals only touch existing rows: deleting a field or its owner deletes its rows before its
+    # reservations, whose signals must not create them again with negative counts
+    if sign > 0:
+        model.objects.bulk_create([model(field_id=field_id, **{key: value}) for value in counts], ignore_conflicts=True)
+    model.objects.filter(field_id=field_id, **{f'{key}__in': counts}).update(
+        bookings=Case(
+            *[When(**{key: value}, then=F('bookings') + sign * number) for value, number in counts.items()],
+            default=F('bookings'),
+            output_field=model._meta.get_field('bookings'),
+        )
+    )
+
+
+def rebuild_rollups(fields=None):
+    # Recomputes both tables from the reservations with one aggregate query each, counting hours
+    fields = Field.objects.all() if fields is None else fields
+    reservations = Reservation.objects.filter(field__in=fields).order_by()
+    FieldDailyStats.objects.filter(field__in=fields).delete()
+    FieldMonthlyStats.objects.filter(field__in=fields).delete()
+    FieldDailyStats.objects.bulk_create(
+        (
+            FieldDailyStats(field_id=row['field_id'], date=row['reservation_date'], bookings=row['bookings'])
+            for row in reservations.values('field_id', 'reservation_date').annotate(bookings=Sum('duration')).iterator()
+        ),
+        batch_size=5000,
+    )
+    FieldMonthlyStats.objects.bulk_create(
+        [
+            FieldMonthlyStats(field_id=row['field_id'], month=row['month'], bookings=row['bookings'])
+            for row in reservations.annotate(month=TruncMonth('reservation_date')).values('field_id', 'month').annotate(bookings=Sum('duration'))
+        ],
+        batch_size=5000,
+    )
+
+
+def period_ranges(today):
+    week_start = today - datetime.timedelta(days=today.weekday())
+    month_start = today.replace(day=1)
+    month_end = month_start.replace(day=calendar.monthrange(today.year, today.month)[1])
+    return {
+        'day': (today, today),
+        'week': (week_start, week_start + datetime.timedelta(days=6)),
+        'month': (month_start, month_end),
+    }
+
+
+def open_hours(field, start_date, end_date):
+    hours = 0
+    date = start_date
+    while date <= end_date:
+        hours += bin(availability.working_mask(field, date)).count('1')
+        date += datetime.timedelta(days=1)
+    return hours
+
+
+def period_summary(bookings, hours, price):
+    return {
+        'bookings': bookings,
+        'revenue': bookings * price,
+        'occupancy': round(bookings * 100 / hours) if hours else None,
+    }
+
+
+def owner_summary(owner, today):
+    # Day, week and month totals per field of the owner, plus a row for all fields: three
+    # queries over at most a week of daily rows and one monthly row per field
+    ranges = period_ranges(today)
+    week_start, week_end = ranges['week']
+    fields = list(Field.objects.filter(field_owner=owner).order_by('name', 'id'))
+    daily = FieldDailyStats.objects.filter(field__field_owner=owner, date__range=(week_start, week_end))
+    monthly = dict(
+        FieldMonthlyStats.objects.filter(field__field_owner=owner, month=ranges['month'][0]).values_list('field_id', 'bookings')
+    )
+
+    bookings = {(field.pk, period): 0 for field in fields for period in PERIODS}
+    for field_id, date, count in daily.values_list('field_id', 'date', 'bookings'):
+        bookings[(field_id, 'week')] += count
+        if date == today:
+            bookings[(field_id, 'day')] += count
+    for field_id, count in monthly.items():
+        bookings[(field_id, 'month')] = count
+
+    rows = []
+    totals = {period: {'bookings': 0, 'revenue': 0, 'hours': 0} for period in PERIODS}
+    for field in fields:
+        row = {'field': field}
+        for period in PERIODS:
+            hours = open_hours(field, *ranges[period])
+            row[period] = period_summary(bookings[(field.pk, period)], hours, field.price_per_hour)
+            totals[period]['bookings'] += row[period]['bookings']
+            totals[period]['revenue'] += row[period]['revenue']
+            totals[period]['hours'] += hours
+        rows.append(row)
+
+    total = {
+        period: dict(
+            period_summary(totals[period]['bookings'], totals[period]['hours'], 0),
+            revenue=totals[period]['revenue'],
+        )
+        for period in PERIODS
+    }
+    return {'ranges': ranges, 'rows': rows, 'total': total}
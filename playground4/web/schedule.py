@@ -0,0 +1,52 @@
+import calendar
+import datetime
+
+from . import availability
+from .models import Reservation
+
+SPANS = ('week', 'month')
+
+
+def schedule_span(date, span):
+    # (first day, last day, first day of the previous span, first day of the next span)
+    if span == 'month':
+        start = date.replace(day=1)
+        end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+        previous_start = (start - datetime.timedelta(days=1)).replace(day=1)
+        return start, end, previous_start, end + datetime.timedelta(days=1)
+
+    start = date - datetime.timedelta(days=date.weekday())
+    end = start + datetime.timedelta(days=6)
+    return start, end, start - datetime.timedelta(weeks=1), start + datetime.timedelta(weeks=1)
+
+
+def schedule_grid(field, start, end):
+    # Day x hour matrix of the field's reservations, filled from a single query. A reservation
+    # is one cell spanning its hours.
+    reservations = Reservation.objects.filter(
+        field=field,
+        reservation_date__range=(start, end),
+    ).select_related('user')
+    booked = {}
+    for reservation in reservations:
+        for hour in range(reservation.reservation_hour, reservation.end_hour):
+            booked[(reservation.reservation_date, hour)] = reservation
+
+    days = []
+    date = start
+    while date <= end:
+        open_mask = availability.working_mask(field, date)
+        cells = []
+        for hour in availability.HOURS:
+            reservation = booked.get((date, hour))
+            if reservation is not None and hour != reservation.reservation_hour:
+                continue
+            cells.append({
+                'hour': hour,
+                'reservation': reservation,
+                'span': reservation.duration if reservation else 1,
+                'open': bool(open_mask & availability.hour_bit(hour)),
+            })
+        days.append({'date': date, 'cells': cells})
+        date += datetime.timedelta(days=1)
+    return days
@@ -0,0 +1,48 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import BigIntegerField, Exists, F, FloatField, IntegerField, OuterRef
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, Coalesce
+
+from . import availability, opening_hours
+from .models import Field, Reservation, reservation_period
+
+SEARCH_CONFIG = 'english'
+
+
+def search_fields(text='', sport='', min_price=None, max_price=None):
+    # Returns (queryset, keyset ordering): best matches first, or plain catalog order without text
+    fields = Field.objects.all()
+    if sport:
+        fields = fields.filter(sport=sport)
+    if min_price is not None:
+        fields = fields.filter(price_per_hour__gte=min_price)
+    if max_price is not None:
+        fields = fields.filter(price_per_hour__lte=max_price)
+
+    if not text:
+        return fields, ['id']
+
+    query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+    # ts_rank returns a real; as double precision the rank survives the round trip through a cursor exactly
+    fields = fields.filter(search_vector=query).annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+    return fields, ['-rank', '-id']
+
+
+def free_fields(sport, date, hour_from, hour_to=None):
+    # Fields of a sport open for every hour of [hour_from, hour_to] on `date` with none of those
+    # hours reserved, as a single anti-join: the date's bookings overlapping the hours come from
+    # the overlap index in one scan and are matched to the candidate fields by id. Opening hours
+    # come from the schedule compiled onto each field (see opening_hours.py).
+    hour_to = hour_from if hour_to is None else hour_to
+    wanted = availability.hours_mask(range(hour_from, hour_to + 1))
+    open_mask = Coalesce(
+        Cast(KeyTextTransform(date.isoformat(), 'opening_exception_masks'), IntegerField()),
+        F('opening_mask').bitrightshift(opening_hours.week_shift(date.isoweekday())).bitand(availability.FULL_MASK),
+        output_field=BigIntegerField(),
+    )
+    taken = Reservation.objects.filter(
+        field=OuterRef('pk'),
+        reservation_date=date,
+        period__overlap=reservation_period(date, hour_from, hour_to - hour_from + 1),
+    )
+    return Field.objects.alias(wanted_open=open_mask.bitand(wanted)).filter(~Exists(taken), sport=sport, wanted_open=wanted)
@@ -0,0 +1,128 @@
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import availability, live_slots, metrics, opening_hours, page_cache, ratings, rollups, signups
+from .models import Event, Field, OpeningException, OpeningHours, Reservation, Review, User, UserEventRegistration
+
+
+def slot_hours(date, hour, duration):
+    return [(date, hour + offset) for offset in range(duration)]
+
+
+@receiver(pre_save, sender=Reservation)
+def remember_reserved_slot(sender, instance, **kwargs):
+    # An edited reservation (e.g. from the admin) may move to other hours
+    instance._previous_slot = None
+    if instance.pk:
+        instance._previous_slot = Reservation.objects.filter(pk=instance.pk).values_list(
+            'field_id', 'reservation_date', 'reservation_hour', 'duration'
+        ).first()
+
+
+@receiver(post_save, sender=Reservation)
+def reservation_saved(sender, instance, created, **kwargs):
+    slot = (instance.field_id, instance.reservation_date, instance.reservation_hour, instance.duration)
+    previous_slot = getattr(instance, '_previous_slot', None)
+    if previous_slot == slot:
+        return
+    if previous_slot:
+        field_id, date, hour, duration = previous_slot
+        availability.mark_freed(*previous_slot)
+        rollups.remove_bookings(field_id, [date] * duration)
+        live_slots.publish(field_id, live_slots.FREED, slot_hours(date, hour, duration))
+    availability.mark_booked(*slot)
+    rollups.add_bookings(instance.field_id, [instance.reservation_date] * instance.duration)
+    live_slots.publish(instance.field_id, live_slots.TAKEN, slot_hours(*slot[1:]))
+
+
+@receiver(post_delete, sender=Reservation)
+def reservation_deleted(sender, instance, **kwargs):
+    slot = (instance.reservation_date, instance.reservation_hour, instance.duration)
+    availability.mark_freed(instance.field_id, *slot)
+    rollups.remove_bookings(instance.field_id, [instance.reservation_date] * instance.duration)
+    live_slots.publish(instance.field_id, live_slots.FREED, slot_hours(*slot))
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = Review.objects.filter(pk=instance.pk).values_list('field_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    rating = (instance.field_id, instance.rating)
+    previous_rating = getattr(instance, '_previous_rating', None)
+    if previous_rating == rating:
+        return
+    if previous_rating:
+        ratings.remove_rating(*previous_rating)
+    ratings.add_rating(*rating)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    ratings.remove_rating(instance.field_id, instance.rating)
+
+
+@receiver(pre_save, sender=Field)
+def compile_opening_hours(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'opening_mask' in update_fields:
+        opening_hours.compile_field(instance)
+
+
+@receiver(post_save, sender=OpeningHours)
+@receiver(post_delete, sender=OpeningHours)
+@receiver(post_save, sender=OpeningException)
+@receiver(post_delete, sender=OpeningException)
+def opening_hours_changed(sender, instance, origin=None, **kwargs):
+    # Not while the field itself or its owner is being deleted
+    if origin is None or getattr(origin, 'model', type(origin)) is sender:
+        opening_hours.refresh(instance.field_id)
+
+
+@receiver(post_save, sender=Field)
+@receiver(post_delete, sender=Field)
+def invalidate_field_pages(sender, instance, **kwargs):
+    page_cache.invalidate('field', f'field:{instance.pk}')
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def invalidate_event_pages(sender, instance, **kwargs):
+    page_cache.invalidate('event', f'event:{instance.field_id}')
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_pages(sender, instance, **kwargs):
+    # Also covers the rating shown on field cards
+    page_cache.invalidate('review', f'review:{instance.field_id}')
+
+
+@receiver(post_delete, sender=UserEventRegistration)
+def registration_deleted(sender, instance, origin=None, **kwargs):
+    Event.objects.filter(pk=instance.event_id).update(registered_count=F('registered_count') - 1)
+    field_ids = Event.objects.filter(pk=instance.event_id).values_list('field_id', flat=True)
+    page_cache.invalidate('event', *[f'event:{field_id}' for field_id in field_ids])
+
+    # No promotion when the event itself (or its field) is being deleted
+    origin_model = getattr(origin, 'model', type(origin))
+    if origin_model in (UserEventRegistration, User):
+        signups.promote_waitlist(instance.event_id)
+
+
+@receiver(post_save, sender=Event)
+def event_saved(sender, instance, created, **kwargs):
+    # A raised capacity lets waiting users in
+    if not created:
+        signups.promote_waitlist(instance.pk)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    metrics.observe_queries(connection)
+    metrics.connection_opened(connection.alias)
@@ -0,0 +1,103 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+
+from . import page_cache
+from .models import Event, EventWaitlistEntry, UserEventRegistration
+
+
+class EventFull(Exception):
+    pass
+
+
+class AlreadySignedUp(Exception):
+    pass
+
+
+class AlreadyWaitlisted(Exception):
+    pass
+
+
+def claim_spot(event_id):
+    # Takes a spot only while the event is below capacity; concurrent claims queue on the
+    # event row for the length of the caller's short transaction
+    return Event.objects.filter(
+        Q(max_sign_ups=0) | Q(registered_count__lt=F('max_sign_ups')),
+        pk=event_id,
+    ).update(registered_count=F('registered_count') + 1)
+
+
+def register(user, event):
+    try:
+        with transaction.atomic():
+            registration = UserEventRegistration.objects.create(user=user, event=event)
+    except IntegrityError:
+        # Leaving the caller's atomic block with an exception gives the spot back
+        raise AlreadySignedUp
+    EventWaitlistEntry.objects.filter(user=user, event=event).delete()
+    page_cache.invalidate('event', f'event:{event.field_id}')
+    return registration
+
+
+def sign_up(user, event):
+    with transaction.atomic():
+        if not claim_spot(event.pk):
+            raise EventFull
+        return register(user, event)
+
+
+def join_waitlist(user, event):
+    # Returns the registration when a spot is free after all, otherwise the waitlist entry
+    with transaction.atomic():
+        # The lock orders this against cancellations, so nobody waits while a spot is open
+        Event.objects.select_for_update().filter(pk=event.pk).first()
+        if UserEventRegistration.objects.filter(user=user, event=event).exists():
+            raise AlreadySignedUp
+        if claim_spot(event.pk):
+            return register(user, event)
+        try:
+            with transaction.atomic():
+                return EventWaitlistEntry.objects.create(user=user, event=event)
+        except IntegrityError:
+            raise AlreadyWaitlisted
+
+
+def leave_waitlist(user, event_id):
+    deleted, _ = EventWaitlistEntry.objects.filter(user=user, event_id=event_id).delete()
+    return bool(deleted)
+
+
+def promote_waitlist(event_id):
+    # Moves waiting users into free spots, first come first served
+    promoted = []
+    with transaction.atomic():
+        # Two promotions of the same event never pick the same entry
+        Event.objects.select_for_update().filter(pk=event_id).first()
+        while True:
+            entry = EventWaitlistEntry.objects.filter(event_id=event_id).select_related('user', 'event').order_by('id').first()
+            if entry is None or not claim_spot(event_id):
+                return promoted
+            entry.delete()
+            promoted.append(UserEventRegistration.objects.create(user=entry.user, event=entry.event))
+            page_cache.invalidate('event', f'event:{entry.event.field_id}')
+
+
+def cancel_sign_up(user, event_id):
+    # The post_delete signal gives the spot back and promotes the first waiting user
+    # within this transaction
+    with transaction.atomic():
+        Event.objects.select_for_update().filter(pk=event_id).first()
+        deleted, _ = UserEventRegistration.objects.filter(user=user, event_id=event_id).delete()
+    return bool(deleted)
+
+
+def with_waitlist_positions(entries):
+    # Annotates `position` (1 = next in line) with an index-only count per entry
+    earlier = EventWaitlistEntry.objects.filter(
+        event=OuterRef('event'),
+        id__lte=OuterRef('id'),
+    ).order_by().values('event').annotate(count=Count('id')).values('count')
+    return entries.annotate(position=Subquery(earlier))
+
+
+def waitlist_entry(user, event):
+    return with_waitlist_positions(EventWaitlistEntry.objects.filter(user=user, event=event)).first()
@@ -1,8 +1,36 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import re
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import IntegrityError, connection, connections, transaction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import TestCase, TransactionTestCase, AsyncClient, Client, RequestFactory, AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404
+from django.urls import path, reverse
+from django.utils import timezone
 
-from playground4.web.forms import FieldForm, EventForm, ReviewForm, LoginForm
-from playground4.web.models import Field, Reservation
+from playground4.web import async_views, availability, booking, holds, live_slots, metrics, partitions, replicas, rollups, signups, urls, views
+from playground4.web.forms import FieldForm, EventForm, ReviewForm, LoginForm, RecurringReservationForm
+from playground4.web.models import Field, Reservation, FieldAvailability, Review, Event, UserEventRegistration, \
+	EventWaitlistEntry, FieldDailyStats, FieldMonthlyStats, SlotHold, OpeningHours, OpeningException
+from playground4.web.pagination import PER_PAGE, keyset_paginate, page_queryset
+from playground4.web.query_budget import QUERY_BUDGETS, count_queries
+from playground4.web.search import free_fields
 
 User = get_user_model()
 
@@ -177,3 +205,1865 @@ class ReviewFormTest(TestCase):
 		self.assertEqual(form.errors['comment'][0], 'This field is required.')
 
 
+class AvailabilityIndexTest(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+		self.field = Field.objects.create(
+			field_owner=self.user,
+			name='Arena',
+			location='Plovdiv',
+			sport='Basketball',
+			description='Brand new facilities',
+			price_per_hour=20,
+			start_working_day=1,
+			start_working_hour=16,
+			end_working_day=5,
+			end_working_hour=19
+		)
+		# A Tuesday
+		self.date = datetime.date(2023, 7, 25)
+
+	def test_reservation_marks_and_frees_slot(self):
+		reservation = Reservation.objects.create(user=self.user, field=self.field, reservation_date=self.date, reservation_hour=18)
+		self.assertFalse(availability.is_slot_free(self.field, self.date, 18))
+		self.assertTrue(availability.is_slot_free(self.field, self.date, 17))
+
+		reservation.delete()
+		self.assertTrue(availability.is_slot_free(self.field, self.date, 18))
+		self.assertEqual(FieldAvailability.objects.get(field=self.field, date=self.date).booked_mask, 0)
+
+	def test_moved_reservation_updates_index(self):
+		reservation = Reservation.objects.create(user=self.user, field=self.field, reservation_date=self.date, reservation_hour=18)
+		reservation.reservation_hour = 16
+		reservation.save()
+		self.assertTrue(availability.is_slot_free(self.field, self.date, 18))
+		self.assertFalse(availability.is_slot_free(self.field, self.date, 16))
+
+	def test_free_slots_respect_working_window(self):
+		Reservation.objects.create(user=self.user, field=self.field, reservation_date=self.date, reservation_hour=17)
+		saturday = self.date + datetime.timedelta(days=4)
+		slots = availability.free_slots(self.field, self.date, saturday)
+		self.assertEqual(slots[0], {'date': self.date, 'free_hours': [16, 18, 19]})
+		self.assertEqual(slots[-1], {'date': saturday, 'free_hours': []})
+
+	def test_availability_endpoint(self):
+		Reservation.objects.create(user=self.user, field=self.field, reservation_date=self.date, reservation_hour=16)
+		response = self.client.get(
+			reverse('field_availability', kwargs={'pk': self.field.pk}),
+			{'start': '2023-07-25', 'end': '2023-07-26'}
+		)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.json()['slots'], [
+			{'date': '2023-07-25', 'free_hours': [17, 18, 19]},
+			{'date': '2023-07-26', 'free_hours': [16, 17, 18, 19]},
+		])
+
+	def test_availability_endpoint_rejects_bad_range(self):
+		url = reverse('field_availability', kwargs={'pk': self.field.pk})
+		self.assertEqual(self.client.get(url, {'start': 'tomorrow'}).status_code, 400)
+		self.assertEqual(self.client.get(url, {'start': '2023-07-25', 'end': '2023-12-25'}).status_code, 400)
+
+	def test_reservation_form_rejects_booked_slot(self):
+		Reservation.objects.create(user=self.user, field=self.field, reservation_date=self.date, reservation_hour=18)
+		self.client.force_login(self.user)
+		response = self.client.post(
+			reverse('reservation_form', kwargs={'pk': self.field.pk}),
+			{'reservation_date': '2023-07-25', 'reservation_hour': 18}
+		)
+		self.assertEqual(response.status_code, 200)
+		self.assertContains(response, 'This hour is already reserved for the selected date.')
+		self.assertEqual(Reservation.objects.count(), 1)
+
+
+class SlotHoldTest(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+		self.other = User.objects.create_user(username='maria', email='maria@some.com', password='dadadada')
+		self.field = Field.objects.create(
+			field_owner=self.user,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=16,
+			end_working_day=5,
+			end_working_hour=21
+		)
+		# A Tuesday
+		self.date = datetime.date(2023, 7, 25)
+		self.expired = timezone.now() - datetime.timedelta(seconds=settings.SLOT_HOLD_SECONDS + 1)
+
+	def book(self, user, hour):
+		self.client.force_login(user)
+		return self.client.post(
+			reverse('reservation_form', kwargs={'pk': self.field.pk}),
+			{'reservation_date': self.date.isoformat(), 'reservation_hour': hour},
+		)
+
+	def test_hold_keeps_others_out(self):
+		holds.hold_slot(self.user, self.field, self.date, 18)
+
+		with self.assertRaises(holds.SlotUnavailable):
+			holds.hold_slot(self.other, self.field, self.date, 18)
+		self.assertContains(self.book(self.other, 18), 'Somebody else is booking this hour')
+		with self.assertRaises(booking.SlotConflicts) as error:
+			booking.book_slots(self.other, self.field, [(self.date, 18)])
+		self.assertEqual(error.exception.conflicts, {(self.date, 18): 'Somebody else is booking this hour.'})
+		self.assertEqual(Reservation.objects.count(), 0)
+
+		self.assertNotIn(18, availability.free_slots(self.field, self.date, self.date, self.other)[0]['free_hours'])
+		self.assertIn(18, availability.free_slots(self.field, self.date, self.date, self.user)[0]['free_hours'])
+
+	def test_booking_turns_the_hold_into_the_reservation(self):
+		holds.hold_slot(self.user, self.field, self.date, 18)
+		self.assertEqual(self.book(self.user, 18).status_code, 302)
+		self.assertTrue(Reservation.objects.filter(user=self.user, reservation_date=self.date, reservation_hour=18).exists())
+		self.assertFalse(SlotHold.objects.exists())
+
+	def test_hold_check_is_one_query(self):
+		holds.hold_slot(self.user, self.field, self.date, 18)
+		Reservation.objects.create(user=self.user, field=self.field, reservation_date=self.date, reservation_hour=19)
+		with self.assertNumQueries(1):
+			self.assertEqual(holds.slot_state(self.field, self.date, 18), (False, {self.user.pk}))
+		with self.assertNumQueries(1):
+			self.assertEqual(holds.slot_state(self.field, self.date, 19), (True, set()))
+		with self.assertNumQueries(1):
+			self.assertEqual(holds.slot_state(self.field, self.date, 17, 2), (False, {self.user.pk}))
+
+	def test_expired_hold_can_be_taken_over(self):
+		holds.hold_slot(self.user, self.field, self.date, 18, now=self.expired)
+		self.assertEqual(holds.slot_state(self.field, self.date, 18), (False, set()))
+		holds.hold_slot(self.other, self.field, self.date, 18)
+		self.assertEqual(SlotHold.objects.get().user, self.other)
+
+	def test_new_hold_releases_the_previous_one(self):
+		holds.hold_slot(self.user, self.field, self.date, 18)
+		holds.hold_slot(self.user, self.field, self.date, 19)
+		self.assertEqual(list(SlotHold.objects.values_list('hold_hour', flat=True)), [19])
+
+	def test_hold_covers_every_hour_of_the_booking(self):
+		holds.hold_slot(self.user, self.field, self.date, 18, 3)
+		self.assertEqual(sorted(SlotHold.objects.values_list('hold_hour', flat=True)), [18, 19, 20])
+		with self.assertRaises(holds.SlotUnavailable):
+			holds.hold_slot(self.other, self.field, self.date, 16, 3)
+		# All or nothing: the other user keeps no hold on 16 and 17
+		self.assertFalse(SlotHold.objects.filter(user=self.other).exists())
+
+		# Fewer hours release the rest
+		holds.hold_slot(self.user, self.field, self.date, 18, 2)
+		self.assertEqual(sorted(SlotHold.objects.values_list('hold_hour', flat=True)), [18, 19])
+		self.client.force_login(self.user)
+		response = self.client.post(
+			reverse('reservation_form', kwargs={'pk': self.field.pk}),
+			{'reservation_date': self.date.isoformat(), 'reservation_hour': 18, 'duration': 2},
+		)
+		self.assertEqual(response.status_code, 302)
+		self.assertFalse(SlotHold.objects.exists())
+
+	def test_booked_or_closed_slots_cannot_be_held(self):
+		Reservation.objects.create(user=self.other, field=self.field, reservation_date=self.date, reservation_hour=18)
+		with self.assertRaises(holds.SlotUnavailable):
+			holds.hold_slot(self.user, self.field, self.date, 18)
+		with self.assertRaises(holds.SlotUnavailable):
+			holds.hold_slot(self.user, self.field, datetime.date(2023, 7, 29), 18)
+		self.assertFalse(SlotHold.objects.exists())
+
+	def test_sweep_deletes_expired_holds_at_once(self):
+		for user, hour in ((self.user, 16), (self.other, 17)):
+			holds.hold_slot(user, self.field, self.date, hour, now=self.expired)
+		third = User.objects.create_user(username='ivan', email='ivan@some.com', password='dadadada')
+		holds.hold_slot(third, self.field, self.date + datetime.timedelta(days=1), 18)
+
+		# Savepoint, the delete, one notify for the field, release
+		with self.assertNumQueries(4):
+			self.assertEqual(holds.sweep(), 2)
+		self.assertEqual(list(SlotHold.objects.values_list('hold_hour', flat=True)), [18])
+
+	def test_hold_endpoint(self):
+		url = reverse('slot_hold', kwargs={'pk': self.field.pk})
+		data = {'reservation_date': self.date.isoformat(), 'reservation_hour': 18}
+		self.assertEqual(self.client.post(url, data).status_code, 302)
+
+		self.client.force_login(self.user)
+		response = self.client.post(url, data)
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('expires_at', response.json())
+
+		self.client.force_login(self.other)
+		response = self.client.post(url, data)
+		self.assertEqual(response.status_code, 409)
+		self.assertEqual(response.json(), {'error': 'This hour is already reserved or being booked by someone else.'})
+
+
+class ConcurrentBookingTest(TransactionTestCase):
+	attempts = 200
+	workers = 20
+
+	def setUp(self):
+		self.owner = User.objects.create_user(username='owner', email='owner@some.com', password='dadadada')
+		self.field = Field.objects.create(
+			field_owner=self.owner,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=16,
+			end_working_day=7,
+			end_working_hour=21
+		)
+		self.users = [
+			User.objects.create(username=f'player{i}', email=f'player{i}@some.com')
+			for i in range(self.workers)
+		]
+
+	def test_duplicate_slot_is_rejected(self):
+		Reservation.objects.create(user=self.owner, field=self.field, reservation_date='2023-07-25', reservation_hour=18)
+		with self.assertRaises(booking.SlotAlreadyReserved):
+			booking.book_slot(Reservation(user=self.owner, field=self.field, reservation_date='2023-07-25', reservation_hour=18))
+
+	def test_parallel_bookings_of_one_slot(self):
+		barrier = threading.Barrier(self.workers)
+
+		def post_booking(attempt):
+			client = Client()
+			client.force_login(self.users[attempt % self.workers])
+			if attempt < self.workers:
+				barrier.wait()
+			try:
+				response = client.post(
+					reverse('reservation_form', kwargs={'pk': self.field.pk}),
+					{'reservation_date': '2023-07-25', 'reservation_hour': 19}
+				)
+				return response.status_code
+			finally:
+				connection.close()
+
+		with ThreadPoolExecutor(max_workers=self.workers) as executor:
+			statuses = list(executor.map(post_booking, range(self.attempts)))
+
+		self.assertEqual(statuses.count(302), 1)
+		self.assertEqual(statuses.count(200), self.attempts - 1)
+		self.assertEqual(Reservation.objects.filter(field=self.field).count(), 1)
+		self.assertFalse(availability.is_slot_free(self.field, datetime.date(2023, 7, 25), 19))
+
+	def test_parallel_inserts_of_one_slot(self):
+		# Skips the availability pre-check, so every attempt reaches the unique constraint
+		barrier = threading.Barrier(self.workers)
+
+		def insert(attempt):
+			barrier.wait()
+			try:
+				booking.book_slot(Reservation(
+					user=self.users[attempt], field=self.field, reservation_date='2023-07-25', reservation_hour=20
+				))
+				return True
+			except booking.SlotAlreadyReserved:
+				return False
+			finally:
+				connection.close()
+
+		with ThreadPoolExecutor(max_workers=self.workers) as executor:
+			results = list(executor.map(insert, range(self.workers)))
+
+		self.assertEqual(results.count(True), 1)
+		self.assertEqual(Reservation.objects.filter(field=self.field).count(), 1)
+
+
+class MultiHourBookingTest(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+		self.other = User.objects.create_user(username='maria', email='maria@some.com', password='dadadada')
+		# Open Monday - Friday, 17:00 - 21:00
+		self.field = Field.objects.create(
+			field_owner=self.user,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=17,
+			end_working_day=5,
+			end_working_hour=21
+		)
+		# A Tuesday
+		self.date = datetime.date(2023, 7, 25)
+
+	def reserve(self, hour, duration, user=None):
+		return Reservation.objects.create(
+			user=user or self.user, field=self.field, reservation_date=self.date, reservation_hour=hour, duration=duration,
+		)
+
+	def book(self, hour, duration):
+		self.client.force_login(self.other)
+		return self.client.post(
+			reverse('reservation_form', kwargs={'pk': self.field.pk}),
+			{'reservation_date': self.date.isoformat(), 'reservation_hour': hour, 'duration': duration},
+		)
+
+	def test_period_follows_the_hours(self):
+		reservation = self.reserve(18, 2)
+		self.assertEqual(reservation.end_hour, 20)
+		self.assertEqual(Reservation.objects.get().period.lower, datetime.datetime(2023, 7, 25, 18, tzinfo=datetime.timezone.utc))
+		self.assertEqual(Reservation.objects.get().period.upper, datetime.datetime(2023, 7, 25, 20, tzinfo=datetime.timezone.utc))
+
+		reservation.reservation_hour = 19
+		reservation.save()
+		self.assertEqual(Reservation.objects.get().period.lower.hour, 19)
+		self.assertEqual(availability.free_slots(self.field, self.date, self.date)[0]['free_hours'], [17, 18, 21])
+
+	def test_overlaps_are_rejected_by_the_database(self):
+		self.reserve(18, 2)
+		for hour, duration in ((17, 2), (19, 1), (17, 4)):
+			with self.subTest(hour=hour, duration=duration), self.assertRaises(IntegrityError), transaction.atomic():
+				self.reserve(hour, duration, self.other)
+		# Touching ranges don't overlap
+		self.reserve(20, 2, self.other)
+		self.reserve(17, 1, self.other)
+		# A booking can't run past the day
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			Reservation.objects.create(user=self.user, field=self.field, reservation_date='2023-07-26', reservation_hour=21, duration=2)
+
+	def test_overlap_is_one_query(self):
+		self.reserve(18, 2)
+		with self.assertNumQueries(1):
+			self.assertTrue(booking.overlapping(self.field.pk, self.date, 19, 3).exists())
+		with self.assertRaises(booking.SlotAlreadyReserved):
+			booking.book_slot(Reservation(user=self.other, field=self.field, reservation_date=self.date, reservation_hour=17, duration=2))
+
+	def test_reservation_form_books_several_hours(self):
+		self.reserve(17, 1)
+		self.assertContains(self.book(20, 3), 'Reservations must end by 22:00.')
+		self.assertContains(self.book(17, 2), 'This hour is already reserved for the selected date.')
+
+		response = self.book(18, 3)
+		reservation = Reservation.objects.get(user=self.other)
+		self.assertRedirects(response, reverse('reservation_confirmation', kwargs={'pk': reservation.pk}))
+		self.assertEqual((reservation.reservation_hour, reservation.duration), (18, 3))
+		self.assertEqual(availability.free_slots(self.field, self.date, self.date)[0]['free_hours'], [21])
+		self.assertContains(self.client.get(response.url), '18:00 - 21:00')
+
+		reservation.delete()
+		self.assertEqual(availability.free_slots(self.field, self.date, self.date)[0]['free_hours'], [18, 19, 20, 21])
+
+	def test_consecutive_slots_become_one_reservation(self):
+		next_week = self.date + datetime.timedelta(weeks=1)
+		reservations = booking.book_slots(self.user, self.field, [(self.date, 19), (self.date, 18), (self.date, 21), (next_week, 18)])
+		self.assertEqual(
+			[(reservation.reservation_date, reservation.reservation_hour, reservation.duration) for reservation in reservations],
+			[(self.date, 18, 2), (self.date, 21, 1), (next_week, 18, 1)],
+		)
+		with self.assertRaises(booking.SlotConflicts) as error:
+			booking.book_slots(self.other, self.field, [(self.date, 17), (self.date, 18), (self.date, 19), (self.date, 20)])
+		self.assertEqual(set(error.exception.conflicts), {(self.date, 18), (self.date, 19)})
+
+	def test_schedules_show_durations(self):
+		self.reserve(18, 3, self.other)
+		self.client.force_login(self.user)
+		response = self.client.get(reverse('field_schedule', args=[self.field.pk]), {'start': '2023-07-25'})
+		tuesday = response.context['days'][1]['cells']
+		self.assertEqual([(cell['hour'], cell['span']) for cell in tuesday], [(16, 1), (17, 1), (18, 3), (21, 1)])
+		self.assertContains(response, '<td class="booked" colspan="3">maria</td>', html=True)
+
+		self.client.force_login(self.other)
+		self.assertContains(self.client.get(reverse('schedule_history')), '18:00 - 21:00')
+
+	def test_free_field_search_sees_every_booked_hour(self):
+		self.reserve(17, 3)
+		self.assertEqual(list(free_fields('Football', self.date, 19)), [])
+		self.assertEqual(list(free_fields('Football', self.date, 20)), [self.field])
+
+
+class OpeningHoursTest(TestCase):
+	def setUp(self):
+		self.owner = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada', field_owner=True)
+		self.player = User.objects.create_user(username='maria', email='maria@some.com', password='dadadada')
+		# Usually open Monday - Friday, 17:00 - 21:00
+		self.field = Field.objects.create(
+			field_owner=self.owner,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=17,
+			end_working_day=5,
+			end_working_hour=21
+		)
+		today = timezone.localdate()
+		self.monday = today + datetime.timedelta(days=7 - today.weekday())
+		self.tuesday = self.monday + datetime.timedelta(days=1)
+		self.wednesday = self.monday + datetime.timedelta(days=2)
+		self.saturday = self.monday + datetime.timedelta(days=5)
+
+	def hours(self, date):
+		return availability.mask_hours(availability.working_mask(self.field, date))
+
+	def test_rows_are_compiled_onto_the_field(self):
+		self.assertEqual(self.hours(self.monday), [17, 18, 19, 20, 21])
+		self.assertEqual(self.hours(self.saturday), [])
+
+		OpeningHours.objects.create(field=self.field, weekday=2, start_hour=16, end_hour=18)
+		OpeningHours.objects.create(field=self.field, weekday=3)
+		OpeningHours.objects.create(field=self.field, weekday=6, start_hour=18, end_hour=21)
+		OpeningException.objects.create(field=self.field, date=self.monday, reason='Maintenance')
+		OpeningException.objects.create(field=self.field, date=self.saturday, start_hour=20, end_hour=21)
+		# Past dates can't be booked, so they aren't compiled
+		OpeningException.objects.create(field=self.field, date=timezone.localdate() - datetime.timedelta(days=1))
+
+		self.field.refresh_from_db()
+		with self.assertNumQueries(0):
+			self.assertEqual(self.hours(self.monday), [])
+			self.assertEqual(self.hours(self.monday + datetime.timedelta(weeks=1)), [17, 18, 19, 20, 21])
+			self.assertEqual(self.hours(self.tuesday), [16, 17, 18])
+			self.assertEqual(self.hours(self.wednesday), [])
+			self.assertEqual(self.hours(self.saturday), [20, 21])
+			self.assertEqual(self.hours(self.saturday + datetime.timedelta(weeks=1)), [18, 19, 20, 21])
+		self.assertEqual(list(self.field.opening_exception_masks), [self.monday.isoformat(), self.saturday.isoformat()])
+		self.assertEqual(self.field.get_opening_days()[1:3], [('Tuesday', '16:00', '18:00'), ('Wednesday', None, None)])
+
+		OpeningHours.objects.filter(field=self.field, weekday=3).delete()
+		self.field.refresh_from_db()
+		self.assertEqual(self.hours(self.wednesday), [17, 18, 19, 20, 21])
+
+		# Rows deleted with their field don't recompile it
+		with CaptureQueriesContext(connection) as queries:
+			self.field.delete()
+		self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "web_field"')])
+
+	def test_hours_must_be_in_order(self):
+		for start_hour, end_hour in ((19, 17), (18, None)):
+			with self.subTest(start_hour=start_hour, end_hour=end_hour), self.assertRaises(IntegrityError), transaction.atomic():
+				OpeningHours.objects.create(field=self.field, weekday=1, start_hour=start_hour, end_hour=end_hour)
+
+	def test_update_view_recompiles_the_schedule(self):
+		self.client.force_login(self.owner)
+		url = reverse('update_field', kwargs={'pk': self.field.pk})
+		self.assertEqual(self.client.get(url).status_code, 200)
+		# Cached with the old hours
+		self.assertContains(self.client.get(reverse('field_detail', kwargs={'pk': self.field.pk})), 'Saturday: closed')
+
+		data = {
+			'name': 'Arena', 'location': 'Plovdiv', 'sport': 'Football', 'description': 'Brand new facilities', 'image_url': '',
+			'start_working_day': 1, 'start_working_hour': 17, 'end_working_day': 5, 'end_working_hour': 21, 'price_per_hour': 20,
+			'hours-TOTAL_FORMS': 1, 'hours-INITIAL_FORMS': 0,
+			'hours-0-weekday': 6, 'hours-0-start_hour': 19, 'hours-0-end_hour': 21,
+			'exceptions-TOTAL_FORMS': 1, 'exceptions-INITIAL_FORMS': 0,
+			'exceptions-0-date': self.tuesday.isoformat(), 'exceptions-0-start_hour': 18, 'exceptions-0-end_hour': '',
+		}
+		response = self.client.post(url, data)
+		self.assertContains(response, 'Set both hours, the first one not after the last, or neither to close.')
+		self.assertFalse(OpeningHours.objects.exists())
+
+		data['exceptions-0-start_hour'] = ''
+		data['exceptions-0-reason'] = 'Holiday'
+		self.assertRedirects(self.client.post(url, data), reverse('my_fields'))
+		self.field.refresh_from_db()
+		self.assertEqual(self.hours(self.saturday), [19, 20, 21])
+		self.assertEqual(self.hours(self.tuesday), [])
+		self.assertEqual(self.field.price_per_hour, 20)
+		self.assertContains(self.client.get(reverse('field_detail', kwargs={'pk': self.field.pk})), 'Saturday: 19:00 - 21:00')
+
+	def test_booking_reads_the_compiled_schedule(self):
+		OpeningHours.objects.create(field=self.field, weekday=6, start_hour=18, end_hour=20)
+		OpeningException.objects.create(field=self.field, date=self.tuesday, reason='Holiday')
+		self.client.force_login(self.player)
+		url = reverse('reservation_form', kwargs={'pk': self.field.pk})
+
+		def book(date, hour, duration=1):
+			return self.client.post(url, {'reservation_date': date.isoformat(), 'reservation_hour': hour, 'duration': duration})
+
+		self.assertContains(book(self.tuesday, 18), 'Reservations are only allowed on working days.')
+		self.assertContains(book(self.saturday + datetime.timedelta(days=1), 18), 'Reservations are only allowed on working days.')
+		self.assertContains(book(self.saturday, 19, 3), 'Reservations are only allowed during working hours.')
+		self.assertContains(book(self.monday, 16), 'Reservations are only allowed during working hours.')
+		self.assertEqual(book(self.saturday, 18, 3).status_code, 302)
+		self.assertEqual(Reservation.objects.get().reservation_date, self.saturday)
+
+		with self.assertRaises(booking.SlotConflicts):
+			booking.book_slots(self.player, Field.objects.get(), [(self.tuesday, 18)])
+		self.assertContains(self.client.get(url), 'Saturday: 18:00 - 20:00')
+
+	def test_free_field_search_reads_the_compiled_schedule(self):
+		OpeningHours.objects.create(field=self.field, weekday=6, start_hour=18, end_hour=21)
+		OpeningException.objects.create(field=self.field, date=self.tuesday, start_hour=20, end_hour=21)
+		with self.assertNumQueries(1):
+			self.assertEqual(list(free_fields('Football', self.saturday, 18, 21)), [self.field])
+		self.assertEqual(list(free_fields('Football', self.saturday, 17)), [])
+		self.assertEqual(list(free_fields('Football', self.tuesday, 20, 21)), [self.field])
+		self.assertEqual(list(free_fields('Football', self.tuesday, 19, 21)), [])
+		self.assertEqual(list(free_fields('Football', self.tuesday + datetime.timedelta(weeks=1), 19, 21)), [self.field])
+
+
+class RecurringBookingTest(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+		self.field = Field.objects.create(
+			field_owner=self.user,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=16,
+			end_working_day=5,
+			end_working_hour=21
+		)
+		# A Tuesday
+		self.date = datetime.date(2023, 7, 25)
+
+	def test_weekly_pattern_form(self):
+		form = RecurringReservationForm(data={'start_date': '2023-07-25', 'weeks': 3, 'hours': [19, 20]})
+		self.assertTrue(form.is_valid())
+		self.assertEqual(len(form.cleaned_data['slot_list']), 6)
+		self.assertIn((datetime.date(2023, 8, 8), 20), form.cleaned_data['slot_list'])
+
+	def test_slot_list_form(self):
+		form = RecurringReservationForm(data={'slots': '2023-07-25 18\n\n2023-07-26 19'})
+		self.assertTrue(form.is_valid())
+		self.assertEqual(form.cleaned_data['slot_list'], [(self.date, 18), (datetime.date(2023, 7, 26), 19)])
+		self.assertFalse(RecurringReservationForm(data={'slots': '2023-07-25 evening'}).is_valid())
+		self.assertFalse(RecurringReservationForm(data={}).is_valid())
+
+	def test_book_slots_all_or_nothing(self):
+		Reservation.objects.create(user=self.user, field=self.field, reservation_date=self.date + datetime.timedelta(weeks=1), reservation_hour=19)
+		slots = [(self.date + datetime.timedelta(weeks=week), 19) for week in range(3)] + [(datetime.date(2023, 7, 29), 19)]
+
+		with self.assertRaises(booking.SlotConflicts) as error:
+			booking.book_slots(self.user, self.field, slots)
+
+		self.assertEqual(set(error.exception.conflicts), {(datetime.date(2023, 8, 1), 19), (datetime.date(2023, 7, 29), 19)})
+		self.assertEqual(Reservation.objects.count(), 1)
+
+	def test_book_slots_updates_availability(self):
+		slots = [(self.date + datetime.timedelta(weeks=week), 19) for week in range(4)]
+		# Conflict check, savepoint, two inserts, index update, two upserts per rollup, notify, release - whatever the number of slots
+		with self.assertNumQueries(11):
+			booking.book_slots(self.user, self.field, slots)
+		self.assertEqual(Reservation.objects.count(), 4)
+		self.assertFalse(availability.is_slot_free(self.field, datetime.date(2023, 8, 15), 19))
+
+	def test_recurring_view_reports_conflicts_per_slot(self):
+		Reservation.objects.create(user=self.user, field=self.field, reservation_date=self.date, reservation_hour=20)
+		self.client.force_login(self.user)
+		url = reverse('recurring_reservation_form', kwargs={'pk': self.field.pk})
+
+		response = self.client.post(url, {'start_date': '2023-07-25', 'weeks': 2, 'hours': [19, 20]})
+		self.assertContains(response, '2023-07-25 at 20:00: This hour is already reserved.')
+		self.assertEqual(Reservation.objects.count(), 1)
+
+		response = self.client.post(url, {'start_date': '2023-07-25', 'weeks': 2, 'hours': [19]})
+		self.assertRedirects(response, reverse('schedule'))
+		self.assertEqual(Reservation.objects.count(), 3)
+
+
+class RatingStatsTest(TestCase):
+	def setUp(self):
+		self.owner = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+		self.users = [User.objects.create(username=f'player{i}', email=f'player{i}@some.com') for i in range(3)]
+		self.field = Field.objects.create(
+			field_owner=self.owner,
+			name='Arena',
+			location='Plovdiv',
+			sport='Tennis',
+			description='Brand new facilities'
+		)
+
+	def review(self, user, rating):
+		return Review.objects.create(user=user, field=self.field, rating=rating, comment='Nice')
+
+	def test_stats_follow_reviews(self):
+		self.review(self.users[0], 5)
+		review = self.review(self.users[1], 4)
+		self.review(self.users[2], 4)
+		self.field.refresh_from_db()
+		self.assertEqual(self.field.get_average_rating(), 4.3)
+		self.assertEqual(self.field.get_rating_distribution()[:2], [(5, 1, 33), (4, 2, 67)])
+
+		review.rating = 1
+		review.save()
+		review.refresh_from_db()
+		self.users[2].delete()
+		self.field.refresh_from_db()
+		self.assertEqual((self.field.rating_count, self.field.rating_sum), (2, 6))
+		self.assertEqual((self.field.rating_1, self.field.rating_4, self.field.rating_5), (1, 0, 1))
+
+	def test_field_update_keeps_stats(self):
+		stale_field = Field.objects.get(pk=self.field.pk)
+		self.review(self.users[0], 5)
+		stale_field.name = 'New Arena'
+		stale_field.save()
+		self.field.refresh_from_db()
+		self.assertEqual((self.field.name, self.field.rating_count), ('New Arena', 1))
+
+	def test_rebuild_command(self):
+		self.review(self.users[0], 2)
+		self.review(self.users[1], 3)
+		Field.objects.filter(pk=self.field.pk).update(rating_count=0, rating_sum=0, rating_2=0)
+		call_command('rebuild_rating_stats', stdout=StringIO())
+		self.field.refresh_from_db()
+		self.assertEqual((self.field.rating_count, self.field.rating_sum, self.field.rating_2, self.field.rating_3), (2, 5, 1, 1))
+
+	def test_detail_page_needs_no_aggregate(self):
+		self.review(self.users[0], 5)
+		with self.assertNumQueries(1):
+			response = self.client.get(reverse('field_detail', kwargs={'pk': self.field.pk}))
+		self.assertContains(response, 'Rating 5.0 / 5 (1 reviews)')
+
+
+class KeysetPaginationTest(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+		self.field = Field.objects.create(
+			field_owner=self.user,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=16,
+			end_working_day=7,
+			end_working_hour=21
+		)
+		start = timezone.localdate() + datetime.timedelta(days=1)
+		Reservation.objects.bulk_create([
+			Reservation(user=self.user, field=self.field, reservation_date=start + datetime.timedelta(days=day), reservation_hour=hour)
+			for day in range(10) for hour in range(16, 22)
+		])
+		self.client.force_login(self.user)
+
+	def walk(self, url):
+		# Follows the "next" links and returns the reservations of every page
+		pages = []
+		while url:
+			response = self.client.get(url)
+			pages.append(list(response.context['reservations']))
+			next_url = response.context['page'].next_url
+			url = reverse('schedule') + next_url if next_url else None
+		return pages
+
+	def test_pages_cover_all_rows_in_order(self):
+		pages = self.walk(reverse('schedule'))
+		self.assertEqual([len(page) for page in pages], [PER_PAGE, PER_PAGE, PER_PAGE])
+		slots = [(reservation.reservation_date, reservation.reservation_hour) for page in pages for reservation in page]
+		self.assertEqual(slots, sorted(slots))
+		self.assertEqual(len(set(slots)), 60)
+
+	def test_previous_link_returns_previous_page(self):
+		first = self.client.get(reverse('schedule'))
+		second = self.client.get(reverse('schedule') + first.context['page'].next_url)
+		back = self.client.get(reverse('schedule') + second.context['page'].previous_url)
+		self.assertEqual(list(back.context['reservations']), list(first.context['reservations']))
+		self.assertFalse(back.context['page'].has_previous)
+
+	def test_deep_page_is_an_index_range(self):
+		# The cursor must bound the index scan, not filter out the rows before it one by one
+		Event.objects.bulk_create([
+			Event(title=f'Cup {number}', content='Knock out', sport='Football', field=self.field, slug=f'cup-{number}')
+			for number in range(500)
+		])
+		deep = Event.objects.filter(field=self.field).order_by('-date_published', '-id')[450]
+		cursor = ([deep.date_published, deep.id], 'next')
+		with connection.cursor() as db_cursor:
+			db_cursor.execute('SET LOCAL enable_seqscan = off')
+		queryset = page_queryset(Event.objects.filter(field=self.field), ['-date_published', '-id'], cursor, PER_PAGE)
+		self.assertEqual([event.title for event in queryset][:2], ['Cup 48', 'Cup 47'])
+		plan = queryset.explain(analyze=True)
+		self.assertRegex(plan, r'Index Cond: .*\(date_published, id\) < ')
+		self.assertNotIn('Rows Removed by Filter', plan)
+
+	def test_orderings_sort_one_way(self):
+		with self.assertRaises(ValueError):
+			keyset_paginate(RequestFactory().get('/'), Event.objects.all(), ['-date_published', 'id'])
+
+	def test_bad_cursor_shows_first_page(self):
+		response = self.client.get(reverse('schedule'), {'cursor': 'not-a-cursor'})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(len(response.context['reservations']), PER_PAGE)
+
+	def test_events_newest_first(self):
+		for number in range(PER_PAGE + 5):
+			Event.objects.create(title=f'Cup {number}', content='Knock out', sport='Football', field=self.field)
+		response = self.client.get(reverse('all_events_list'))
+		self.assertEqual(response.context['events_list'][0].title, f'Cup {PER_PAGE + 4}')
+		response = self.client.get(reverse('all_events_list') + response.context['page'].next_url)
+		self.assertEqual([event.title for event in response.context['events_list']], [f'Cup {number}' for number in range(4, -1, -1)])
+
+
+class FieldScheduleGridTest(TestCase):
+	def setUp(self):
+		self.owner = User.objects.create(username='owner', email='owner@some.com')
+		self.player = User.objects.create(username='player', email='player@some.com')
+		self.field = Field.objects.create(
+			field_owner=self.owner,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=17,
+			end_working_day=5,
+			end_working_hour=20
+		)
+		# Wednesday 2023-07-12 and 2023-07-13, plus history the grid must not load
+		for date, hour in [(datetime.date(2023, 7, 12), 18), (datetime.date(2023, 7, 13), 17), (datetime.date(2022, 1, 3), 18)]:
+			Reservation.objects.create(user=self.player, field=self.field, reservation_date=date, reservation_hour=hour)
+		self.client.force_login(self.owner)
+		self.url = reverse('field_schedule', args=[self.field.pk])
+
+	def test_week_grid_starts_on_monday(self):
+		response = self.client.get(self.url, {'start': '2023-07-12'})
+		days = response.context['days']
+		self.assertEqual([day['date'] for day in days], [datetime.date(2023, 7, 10) + datetime.timedelta(days=n) for n in range(7)])
+		self.assertEqual(response.context['previous_start'], datetime.date(2023, 7, 3))
+		self.assertEqual(response.context['next_start'], datetime.date(2023, 7, 17))
+
+		wednesday = {cell['hour']: cell for cell in days[2]['cells']}
+		self.assertEqual(wednesday[18]['reservation'].user.username, 'player')
+		self.assertIsNone(wednesday[17]['reservation'])
+		self.assertTrue(wednesday[17]['open'])
+		self.assertFalse(wednesday[16]['open'])
+		self.assertFalse(any(cell['open'] for cell in days[5]['cells']))
+		self.assertEqual(sum(cell['reservation'] is not None for day in days for cell in day['cells']), 2)
+
+	def test_grid_is_one_reservation_query(self):
+		with self.assertNumQueries(4):
+			# Session, user, field and the reservations with their users
+			self.client.get(self.url, {'start': '2023-07-12', 'span': 'month'})
+
+	def test_month_span(self):
+		response = self.client.get(self.url, {'start': '2023-02-15', 'span': 'month'})
+		self.assertEqual(len(response.context['days']), 28)
+		self.assertEqual(response.context['previous_start'], datetime.date(2023, 1, 1))
+		self.assertEqual(response.context['next_start'], datetime.date(2023, 3, 1))
+
+	def test_only_owner_sees_schedule(self):
+		self.assertEqual(self.client.get(self.url).status_code, 200)
+
+		other_owner = User.objects.create(username='other', email='other@some.com')
+		Field.objects.create(
+			field_owner=other_owner,
+			name='Other arena',
+			location='Sofia',
+			sport='Tennis',
+			description='Clay courts',
+			start_working_day=1,
+			start_working_hour=17,
+			end_working_day=7,
+			end_working_hour=21
+		)
+		for user in [self.player, other_owner]:
+			self.client.force_login(user)
+			self.assertEqual(self.client.get(self.url).status_code, 404)
+
+		self.client.logout()
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, 302)
+		self.assertTrue(response.url.startswith(settings.LOGIN_URL))
+
+
+class FieldSearchTest(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+
+		def field(name, location, sport, description, price):
+			return Field.objects.create(
+				field_owner=self.user, name=name, location=location, sport=sport, description=description, price_per_hour=price
+			)
+
+		self.arena = field('Central Arena', 'Plovdiv', 'Basketball', 'Indoor courts', 30)
+		self.park = field('Park Courts', 'Sofia', 'Tennis', 'Clay courts next to the arena', 15)
+		self.stadium = field('Stadium', 'Varna', 'Football', 'Natural grass pitch', 50)
+
+	def search(self, **params):
+		response = self.client.get(reverse('field_search'), params)
+		self.assertEqual(response.status_code, 200)
+		return [field.name for field in response.context['fields']]
+
+	def test_ranked_results(self):
+		self.assertEqual(self.search(q='arena'), ['Central Arena', 'Park Courts'])
+		self.assertEqual(self.search(q='court'), ['Park Courts', 'Central Arena'])
+		self.assertEqual(self.search(q='plovdiv'), ['Central Arena'])
+
+	def test_filters(self):
+		self.assertEqual(self.search(q='courts', sport='Tennis'), ['Park Courts'])
+		self.assertEqual(self.search(min_price=20, max_price=40), ['Central Arena'])
+		self.assertEqual(self.search(), ['Central Arena', 'Park Courts', 'Stadium'])
+
+	def test_vector_follows_edits(self):
+		self.stadium.description = 'Artificial turf'
+		self.stadium.save()
+		self.assertEqual(self.search(q='turf'), ['Stadium'])
+		self.assertEqual(self.search(q='grass'), [])
+
+	def test_ranked_pagination(self):
+		for number in range(25):
+			Field.objects.create(field_owner=self.user, name=f'Arena {number}', location='Ruse', sport='Volleyball', description='Sand')
+		first = self.client.get(reverse('field_search'), {'q': 'arena'})
+		second = self.client.get(reverse('field_search') + first.context['page'].next_url)
+		names = [field.name for field in first.context['fields']] + [field.name for field in second.context['fields']]
+		self.assertEqual(len(names), 27)
+		self.assertEqual(len(set(names)), 27)
+
+
+class FreeFieldSearchTest(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+
+		def field(name, sport='Football', **hours):
+			return Field.objects.create(
+				field_owner=self.user, name=name, location='Plovdiv', sport=sport, description='Pitch', **{
+					'start_working_day': 1, 'end_working_day': 7, 'start_working_hour': 16, 'end_working_hour': 21, **hours
+				}
+			)
+
+		self.free = field('Free')
+		self.booked = field('Booked')
+		self.weekdays = field('Weekdays', end_working_day=5)
+		self.early = field('Early', end_working_hour=18)
+		self.court = field('Court', sport='Tennis')
+		# A Saturday
+		self.date = datetime.date(2023, 7, 29)
+		Reservation.objects.create(user=self.user, field=self.booked, reservation_date=self.date, reservation_hour=20)
+
+	def names(self, *args):
+		return sorted(field.name for field in free_fields(*args))
+
+	def test_single_hour(self):
+		self.assertEqual(self.names('Football', self.date, 19), ['Booked', 'Free'])
+		self.assertEqual(self.names('Football', self.date, 20), ['Free'])
+		self.assertEqual(self.names('Football', self.date - datetime.timedelta(days=1), 18), ['Booked', 'Early', 'Free', 'Weekdays'])
+
+	def test_hour_range(self):
+		self.assertEqual(self.names('Football', self.date, 18, 21), ['Free'])
+		self.assertEqual(self.names('Football', self.date, 16, 18), ['Booked', 'Early', 'Free'])
+
+	def test_single_query(self):
+		with self.assertNumQueries(1):
+			list(free_fields('Football', self.date, 18, 21))
+
+	def test_search_page(self):
+		response = self.client.get(reverse('free_field_search'), {'sport': 'Football', 'date': '2023-07-29', 'hour_from': 20})
+		self.assertEqual([field.name for field in response.context['fields']], ['Free'])
+		response = self.client.get(reverse('free_field_search'), {'sport': 'Football', 'date': '2023-07-29', 'hour_from': 20, 'hour_to': 18})
+		self.assertIsNone(response.context['fields'])
+
+
+class CatalogPageCacheTest(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.user = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+		self.field = Field.objects.create(
+			field_owner=self.user, name='Arena', location='Plovdiv', sport='Football', description='Pitch'
+		)
+
+	def test_hit_skips_database(self):
+		first = self.client.get(reverse('field_list'))
+		with self.assertNumQueries(0):
+			second = self.client.get(reverse('field_list'))
+		self.assertEqual(first.content, second.content)
+
+	def test_field_edit_invalidates(self):
+		self.client.get(reverse('field_list_by_sport', kwargs={'sport': 'football'}))
+		self.field.name = 'New Arena'
+		self.field.save()
+		self.assertContains(self.client.get(reverse('field_list_by_sport', kwargs={'sport': 'football'})), 'New Arena')
+
+	def test_review_invalidates_only_its_field(self):
+		other = Field.objects.create(field_owner=self.user, name='Court', location='Sofia', sport='Tennis', description='Clay')
+		self.client.get(reverse('reviews', kwargs={'pk': self.field.pk}))
+		self.client.get(reverse('reviews', kwargs={'pk': other.pk}))
+
+		Review.objects.create(user=self.user, field=self.field, rating=5, comment='Great pitch')
+		self.assertContains(self.client.get(reverse('reviews', kwargs={'pk': self.field.pk})), 'Great pitch')
+		with self.assertNumQueries(0):
+			self.client.get(reverse('reviews', kwargs={'pk': other.pk}))
+
+	def test_event_invalidates_listing(self):
+		self.client.get(reverse('all_events_list'))
+		Event.objects.create(title='Summer Cup', content='Knock out', sport='Football', field=self.field)
+		self.assertContains(self.client.get(reverse('all_events_list')), 'Summer Cup')
+		self.assertContains(self.client.get(reverse('events_list', kwargs={'pk': self.field.pk})), 'Summer Cup')
+
+	def test_pages_are_kept_per_user(self):
+		anonymous = self.client.get(reverse('field_list'))
+		self.client.force_login(self.user)
+		logged_in = self.client.get(reverse('field_list'))
+		self.assertNotContains(anonymous, 'Logout')
+		self.assertContains(logged_in, 'Logout')
+
+
+class EventCapacityTest(TestCase):
+	def setUp(self):
+		self.owner = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+		self.users = [User.objects.create(username=f'player{i}', email=f'player{i}@some.com') for i in range(3)]
+		self.event = Event.objects.create(title='Summer Cup', content='Knock out', sport='Football', max_sign_ups=2)
+
+	def test_capacity_is_enforced(self):
+		signups.sign_up(self.users[0], self.event)
+		signups.sign_up(self.users[1], self.event)
+		with self.assertRaises(signups.EventFull):
+			signups.sign_up(self.users[2], self.event)
+		self.event.refresh_from_db()
+		self.assertEqual((self.event.registered_count, self.event.spots_left, self.event.is_full), (2, 0, True))
+
+	def test_duplicate_sign_up_keeps_count(self):
+		signups.sign_up(self.users[0], self.event)
+		with self.assertRaises(signups.AlreadySignedUp):
+			signups.sign_up(self.users[0], self.event)
+		self.event.refresh_from_db()
+		self.assertEqual(self.event.registered_count, 1)
+
+	def test_cancel_and_cascade_give_spots_back(self):
+		signups.sign_up(self.users[0], self.event)
+		signups.sign_up(self.users[1], self.event)
+		self.assertTrue(signups.cancel_sign_up(self.users[0], self.event.pk))
+		self.assertFalse(signups.cancel_sign_up(self.users[0], self.event.pk))
+		self.users[1].delete()
+		self.event.refresh_from_db()
+		self.assertEqual(self.event.registered_count, 0)
+
+	def test_unlimited_event(self):
+		event = Event.objects.create(title='Open Day', content='Everyone', sport='Tennis')
+		for user in self.users:
+			signups.sign_up(user, event)
+		event.refresh_from_db()
+		self.assertEqual((event.registered_count, event.spots_left), (3, None))
+
+	def test_event_edit_keeps_count(self):
+		stale_event = Event.objects.get(pk=self.event.pk)
+		signups.sign_up(self.users[0], self.event)
+		stale_event.content = 'Group stage first'
+		stale_event.save()
+		self.event.refresh_from_db()
+		self.assertEqual(self.event.registered_count, 1)
+
+	def test_sign_up_view(self):
+		self.event.max_sign_ups = 1
+		self.event.save()
+		for user in self.users[:2]:
+			self.client.force_login(user)
+			self.client.post(reverse('event_detail', kwargs={'pk': self.event.pk}))
+		self.assertEqual(UserEventRegistration.objects.filter(event=self.event).count(), 1)
+		self.assertContains(self.client.get(reverse('event_detail', kwargs={'pk': self.event.pk})), 'This event is full.')
+
+
+class ConcurrentSignUpTest(TransactionTestCase):
+	workers = 20
+
+	def test_parallel_sign_ups_respect_capacity(self):
+		event = Event.objects.create(title='Summer Cup', content='Knock out', sport='Football', max_sign_ups=5)
+		users = [User.objects.create(username=f'player{i}', email=f'player{i}@some.com') for i in range(self.workers)]
+		barrier = threading.Barrier(self.workers)
+
+		def attempt(user):
+			barrier.wait()
+			try:
+				signups.sign_up(user, event)
+				return True
+			except signups.EventFull:
+				return False
+			finally:
+				connection.close()
+
+		with ThreadPoolExecutor(max_workers=self.workers) as executor:
+			results = list(executor.map(attempt, users))
+
+		event.refresh_from_db()
+		self.assertEqual(results.count(True), 5)
+		self.assertEqual(event.registered_count, 5)
+		self.assertEqual(UserEventRegistration.objects.filter(event=event).count(), 5)
+
+
+class EventWaitlistTest(TestCase):
+	def setUp(self):
+		self.users = [User.objects.create(username=f'player{i}', email=f'player{i}@some.com') for i in range(5)]
+		self.event = Event.objects.create(title='Summer Cup', content='Knock out', sport='Football', max_sign_ups=2)
+		signups.sign_up(self.users[0], self.event)
+		signups.sign_up(self.users[1], self.event)
+
+	def registered(self):
+		return set(UserEventRegistration.objects.filter(event=self.event).values_list('user__username', flat=True))
+
+	def test_positions(self):
+		for user in self.users[2:]:
+			self.assertIsInstance(signups.join_waitlist(user, self.event), EventWaitlistEntry)
+		self.assertEqual(signups.waitlist_entry(self.users[4], self.event).position, 3)
+
+		signups.leave_waitlist(self.users[2], self.event.pk)
+		self.assertEqual(signups.waitlist_entry(self.users[3], self.event).position, 1)
+		self.assertEqual(signups.waitlist_entry(self.users[4], self.event).position, 2)
+		with self.assertRaises(signups.AlreadyWaitlisted):
+			signups.join_waitlist(self.users[3], self.event)
+		with self.assertRaises(signups.AlreadySignedUp):
+			signups.join_waitlist(self.users[0], self.event)
+
+	def test_cancellation_promotes_first_in_line(self):
+		signups.join_waitlist(self.users[2], self.event)
+		signups.join_waitlist(self.users[3], self.event)
+		signups.cancel_sign_up(self.users[0], self.event.pk)
+
+		self.assertEqual(self.registered(), {'player1', 'player2'})
+		self.assertEqual(signups.waitlist_entry(self.users[3], self.event).position, 1)
+		self.event.refresh_from_db()
+		self.assertEqual(self.event.registered_count, 2)
+
+	def test_deleted_user_and_raised_capacity_promote(self):
+		for user in self.users[2:]:
+			signups.join_waitlist(user, self.event)
+		self.users[1].delete()
+		self.assertEqual(self.registered(), {'player0', 'player2'})
+
+		self.event.max_sign_ups = 4
+		self.event.save()
+		self.assertEqual(self.registered(), {'player0', 'player2', 'player3', 'player4'})
+		self.assertFalse(EventWaitlistEntry.objects.exists())
+
+	def test_joining_with_a_free_spot_registers(self):
+		signups.cancel_sign_up(self.users[1], self.event.pk)
+		self.assertIsInstance(signups.join_waitlist(self.users[2], self.event), UserEventRegistration)
+
+	def test_signed_up_page_shows_position(self):
+		signups.join_waitlist(self.users[2], self.event)
+		signups.join_waitlist(self.users[3], self.event)
+		self.client.force_login(self.users[3])
+		self.assertContains(self.client.get(reverse('my_signed_up_events')), 'number 2 on the waitlist')
+		self.assertContains(self.client.get(reverse('event_detail', kwargs={'pk': self.event.pk})), 'You are number 2 on the waitlist.')
+
+
+class ConcurrentWaitlistTest(TransactionTestCase):
+	def test_parallel_cancellations_and_sign_ups(self):
+		event = Event.objects.create(title='Summer Cup', content='Knock out', sport='Football', max_sign_ups=5)
+		users = [User.objects.create(username=f'player{i}', email=f'player{i}@some.com') for i in range(20)]
+		for user in users[:5]:
+			signups.sign_up(user, event)
+		for user in users[5:10]:
+			signups.join_waitlist(user, event)
+		barrier = threading.Barrier(10)
+
+		def act(number):
+			barrier.wait()
+			try:
+				if number < 5:
+					signups.cancel_sign_up(users[number], event.pk)
+				else:
+					signups.join_waitlist(users[number + 5], event)
+			finally:
+				connection.close()
+
+		with ThreadPoolExecutor(max_workers=10) as executor:
+			list(executor.map(act, range(10)))
+
+		event.refresh_from_db()
+		registered = set(UserEventRegistration.objects.filter(event=event).values_list('user_id', flat=True))
+		self.assertEqual(event.registered_count, 5)
+		# Everybody who was waiting before the cancellations got in first
+		self.assertEqual(registered, {user.pk for user in users[5:10]})
+		self.assertEqual(EventWaitlistEntry.objects.filter(event=event).count(), 5)
+
+
+class QueryBudgetTest(TestCase):
+	# Pages the owner of the seeded field opens, every other URL is opened by a player
+	OWNER_URLS = {'export_reservations', 'my_fields', 'owner_dashboard', 'update_field', 'delete_field', 'field_schedule', 'field_owner_reviews', 'add_event', 'registered_users_list'}
+
+	def setUp(self):
+		self.owner = User.objects.create(username='owner', email='owner@some.com', field_owner=True)
+		self.player = User.objects.create(username='player', email='player@some.com')
+		self.field = self.create_field(0)
+		self.event = Event.objects.create(title='Cup', content='Cup', field=self.field, sport='Football')
+		self.full_event = Event.objects.create(title='Final', content='Final', field=self.field, sport='Football', max_sign_ups=1)
+		self.monday = timezone.localdate() - datetime.timedelta(days=timezone.localdate().weekday())
+		self.rows = 0
+
+	def create_field(self, number):
+		return Field.objects.create(
+			field_owner=self.owner,
+			name=f'Arena {number}',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=16,
+			end_working_day=7,
+			end_working_hour=21
+		)
+
+	def grow(self, rows):
+		# Adds users with a reservation, a review, a sign-up and a waitlist entry each, plus fields and events
+		for number in range(self.rows, rows):
+			user = User.objects.create(username=f'user{number}', email=f'user{number}@some.com')
+			Reservation.objects.create(user=user, field=self.field, reservation_date=self.monday + datetime.timedelta(days=number // 6), reservation_hour=16 + number % 6)
+			Reservation.objects.create(user=self.player, field=self.create_field(number + 1), reservation_date=self.monday, reservation_hour=16)
+			Review.objects.create(user=user, field=self.field, rating=1 + number % 5, comment='Nice')
+			Event.objects.create(title=f'Event {number}', content='Event', field=self.field, sport='Football')
+			signups.sign_up(user, self.event)
+			if number == 0:
+				signups.sign_up(user, self.full_event)
+			EventWaitlistEntry.objects.create(user=User.objects.create(username=f'waiting{number}', email=f'waiting{number}@some.com'), event=self.full_event)
+		if not UserEventRegistration.objects.filter(user=self.player, event=self.event).exists():
+			# cancel_sign_up is a GET
+			signups.sign_up(self.player, self.event)
+		EventWaitlistEntry.objects.get_or_create(user=self.player, event=self.full_event)
+		self.rows = rows
+
+	def url_kwargs(self, name):
+		return {
+			'profile_edit': {'pk': self.player.pk},
+			'profile_delete': {'pk': self.player.pk},
+			'update_field': {'pk': self.field.pk},
+			'delete_field': {'pk': self.field.pk},
+			'field_detail': {'pk': self.field.pk},
+			'reservation_form': {'pk': self.field.pk},
+			'recurring_reservation_form': {'pk': self.field.pk},
+			'slot_hold': {'pk': self.field.pk},
+			'slot_events': {'pk': self.field.pk, 'date': self.monday.isoformat()},
+			'field_availability': {'pk': self.field.pk},
+			'reservation_confirmation': {'pk': Reservation.objects.filter(user=self.player).latest('id').pk},
+			'field_schedule': {'field_id': self.field.pk},
+			'reservation_cancel': {'pk': Reservation.objects.filter(user=self.player).latest('id').pk},
+			'add_review': {'pk': self.field.pk},
+			'reviews': {'pk': self.field.pk},
+			'field_owner_reviews': {'pk': self.field.pk},
+			'add_event': {'pk': self.field.pk},
+			'events_list': {'pk': self.field.pk},
+			'field_list_by_sport': {'sport': 'Football'},
+			'event_detail': {'pk': self.event.pk},
+			'registered_users_list': {'pk': self.event.pk},
+			'cancel_sign_up': {'pk': self.event.pk},
+			'leave_waitlist': {'pk': self.full_event.pk},
+		}.get(name, {})
+
+	def url_query(self, name):
+		return {
+			'field_search': {'q': 'arena'},
+			'free_field_search': {'sport': 'Football', 'date': (self.monday + datetime.timedelta(days=7)).isoformat(), 'hour_from': 16},
+			'export_reservations': {'start_date': self.monday.isoformat(), 'end_date': (self.monday + datetime.timedelta(days=6)).isoformat()},
+		}.get(name, {})
+
+	def measure(self):
+		counts = {}
+		for pattern in urls.urlpatterns:
+			self.grow(self.rows)
+			# A fresh client, so messages left by the previous URL aren't counted
+			self.client = Client()
+			self.client.force_login(self.owner if pattern.name in self.OWNER_URLS else self.player)
+			# Cached catalog pages would hide the queries of the view
+			cache.clear()
+			url = reverse(pattern.name, kwargs=self.url_kwargs(pattern.name))
+			with count_queries() as counter:
+				response = self.client.get(url, self.url_query(pattern.name))
+				if response.streaming:
+					b''.join(response.streaming_content)
+			counts[pattern.name] = counter.count
+		return counts
+
+	def test_every_url_has_a_budget(self):
+		self.assertEqual(sorted(pattern.name for pattern in urls.urlpatterns if pattern.name not in QUERY_BUDGETS), [])
+
+	def test_query_counts_do_not_grow_with_rows(self):
+		self.grow(2)
+		few = self.measure()
+		self.grow(PER_PAGE + 10)
+		many = self.measure()
+		self.assertEqual(many, few)
+		for name, count in many.items():
+			self.assertLessEqual(count, QUERY_BUDGETS[name], name)
+
+
+class AsyncURLConf:
+	# The catalog served by its async view, as asgi.py does, with every other URL as usual
+	urlpatterns = [path('fields/', async_views.field_list, name='field_list')] + urls.urlpatterns
+
+
+async def asgi_get(url):
+	return await AsyncClient().get(url)
+
+
+class RequestMetricsTest(TestCase):
+	def setUp(self):
+		self.user = User.objects.create(username='player', email='player@some.com')
+		self.staff = User.objects.create(username='admin', email='admin@some.com', is_staff=True)
+		self.field = Field.objects.create(
+			field_owner=self.user,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=16,
+			end_working_day=7,
+			end_working_hour=21
+		)
+
+	def test_records_requests_queries_and_template_time(self):
+		before = metrics.collect().get('field_detail', [0] * metrics.ROW_SIZE)
+		self.client.get(reverse('field_detail', kwargs={'pk': self.field.pk}))
+		self.client.get(reverse('field_detail', kwargs={'pk': self.field.pk}))
+		after = metrics.collect()['field_detail']
+
+		self.assertEqual(after[metrics.REQUESTS] - before[metrics.REQUESTS], 2)
+		self.assertEqual(after[metrics.QUERIES] - before[metrics.QUERIES], 2)
+		self.assertGreater(after[metrics.SQL_SECONDS], before[metrics.SQL_SECONDS])
+		self.assertGreater(after[metrics.TEMPLATE_SECONDS], before[metrics.TEMPLATE_SECONDS])
+		self.assertEqual(sum(after[metrics.FIRST_BUCKET:]) - sum(before[metrics.FIRST_BUCKET:]), 2)
+
+	@override_settings(ROOT_URLCONF=AsyncURLConf)
+	def test_counts_the_queries_of_asgi_requests(self):
+		# Under ASGI the queries run in sync_to_async threads, on other connections than the
+		# middleware's: an async view and a sync one
+		pages = [('field_list', {}), ('field_detail', {'pk': self.field.pk})]
+		for name, kwargs in pages:
+			with self.subTest(name):
+				url = reverse(name, kwargs=kwargs)
+				cache.clear()
+				before = metrics.collect().get(name, [0] * metrics.ROW_SIZE)
+				self.assertEqual(async_to_sync(asgi_get)(url).status_code, 200)
+				middle = metrics.collect()[name]
+				cache.clear()
+				self.assertEqual(Client().get(url).status_code, 200)
+				after = metrics.collect()[name]
+
+				asgi_queries = middle[metrics.QUERIES] - before[metrics.QUERIES]
+				self.assertGreater(asgi_queries, 0)
+				self.assertEqual(asgi_queries, after[metrics.QUERIES] - middle[metrics.QUERIES])
+				self.assertGreater(middle[metrics.SQL_SECONDS], before[metrics.SQL_SECONDS])
+
+	@override_settings(ROOT_URLCONF=AsyncURLConf, DEBUG=True)
+	def test_query_budgets_hold_for_asgi_requests(self):
+		cache.clear()
+		with mock.patch.dict(QUERY_BUDGETS, {'field_list': 0}), self.assertLogs('playground4.web.query_budget', 'WARNING') as logs:
+			async_to_sync(asgi_get)(reverse('field_list'))
+		self.assertIn("ran 1 queries, the budget for 'field_list' is 0", logs.output[0])
+
+	def test_endpoint_is_for_staff_only(self):
+		self.client.force_login(self.user)
+		self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+		self.client.force_login(self.staff)
+		self.client.get(reverse('home'))
+		response = self.client.get(reverse('metrics'))
+		self.assertEqual(response.status_code, 200)
+		self.assertContains(response, 'playground4_request_duration_seconds_bucket{view="home",le="+Inf"}')
+		self.assertContains(response, '# TYPE playground4_db_queries_total counter')
+		self.assertContains(response, '# TYPE playground4_db_connections_held gauge')
+
+	def test_adds_up_worker_files(self):
+		with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+			row = [0] * metrics.ROW_SIZE
+			row[metrics.REQUESTS] = 5
+			for name in ('metrics-999999-finished.json', 'metrics-999998-running.json'):
+				with open(os.path.join(directory, name), 'w') as file:
+					json.dump({'views': {'home': row}, 'connections': {'default': [3, 2, 1, 1]}}, file)
+			# Last flushed long ago
+			old = time.time() - 10 * settings.METRICS_FLUSH_INTERVAL
+			os.utime(os.path.join(directory, 'metrics-999999-finished.json'), (old, old))
+			own = metrics.collect().get('home', [0] * metrics.ROW_SIZE)[metrics.REQUESTS]
+			own_connections = metrics.collect_connections().get('default', [0] * metrics.CONNECTION_ROW_SIZE)
+
+			metrics.flush()
+			pid, token = metrics.process_key()
+			self.assertEqual(pid, os.getpid())
+			self.assertTrue(os.path.exists(os.path.join(directory, f'metrics-{pid}-{token}.json')))
+			# The own file is skipped in favour of the live numbers
+			self.assertEqual(metrics.collect_all()['home'][metrics.REQUESTS], own + 10)
+			# The finished worker's counters stay, the connection it held is gone
+			connections_totals = metrics.collect_all_connections()['default']
+			self.assertEqual(connections_totals[metrics.OPENED], own_connections[metrics.OPENED] + 6)
+			self.assertEqual(connections_totals[metrics.HELD], own_connections[metrics.HELD] + 1)
+
+	def test_requests_never_write_the_file(self):
+		with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+			self.client.get(reverse('home'))
+			self.assertEqual(os.listdir(directory), [])
+			self.assertTrue(any(thread.name == 'metrics-flush' for thread in threading.enumerate()))
+
+
+class ConnectionReuseTest(TransactionTestCase):
+	# Through the WSGI handler, which closes or keeps connections like a server does
+	def setUp(self):
+		self.handler = WSGIHandler()
+		self.max_age = connection.settings_dict['CONN_MAX_AGE']
+
+	def tearDown(self):
+		connection.settings_dict['CONN_MAX_AGE'] = self.max_age
+		connection.close()
+
+	def get(self, url_name):
+		# A cached page would need no connection at all
+		cache.clear()
+		status = []
+		response = self.handler(
+			RequestFactory().get(reverse(url_name)).environ,
+			lambda code, headers, exc_info=None: status.append(code),
+		)
+		response.close()
+		self.assertEqual(status, ['200 OK'])
+
+	def requests(self, max_age, count=3):
+		connection.settings_dict['CONN_MAX_AGE'] = max_age
+		connection.close()
+		before = metrics.collect_connections().get('default', [0] * metrics.CONNECTION_ROW_SIZE)
+		for _ in range(count):
+			self.get('field_list')
+		after = metrics.collect_connections()['default']
+		return [later - earlier for earlier, later in zip(before, after)], after[metrics.HELD]
+
+	def test_new_connection_per_request_without_max_age(self):
+		changes, held = self.requests(0)
+		self.assertEqual(changes[metrics.OPENED], 3)
+		self.assertEqual(changes[metrics.REUSED], 0)
+		self.assertEqual(held, 0)
+
+	def test_persistent_connection_is_reused(self):
+		changes, held = self.requests(60)
+		self.assertEqual(changes[metrics.OPENED], 1)
+		self.assertEqual(changes[metrics.REUSED], 2)
+		self.assertEqual(held, 1)
+
+	def test_broken_connection_fails_health_check(self):
+		self.requests(60, count=1)
+		# Like a restarted server or a dropped network connection
+		connection.connection.close()
+		before = metrics.collect_connections()['default']
+		self.get('field_list')
+		after = metrics.collect_connections()['default']
+		self.assertEqual(after[metrics.REPLACED] - before[metrics.REPLACED], 1)
+		self.assertEqual(after[metrics.OPENED] - before[metrics.OPENED], 1)
+
+
+class DatasetBenchmarkTest(TestCase):
+	def test_generates_consistent_dataset_and_report(self):
+		call_command(
+			'generate_dataset', prefix='t', owners=2, users=20, fields=4, years=1, reviews=3, events=2, registrations=4,
+			stdout=StringIO(),
+		)
+		self.assertEqual(User.objects.filter(username__startswith='t-user-').count(), 20)
+		field = Field.objects.filter(field_owner__username__startswith='t-owner-').first()
+		self.assertEqual(field.rating_count, 3)
+		# The availability index matches the generated reservations
+		for date, mask in FieldAvailability.objects.filter(field=field).values_list('date', 'booked_mask'):
+			hours = Reservation.objects.filter(field=field, reservation_date=date).values_list('reservation_hour', flat=True)
+			self.assertEqual(mask, availability.hours_mask(hours))
+		self.assertTrue(all(event.registered_count == 4 for event in Event.objects.filter(field__in=Field.objects.filter(field_owner__username__startswith='t-owner-'))))
+		# The generated history has its own month partitions
+		self.assertEqual(partitions.waiting_months(), [])
+
+		reservations = Reservation.objects.count()
+		with tempfile.TemporaryDirectory() as directory:
+			output = os.path.join(directory, 'report.json')
+			call_command('benchmark_views', prefix='t', runs=2, warmup=0, output=output, stdout=StringIO())
+			with open(output) as file:
+				report = json.load(file)
+		self.assertEqual(set(report['views']), {'field_list', 'field_detail', 'reservation_create', 'field_schedule', 'all_events_list', 'schedule'})
+		self.assertEqual(report['views']['reservation_create']['statuses'], [302])
+		self.assertEqual(report['views']['field_list']['queries'], QUERY_BUDGETS['field_list'])
+		self.assertFalse(report['views']['reservation_create']['committed'])
+		# The field the benchmark booked and its bookings are deleted
+		self.assertEqual(Reservation.objects.count(), reservations)
+		self.assertFalse(Field.objects.filter(name__startswith='Benchmark bookings').exists())
+
+
+class ReservationExportTest(TestCase):
+	def setUp(self):
+		self.owner = User.objects.create(username='owner', email='owner@some.com', field_owner=True)
+		self.other_owner = User.objects.create(username='other', email='other@some.com', field_owner=True)
+		self.player = User.objects.create(username='player', email='player@some.com')
+		self.arena = self.create_field(self.owner, 'Arena', 30)
+		self.court = self.create_field(self.owner, 'Court', 20)
+		self.park = self.create_field(self.other_owner, 'Park', 10)
+		for field in (self.arena, self.court, self.park):
+			for day in (1, 2, 20):
+				Reservation.objects.create(user=self.player, field=field, reservation_date=datetime.date(2023, 7, day), reservation_hour=18)
+		self.client.force_login(self.owner)
+
+	def create_field(self, owner, name, price):
+		return Field.objects.create(
+			field_owner=owner,
+			name=name,
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			price_per_hour=price,
+			start_working_day=1,
+			start_working_hour=16,
+			end_working_day=7,
+			end_working_hour=21
+		)
+
+	def export(self, **params):
+		response = self.client.get(reverse('export_reservations'), {'start_date': '2023-07-01', 'end_date': '2023-07-10', **params})
+		self.assertTrue(response.streaming)
+		return b''.join(response.streaming_content).decode().splitlines()
+
+	def test_streams_owner_reservations_in_range(self):
+		lines = self.export()
+		self.assertEqual(lines[0], 'reservation,field,user,date,hour,duration,price_per_hour')
+		self.assertEqual([line.split(',')[1:] for line in lines[1:]], [
+			['Arena', 'player', '2023-07-01', '18', '1', '30'],
+			['Court', 'player', '2023-07-01', '18', '1', '20'],
+			['Arena', 'player', '2023-07-02', '18', '1', '30'],
+			['Court', 'player', '2023-07-02', '18', '1', '20'],
+		])
+
+	def test_single_field(self):
+		self.assertEqual(len(self.export(field=self.court.pk)), 3)
+		# Other owners' fields can't be picked
+		response = self.client.get(reverse('export_reservations'), {'start_date': '2023-07-01', 'end_date': '2023-07-10', 'field': self.park.pk})
+		self.assertFalse(response.streaming)
+		self.assertIn('field', response.context['form'].errors)
+
+	def test_admin_action(self):
+		admin_user = User.objects.create(username='admin', email='admin@some.com', is_staff=True, is_superuser=True)
+		self.client.force_login(admin_user)
+		response = self.client.post(reverse('admin:web_reservation_changelist'), {
+			'action': 'export_as_csv',
+			'_selected_action': list(Reservation.objects.filter(field=self.park).values_list('pk', flat=True)),
+		})
+		lines = b''.join(response.streaming_content).decode().splitlines()
+		self.assertEqual(len(lines), 4)
+		self.assertTrue(all(',Park,' in line for line in lines[1:]))
+
+
+class BookingRollupTest(TestCase):
+	def setUp(self):
+		self.owner = User.objects.create(username='owner', email='owner@some.com', field_owner=True)
+		self.player = User.objects.create(username='player', email='player@some.com')
+		# Open Monday - Friday, 18:00 - 21:00
+		self.field = Field.objects.create(
+			field_owner=self.owner,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			price_per_hour=25,
+			start_working_day=1,
+			start_working_hour=18,
+			end_working_day=5,
+			end_working_hour=21
+		)
+		# Wednesday
+		self.today = datetime.date(2023, 7, 12)
+
+	def reserve(self, date, hour):
+		return Reservation.objects.create(user=self.player, field=self.field, reservation_date=date, reservation_hour=hour)
+
+	def daily(self):
+		return dict(FieldDailyStats.objects.filter(field=self.field).values_list('date', 'bookings'))
+
+	def monthly(self):
+		return dict(FieldMonthlyStats.objects.filter(field=self.field).values_list('month', 'bookings'))
+
+	def test_kept_up_to_date_on_booking_moving_and_cancelling(self):
+		first = self.reserve(self.today, 18)
+		self.reserve(self.today, 19)
+		self.reserve(datetime.date(2023, 8, 1), 18)
+		self.assertEqual(self.daily(), {self.today: 2, datetime.date(2023, 8, 1): 1})
+		self.assertEqual(self.monthly(), {datetime.date(2023, 7, 1): 2, datetime.date(2023, 8, 1): 1})
+
+		first.reservation_date = datetime.date(2023, 7, 13)
+		first.save()
+		self.assertEqual(self.daily()[self.today], 1)
+		self.assertEqual(self.daily()[datetime.date(2023, 7, 13)], 1)
+
+		first.delete()
+		self.assertEqual(self.daily()[datetime.date(2023, 7, 13)], 0)
+		self.assertEqual(self.monthly()[datetime.date(2023, 7, 1)], 1)
+
+	def test_deleting_a_booked_field_or_its_owner(self):
+		self.reserve(self.today, 18)
+		self.field.delete()
+		self.assertFalse(FieldDailyStats.objects.exists())
+
+		self.field = Field.objects.create(field_owner=self.owner, name='Court', location='Plovdiv', sport='Tennis', description='Clay')
+		self.reserve(self.today, 16)
+		self.owner.delete()
+		self.assertFalse(FieldMonthlyStats.objects.exists())
+
+	def test_bulk_booking_and_rebuild(self):
+		booking.book_slots(self.player, self.field, [(datetime.date(2023, 7, 10), 18), (datetime.date(2023, 7, 10), 19), (datetime.date(2023, 7, 17), 18)])
+		self.assertEqual(self.daily(), {datetime.date(2023, 7, 10): 2, datetime.date(2023, 7, 17): 1})
+
+		FieldDailyStats.objects.update(bookings=0)
+		FieldMonthlyStats.objects.all().delete()
+		call_command('rebuild_rollups', stdout=StringIO())
+		self.assertEqual(self.daily(), {datetime.date(2023, 7, 10): 2, datetime.date(2023, 7, 17): 1})
+		self.assertEqual(self.monthly(), {datetime.date(2023, 7, 1): 3})
+
+	def test_owner_summary(self):
+		for date, hour in [(self.today, 18), (self.today, 19), (datetime.date(2023, 7, 10), 20), (datetime.date(2023, 7, 28), 18), (datetime.date(2023, 6, 30), 18)]:
+			self.reserve(date, hour)
+
+		with self.assertNumQueries(3):
+			summary = rollups.owner_summary(self.owner, self.today)
+		row = summary['rows'][0]
+		# 4 open hours a day, 5 open days a week, 21 working days in July 2023
+		self.assertEqual(row['day'], {'bookings': 2, 'revenue': 50, 'occupancy': 50})
+		self.assertEqual(row['week'], {'bookings': 3, 'revenue': 75, 'occupancy': 15})
+		self.assertEqual(row['month'], {'bookings': 4, 'revenue': 100, 'occupancy': 5})
+		self.assertEqual(summary['total']['month'], row['month'])
+
+		# Saturday, the field is closed
+		self.assertIsNone(rollups.owner_summary(self.owner, datetime.date(2023, 7, 15))['rows'][0]['day']['occupancy'])
+
+	def test_dashboard_page(self):
+		self.reserve(timezone.localdate(), 18)
+		self.client.force_login(self.owner)
+		response = self.client.get(reverse('owner_dashboard'))
+		self.assertContains(response, 'Arena')
+		self.assertEqual(response.context['total']['month']['revenue'], 25)
+
+
+class ReservationPartitionTest(TestCase):
+	def setUp(self):
+		self.user = User.objects.create(username='player', email='player@some.com')
+		self.field = Field.objects.create(
+			field_owner=self.user,
+			name='Arena',
+			location='Plovdiv',
+			sport='Football',
+			description='Brand new facilities',
+			start_working_day=1,
+			start_working_hour=16,
+			end_working_day=7,
+			end_working_hour=21
+		)
+		self.today = timezone.localdate()
+
+	def reserve(self, date, hour=18):
+		return Reservation.objects.create(user=self.user, field=self.field, reservation_date=date, reservation_hour=hour)
+
+	def partition_of(self, reservation):
+		with connection.cursor() as cursor:
+			cursor.execute('SELECT tableoid::regclass::text FROM web_reservation WHERE id = %s', [reservation.pk])
+			return cursor.fetchone()[0]
+
+	def test_rows_go_to_their_month(self):
+		names = [name for name, start, end in partitions.partitions()]
+		self.assertIn(partitions.partition_name(self.today.replace(day=1)), names)
+		self.assertIn(partitions.DEFAULT_PARTITION, names)
+		self.assertEqual(self.partition_of(self.reserve(self.today)), partitions.partition_name(self.today.replace(day=1)))
+
+	def test_new_partition_takes_rows_from_default(self):
+		far = datetime.date(self.today.year + 5, 3, 10)
+		reservation = self.reserve(far)
+		self.assertEqual(self.partition_of(reservation), partitions.DEFAULT_PARTITION)
+
+		self.assertTrue(partitions.create_partition(far.replace(day=1)))
+		self.assertFalse(partitions.create_partition(far.replace(day=1)))
+		self.assertEqual(self.partition_of(reservation), partitions.partition_name(far.replace(day=1)))
+		# The unique slot and overlap constraints cover the new partition too
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			self.reserve(far)
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			Reservation.objects.create(user=self.user, field=self.field, reservation_date=far, reservation_hour=17, duration=2)
+
+	def test_archive_old_months(self):
+		partitions.create_partition(datetime.date(2001, 1, 1))
+		old = self.reserve(datetime.date(2001, 1, 15))
+		kept = self.reserve(self.today)
+
+		self.assertEqual(partitions.archive_partitions(datetime.date(2001, 2, 1)), ['web_reservation_2001_01'])
+		self.assertFalse(Reservation.objects.filter(pk=old.pk).exists())
+		self.assertTrue(Reservation.objects.filter(pk=kept.pk).exists())
+		with connection.cursor() as cursor:
+			cursor.execute('SELECT count(*) FROM archive.web_reservation_2001_01')
+			self.assertEqual(cursor.fetchone()[0], 1)
+
+	def test_past_months_are_split_out_of_default(self):
+		# As generate_dataset or an import inserts history before its months have partitions
+		months = [datetime.date(2002, 5, 1), datetime.date(2002, 7, 1)]
+		old = [self.reserve(month + datetime.timedelta(days=3)) for month in months]
+		self.assertEqual([self.partition_of(reservation) for reservation in old], [partitions.DEFAULT_PARTITION] * 2)
+
+		created = partitions.ensure_partitions(self.today)
+		self.assertIn('web_reservation_2002_05', created)
+		self.assertNotIn('web_reservation_2002_06', created)
+		self.assertEqual([self.partition_of(reservation) for reservation in old], ['web_reservation_2002_05', 'web_reservation_2002_07'])
+		self.assertEqual(partitions.waiting_months(), [])
+
+		self.assertEqual(partitions.archive_partitions(datetime.date(2002, 8, 1)), ['web_reservation_2002_05', 'web_reservation_2002_07'])
+		self.assertFalse(Reservation.objects.filter(pk__in=[reservation.pk for reservation in old]).exists())
+
+	def test_command_creates_months_ahead(self):
+		out = StringIO()
+		call_command('reservation_partitions', ahead=30, stdout=out)
+		last = self.today.replace(day=1)
+		for _ in range(30):
+			last = partitions.next_month(last)
+		self.assertIn(f'Created {partitions.partition_name(last)}', out.getvalue())
+
+	def test_schedule_splits_upcoming_and_history(self):
+		past = self.reserve(self.today - datetime.timedelta(days=40))
+		upcoming = self.reserve(self.today + datetime.timedelta(days=2))
+		self.client.force_login(self.user)
+		self.assertEqual(list(self.client.get(reverse('schedule')).context['reservations']), [upcoming])
+		response = self.client.get(reverse('schedule_history'))
+		self.assertEqual(list(response.context['reservations']), [past])
+		self.assertNotContains(response, 'Cancel Reservation')
+
+
+
+class HotQueryPlanTest(TestCase):
+	# Every hot lookup must be served by an index. Sequential scans are switched off, so the
+	# planner only still picks one when no index fits the query.
+	@classmethod
+	def setUpTestData(cls):
+		call_command(
+			'generate_dataset', prefix='plan', owners=2, users=30, fields=4, years=1, ahead=30, reviews=5, events=3,
+			registrations=5, stdout=StringIO(),
+		)
+		cls.field = Field.objects.filter(field_owner__username__startswith='plan-owner-').select_related('field_owner').first()
+		cls.review = Review.objects.filter(field=cls.field).first()
+		cls.registration = UserEventRegistration.objects.filter(event__field=cls.field).first()
+		cls.today = timezone.localdate()
+
+	def hot_queries(self):
+		field, user, event = self.field, self.review.user, self.registration.event
+		week = (self.today, self.today + datetime.timedelta(days=6))
+		return {
+			'slot_taken': Reservation.objects.filter(field=field, reservation_date=self.today, reservation_hour=18),
+			'slot_overlap': booking.overlapping(field.pk, self.today, 18, 2),
+			'field_schedule': Reservation.objects.filter(field=field, reservation_date__range=week).select_related('user'),
+			'user_schedule': Reservation.objects.filter(user=user, reservation_date__gte=self.today)
+				.select_related('field').order_by('reservation_date', 'reservation_hour', 'id')[:PER_PAGE + 1],
+			'user_history': Reservation.objects.filter(user=user, reservation_date__lt=self.today)
+				.order_by('-reservation_date', '-reservation_hour', '-id')[:PER_PAGE + 1],
+			'field_availability': FieldAvailability.objects.filter(field=field, date__range=week),
+			'slot_hold': SlotHold.objects.filter(field=field, hold_date=self.today, hold_hour=18, expires_at__gt=timezone.now()),
+			'field_holds': SlotHold.objects.filter(field=field, hold_date__range=week, expires_at__gt=timezone.now()),
+			'expired_holds': SlotHold.objects.filter(expires_at__lte=timezone.now()),
+			'user_holds': SlotHold.objects.filter(user=user),
+			'has_reviewed': Review.objects.filter(user=user, field=field),
+			'field_reviews': Review.objects.filter(field=field).select_related('user').order_by('-created_at', '-id')[:PER_PAGE + 1],
+			'field_events': Event.objects.filter(field=field).order_by('-date_published', '-id')[:PER_PAGE + 1],
+			'all_events': Event.objects.select_related('field').order_by('-date_published', '-id')[:PER_PAGE + 1],
+			'is_registered': UserEventRegistration.objects.filter(user=self.registration.user, event=event),
+			'registered_users': UserEventRegistration.objects.filter(event=event).select_related('user')
+				.order_by('registration_date', 'id')[:PER_PAGE + 1],
+			'signed_up_events': UserEventRegistration.objects.filter(user=self.registration.user).select_related('event'),
+			'waitlist_head': EventWaitlistEntry.objects.filter(event=event).order_by('id')[:1],
+			'waitlisted_events': EventWaitlistEntry.objects.filter(user=user),
+			'fields_by_sport': Field.objects.filter(sport=field.sport).order_by('id')[:PER_PAGE + 1],
+			'my_fields': Field.objects.filter(field_owner=field.field_owner),
+			'dashboard_days': FieldDailyStats.objects.filter(field=field, date__range=week),
+			'dashboard_month': FieldMonthlyStats.objects.filter(field=field, month=self.today.replace(day=1)),
+		}
+
+	def test_hot_queries_use_indexes(self):
+		with connection.cursor() as cursor:
+			cursor.execute('SET LOCAL enable_seqscan = off')
+		for name, queryset in self.hot_queries().items():
+			with self.subTest(name):
+				plan = queryset.explain()
+				self.assertNotIn('Seq Scan', plan, f'{name} has no fitting index:\n{plan}')
+
+	def test_overlap_probe_uses_the_exclusion_index(self):
+		with connection.cursor() as cursor:
+			cursor.execute('SET LOCAL enable_seqscan = off')
+		plan = booking.overlapping(self.field.pk, self.today, 17, 3).explain()
+		self.assertIn(f'{partitions.partition_name(self.today.replace(day=1))}_no_overlap', plan)
+		self.assertNotIn('Append', plan)
+
+	def test_one_review_per_field(self):
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			Review.objects.create(user=self.review.user, field=self.field, rating=1, comment='Again')
+
+		self.client.force_login(self.review.user)
+		response = self.client.post(reverse('add_review', kwargs={'pk': self.field.pk}), {'rating': 1, 'comment': 'Again'})
+		self.assertContains(response, 'You have already reviewed this field.')
+		self.assertEqual(Review.objects.filter(user=self.review.user, field=self.field).count(), 1)
+
+
+class ReplicaRoutingTest(TransactionTestCase):
+	# A TransactionTestCase commits its rows, so the stand-in replica connection sees them
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		# Stand-ins: another connection to the test database and one to a closed port
+		default = connections['default'].settings_dict
+		test = {**default['TEST'], 'MIRROR': 'default'}
+		connections.settings['replica'] = {**default, 'TEST': test}
+		connections.settings['broken_replica'] = {**default, 'PORT': '1', 'TEST': test}
+
+	@classmethod
+	def tearDownClass(cls):
+		for alias in ('replica', 'broken_replica'):
+			connections[alias].close()
+			del connections[alias]
+			del connections.settings[alias]
+		super().tearDownClass()
+
+	def setUp(self):
+		cache.clear()
+		replicas._down_until.clear()
+		self.user = User.objects.create_user(username='aleks', email='aleks@some.com', password='dadadada')
+		self.field = Field.objects.create(field_owner=self.user, name='Arena', location='Plovdiv', sport='Football', description='Grass')
+		self.client.force_login(self.user)
+
+	def get(self, url_name, alias='replica', **kwargs):
+		with CaptureQueriesContext(connections[alias]) as queries:
+			response = self.client.get(reverse(url_name, kwargs=kwargs))
+		self.assertEqual(response.status_code, 200)
+		return response, len(queries)
+
+	@override_settings(DATABASE_REPLICAS=['replica'])
+	def test_catalog_views_read_from_replica(self):
+		response, replica_queries = self.get('field_list')
+		self.assertContains(response, 'Arena')
+		self.assertGreater(replica_queries, 0)
+		self.assertGreater(self.get('reviews', pk=self.field.pk)[1], 0)
+		# Anything else stays on the primary
+		self.assertEqual(self.get('field_detail', pk=self.field.pk)[1], 0)
+
+	@override_settings(DATABASE_REPLICAS=['replica'])
+	def test_writes_pin_to_primary(self):
+		response = self.client.post(reverse('add_review', kwargs={'pk': self.field.pk}), {'rating': 5, 'comment': 'Great pitch'})
+		self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'], 10)
+
+		response, replica_queries = self.get('reviews', pk=self.field.pk)
+		self.assertContains(response, 'Great pitch')
+		self.assertEqual(replica_queries, 0)
+
+		del self.client.cookies[replicas.PIN_COOKIE]
+		cache.clear()
+		self.assertGreater(self.get('reviews', pk=self.field.pk)[1], 0)
+
+	@override_settings(DATABASE_REPLICAS=['broken_replica'])
+	def test_failed_replica_falls_back_to_primary(self):
+		with self.assertLogs('playground4.web.replicas', 'WARNING'):
+			response, primary_queries = self.get('field_list', alias='default')
+		self.assertContains(response, 'Arena')
+		self.assertGreater(primary_queries, 0)
+		# Skipped without another connection attempt until it is retried
+		with self.assertNoLogs('playground4.web.replicas', 'WARNING'):
+			self.get('field_list', alias='default')
+
+
+class AsyncReadViewTest(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.owner = User.objects.create(username='owner', email='owner@some.com', field_owner=True, company_name='Arenas Ltd')
+		self.player = User.objects.create(username='player', email='player@some.com')
+		self.field = Field.objects.create(field_owner=self.owner, name='Arena', location='Plovdiv', sport='Football', description='Grass')
+		Review.objects.create(user=self.player, field=self.field, rating=4, comment='Nice')
+		for number in range(PER_PAGE + 2):
+			Event.objects.create(title=f'Cup {number}', content='Knock out', sport='Football', field=self.field)
+
+	def respond(self, view, factory, user, url, **kwargs):
+		cache.clear()
+		request = factory.get(url)
+		request.user = user
+		with CaptureQueriesContext(connection) as queries:
+			response = async_to_sync(view)(request, **kwargs) if factory is self.async_factory else view(request, **kwargs)
+			if hasattr(response, 'render'):
+				response.render()
+		# Tokens differ per render
+		return re.sub(r'name="csrfmiddlewaretoken" value="[^"]+"', '', response.content.decode()), len(queries)
+
+	def test_pages_match_sync_views(self):
+		self.async_factory = AsyncRequestFactory()
+		pages = [
+			('field_list', views.field_list, async_views.field_list, {}),
+			('field_detail', views.FieldDetailView.as_view(), async_views.field_detail, {'pk': self.field.pk}),
+			('reviews', views.ReviewListView.as_view(), async_views.reviews, {'pk': self.field.pk}),
+			('events_list', views.EventsListView.as_view(), async_views.events_list, {'pk': self.field.pk}),
+			('all_events_list', views.AllEventsListView.as_view(), async_views.all_events_list, {}),
+			('field_list_by_sport', views.FieldListBySportView.as_view(), async_views.field_list_by_sport, {'sport': 'football'}),
+		]
+		for url_name, sync_view, async_view, kwargs in pages:
+			for user in (self.player, AnonymousUser()):
+				with self.subTest(url_name, user=user):
+					url = reverse(url_name, kwargs=kwargs)
+					self.assertEqual(
+						self.respond(async_view, self.async_factory, user, url, **kwargs),
+						self.respond(sync_view, RequestFactory(), user, url, **kwargs),
+					)
+
+	def test_field_detail_knows_the_reviewer(self):
+		request = AsyncRequestFactory().get(reverse('field_detail', kwargs={'pk': self.field.pk}))
+		request.user = self.player
+		self.assertContains(async_to_sync(async_views.field_detail)(request, pk=self.field.pk), 'You have already left a review for this field.')
+
+	def test_missing_field_and_unsafe_methods(self):
+		request = AsyncRequestFactory().get('/')
+		request.user = AnonymousUser()
+		with self.assertRaises(Http404):
+			async_to_sync(async_views.reviews)(request, pk=self.field.pk + 1)
+		request = AsyncRequestFactory().post('/')
+		self.assertEqual(async_to_sync(async_views.field_list)(request).status_code, 405)
+
+
+@override_settings(SLOT_EVENTS_HEARTBEAT=60)
+class LiveSlotsTest(TransactionTestCase):
+	# Notifications are only delivered on commit, so nothing here runs in a test transaction
+	def setUp(self):
+		self.owner = User.objects.create(username='owner', email='owner@some.com', field_owner=True, company_name='Arenas Ltd')
+		self.player = User.objects.create(username='player', email='player@some.com')
+		self.field = Field.objects.create(
+			field_owner=self.owner, name='Arena', location='Plovdiv', sport='Football', description='Grass',
+			start_working_day=1, end_working_day=5, start_working_hour=17, end_working_hour=20,
+		)
+		# A Tuesday
+		self.date = datetime.date(2023, 8, 1)
+
+	def test_stream_follows_bookings_and_cancellations(self):
+		def book(hour):
+			return Reservation.objects.create(user=self.player, field=self.field, reservation_date=self.date, reservation_hour=hour)
+
+		def book_rolled_back():
+			with transaction.atomic():
+				book(19)
+				transaction.set_rollback(True)
+
+		async def events():
+			request = AsyncRequestFactory().get('/')
+			response = await async_views.slot_events(request, pk=self.field.pk, date=self.date.isoformat())
+			chunks = response.__aiter__()
+			received = [await anext(chunks)]
+			# The free hours again once the process listens
+			received.append(await asyncio.wait_for(anext(chunks), 10))
+			reservation = await sync_to_async(book)(18)
+			await sync_to_async(book_rolled_back)()
+			# Another date
+			await sync_to_async(Reservation.objects.create)(user=self.player, field=self.field, reservation_date=self.date + datetime.timedelta(days=1), reservation_hour=18)
+			await sync_to_async(reservation.delete)()
+			received.append(await asyncio.wait_for(anext(chunks), 10))
+			received.append(await asyncio.wait_for(anext(chunks), 10))
+			await chunks.aclose()
+			await live_slots.get_hub().stop()
+			# The thread the ORM calls ran in keeps its connection otherwise
+			await sync_to_async(connections.close_all)()
+			return received
+
+		received = asyncio.run(events())
+
+		self.assertEqual(received, [
+			b'retry: 2000\nevent: free\ndata: {"hours": [17, 18, 19, 20]}\n\n',
+			b'event: free\ndata: {"hours": [17, 18, 19, 20]}\n\n',
+			b'event: taken\ndata: {"hours": [18]}\n\n',
+			b'event: freed\ndata: {"hours": [18]}\n\n',
+		])
+
+	def test_hub_resyncs_streams_that_fall_behind(self):
+		hub = live_slots.SlotHub()
+
+		async def fill():
+			queue = asyncio.Queue(live_slots.QUEUE_SIZE)
+			hub.streams[(self.field.pk, self.date.isoformat())] = {queue}
+			payload = json.dumps({'field': self.field.pk, 'event': live_slots.TAKEN, 'slots': [[self.date.isoformat(), 18]]})
+			for _ in range(live_slots.QUEUE_SIZE + 1):
+				hub.deliver(payload)
+			return [queue.get_nowait() for _ in range(queue.qsize())]
+
+		self.assertEqual(asyncio.run(fill()), [(live_slots.RESYNC, [])])
+
+	def test_wsgi_tells_the_browser_not_to_reconnect(self):
+		url = reverse('slot_events', kwargs={'pk': self.field.pk, 'date': self.date.isoformat()})
+		self.assertEqual(self.client.get(url).status_code, 204)
+
+	def test_bad_date(self):
+		request = AsyncRequestFactory().get('/')
+		with self.assertRaises(Http404):
+			async_to_sync(async_views.slot_events)(request, pk=self.field.pk, date='tuesday')
@@ -1,12 +1,17 @@
+from django.conf import settings
 from django.urls import path
 from django.views.defaults import page_not_found
 
-from playground4.web import views
+from playground4.web import async_views, views
 from playground4.web.views import FieldCreateView, FieldUpdateView, FieldDeleteView, ScheduleListView, \
 	FieldScheduleView, ReviewListView, FieldOwnerReviews, \
 	AddEventView, EventsListView, AllEventsListView, FieldDetailView, SignedUpEventsListView, cancel_sign_up, \
 	change_password
 
+# The hot read views as async views under ASGI (see async_views.py)
+def read_view(sync_view, async_view):
+	return async_view if settings.ASYNC_VIEWS else sync_view
+
 urlpatterns=[
 	path('register/', views.register, name='register'),
 	path('login/success/', views.login_success, name='login_success'),
@@ -19,26 +24,37 @@ urlpatterns=[
 	path('fields/add/', FieldCreateView.as_view(), name='add_field'),
     path('fields/<int:pk>/update/', FieldUpdateView.as_view(), name='update_field'),
     path('fields/<int:pk>/delete/', FieldDeleteView.as_view(), name='delete_field'),
-	path('fields/', views.field_list, name='field_list'),
+	path('fields/', read_view(views.field_list, async_views.field_list), name='field_list'),
 	path('fields/my/', views.my_fields, name='my_fields'),
-	path('field_detail/<int:pk>/', FieldDetailView.as_view(), name='field_detail'),
+	path('fields/dashboard/', views.owner_dashboard, name='owner_dashboard'),
+	path('fields/search/', views.FieldSearchView.as_view(), name='field_search'),
+	path('fields/free/', views.FreeFieldSearchView.as_view(), name='free_field_search'),
+	path('field_detail/<int:pk>/', read_view(FieldDetailView.as_view(), async_views.field_detail), name='field_detail'),
 	path('field/<int:pk>/reserve/', views.ReservationCreateView.as_view(), name='reservation_form'),
+	path('field/<int:pk>/hold/', views.hold_slot, name='slot_hold'),
+	path('field/<int:pk>/slots/<str:date>/events/', read_view(views.slot_events, async_views.slot_events), name='slot_events'),
+	path('field/<int:pk>/reserve/recurring/', views.RecurringReservationCreateView.as_view(), name='recurring_reservation_form'),
+	path('field/<int:pk>/availability/', views.field_availability, name='field_availability'),
 	path('reservation/<int:pk>/confirmation/', views.reservation_confirmation, name='reservation_confirmation'),
 	path('schedule/', ScheduleListView.as_view(), name='schedule'),
+	path('schedule/history/', views.ScheduleHistoryView.as_view(), name='schedule_history'),
 	path('field/<int:field_id>/schedule/', FieldScheduleView.as_view(), name='field_schedule'),
 	path('reservation/<int:pk>/cancel/', views.ReservationCancelView.as_view(), name='reservation_cancel'),
+	path('reservations/export/', views.export_reservations, name='export_reservations'),
 	path('field/<int:pk>/add_review/', views.AddReviewView.as_view(), name='add_review'),
-	path('reviews/<int:pk>/', ReviewListView.as_view(), name='reviews'),
+	path('reviews/<int:pk>/', read_view(ReviewListView.as_view(), async_views.reviews), name='reviews'),
 	path('reviews/field/<int:pk>/', FieldOwnerReviews.as_view(), name='field_owner_reviews'),
 	path('add_event/<int:pk>/', AddEventView.as_view(), name='add_event'),
-	path('events_list/<int:pk>/', EventsListView.as_view(), name='events_list'),
-	path('all_events/', AllEventsListView.as_view(), name='all_events_list'),
-	path('fields/<str:sport>/', views.FieldListBySportView.as_view(), name='field_list_by_sport'),
+	path('events_list/<int:pk>/', read_view(EventsListView.as_view(), async_views.events_list), name='events_list'),
+	path('all_events/', read_view(AllEventsListView.as_view(), async_views.all_events_list), name='all_events_list'),
+	path('fields/<str:sport>/', read_view(views.FieldListBySportView.as_view(), async_views.field_list_by_sport), name='field_list_by_sport'),
 	path('event/<int:pk>/', views.event_detail, name='event_detail'),
 	path('event/<int:pk>/registered-users/', views.registered_users_list, name='registered_users_list'),
 	path('my-signed-up-events/', SignedUpEventsListView.as_view(), name='my_signed_up_events'),
 	path('cancel-sign-up/<int:pk>/', cancel_sign_up, name='cancel_sign_up'),
+	path('leave-waitlist/<int:pk>/', views.leave_waitlist, name='leave_waitlist'),
 	path('change-password/', change_password, name='change_password'),
+	path('metrics/', views.metrics_view, name='metrics'),
 ]
 
 
@@ -4,17 +4,28 @@ from django import forms
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth import login, authenticate, logout
-from django.http import HttpResponseRedirect
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views import View
-from .forms import LoginForm, RegistrationForm, ReservationForm, ReviewForm, EventForm
-from .models import User, Field, Reservation, Review, Event, UserEventRegistration
+from . import availability, booking, exports, holds, metrics, rollups, schedule, signups
+from .forms import LoginForm, RegistrationForm, ReservationForm, RecurringReservationForm, ReviewForm, EventForm, FieldSearchForm, \
+    FreeFieldSearchForm, ReservationExportForm, OpeningHoursFormSet, OpeningExceptionFormSet
+from .page_cache import cache_catalog_page
+from .pagination import KeysetPaginationMixin, keyset_paginate
+from .search import free_fields, search_fields
+from .models import User, Field, Reservation, Review, Event, UserEventRegistration, EventWaitlistEntry, OpeningException
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 from django.shortcuts import render, redirect, get_object_or_404
-from django.views.generic.edit import CreateView, UpdateView, DeleteView
+from django.views.generic.edit import CreateView, UpdateView, DeleteView, FormView
 from django.urls import reverse_lazy
 from django.views.generic import ListView
 
+MAX_AVAILABILITY_DAYS = 31
+
 
 def register(request):
     if request.method == 'POST':
@@ -78,9 +89,46 @@ class ProfileDeleteView(LoginRequiredMixin, DeleteView):
 
 
 
+@cache_catalog_page('field', 'review')
 def field_list(request):
-    fields = Field.objects.all()
-    return render(request, 'field/field_list.html', {'fields': fields})
+    fields = keyset_paginate(request, Field.objects.all(), ['id'])
+    return render(request, 'field/field_list.html', {'fields': fields, 'page': fields})
+
+
+class FieldSearchView(View):
+    template_name = 'field/field_search.html'
+
+    def get(self, request):
+        form = FieldSearchForm(request.GET)
+        fields = None
+        if form.is_valid():
+            queryset, ordering = search_fields(
+                form.cleaned_data['q'].strip(),
+                form.cleaned_data['sport'],
+                form.cleaned_data['min_price'],
+                form.cleaned_data['max_price'],
+            )
+            fields = keyset_paginate(request, queryset, ordering)
+
+        return render(request, self.template_name, {'form': form, 'fields': fields, 'page': fields})
+
+
+class FreeFieldSearchView(View):
+    template_name = 'field/free_field_search.html'
+
+    def get(self, request):
+        form = FreeFieldSearchForm(request.GET or None)
+        fields = None
+        if form.is_valid():
+            queryset = free_fields(
+                form.cleaned_data['sport'],
+                form.cleaned_data['date'],
+                form.cleaned_data['hour_from'],
+                form.cleaned_data['hour_to'],
+            )
+            fields = keyset_paginate(request, queryset, ['id'])
+
+        return render(request, self.template_name, {'form': form, 'fields': fields, 'page': fields})
 
 
 @login_required
@@ -89,6 +137,13 @@ def my_fields(request):
     return render(request, 'field/my_fields.html', {'fields': fields})
 
 
+@login_required
+def owner_dashboard(request):
+    # Reads only the booking rollups, so it costs the same whatever the reservation history
+    summary = rollups.owner_summary(request.user, timezone.localdate())
+    return render(request, 'field/owner_dashboard.html', summary)
+
+
 
 class FieldCreateView(LoginRequiredMixin, CreateView):
     model = Field
@@ -111,6 +166,36 @@ class FieldUpdateView(LoginRequiredMixin, UpdateView):
     def get_queryset(self):
         return Field.objects.filter(field_owner=self.request.user)
 
+    def get_formsets(self):
+        # Hours of single weekdays and upcoming dates, saved with the field
+        data = self.request.POST if self.request.method == 'POST' else None
+        upcoming = OpeningException.objects.filter(date__gte=timezone.localdate())
+        return (
+            OpeningHoursFormSet(data, instance=self.object, prefix='hours'),
+            OpeningExceptionFormSet(data, instance=self.object, prefix='exceptions', queryset=upcoming),
+        )
+
+    def get_context_data(self, **kwargs):
+        if 'hours_formset' not in kwargs:
+            kwargs['hours_formset'], kwargs['exceptions_formset'] = self.get_formsets()
+        return super().get_context_data(**kwargs)
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        form = self.get_form()
+        hours_formset, exceptions_formset = self.get_formsets()
+        # Validates all three so every error shows at once
+        if all([form.is_valid(), hours_formset.is_valid(), exceptions_formset.is_valid()]):
+            with transaction.atomic():
+                self.object = form.save()
+                # Saving the rows recompiles the field's opening hours (signals.py)
+                hours_formset.save()
+                exceptions_formset.save()
+            return HttpResponseRedirect(self.get_success_url())
+        return self.render_to_response(self.get_context_data(
+            form=form, hours_formset=hours_formset, exceptions_formset=exceptions_formset,
+        ))
+
 
 class FieldDeleteView(LoginRequiredMixin, DeleteView):
     model = Field
@@ -125,7 +210,7 @@ class FieldDetailView(View):
     login_url = 'login'
 
     def get(self, request, pk):
-        field = get_object_or_404(Field, pk=pk)
+        field = get_object_or_404(Field.objects.select_related('field_owner'), pk=pk)
 
         # Check if the user is authenticated
         is_authenticated = request.user.is_authenticated
@@ -166,8 +251,12 @@ class FieldDetailView(View):
             review = review_form.save(commit=False)
             review.user = request.user
             review.field = field
-            review.save()
-            messages.success(request, "Review successfully added.")
+            try:
+                review.save()
+            except IntegrityError:
+                messages.error(request, "You have already reviewed this field.")
+            else:
+                messages.success(request, "Review successfully added.")
         else:
             messages.error(request, "Failed to add the review. Please try again.")
 
@@ -178,39 +267,45 @@ class ReservationCreateView(CreateView):
     template_name = 'reservation/reservation_form.html'
     form_class = ReservationForm
 
+    def dispatch(self, request, *args, **kwargs):
+        self.field = get_object_or_404(Field, pk=self.kwargs['pk'])
+        return super().dispatch(request, *args, **kwargs)
+
     def form_valid(self, form):
         form.instance.user = self.request.user
-        form.instance.field = get_object_or_404(Field, pk=self.kwargs['pk'])
+        form.instance.field = self.field
 
-        # Access the selected reservation date and hour
+        # Access the selected reservation date, first hour and duration
         reservation_date = form.cleaned_data.get('reservation_date')
         reservation_hour = form.cleaned_data.get('reservation_hour')
+        duration = form.cleaned_data.get('duration') or 1
 
         if reservation_date and reservation_hour:
-            field = get_object_or_404(Field, pk=self.kwargs['pk'])
-            start_working_day = field.start_working_day
-            start_working_hour = field.start_working_hour
-            end_working_day = field.end_working_day
-            end_working_hour = field.end_working_hour
-
-            # Check if the selected reservation date and hour are within the working hours
-            if reservation_date.weekday() + 1 < start_working_day or reservation_date.weekday() + 1 > end_working_day:
+            field = self.field
+            # The open hours of the date, from the schedule compiled onto the field
+            open_mask = availability.working_mask(field, reservation_date)
+            span = availability.span_mask(reservation_hour, duration)
+            if not open_mask:
                 form.add_error('reservation_date', "Reservations are only allowed on working days.")
-            elif reservation_hour < start_working_hour or reservation_hour > end_working_hour:
+            elif open_mask & span != span:
                 form.add_error('reservation_hour', "Reservations are only allowed during working hours.")
             else:
-                # Check for duplicate reservations
-                existing_reservations = Reservation.objects.filter(
-                    field=field,
-                    reservation_date=reservation_date,
-                    reservation_hour=reservation_hour
-                )
-
-                if existing_reservations.exists():
+                # Reservations and other users' holds on any of the hours in one query
+                booked, holders = holds.slot_state(field, reservation_date, reservation_hour, duration)
+                if booked:
                     form.add_error(None, "This hour is already reserved for the selected date.")
+                elif holders - {self.request.user.pk}:
+                    form.add_error(None, "Somebody else is booking this hour, please choose another one.")
                 else:
-                    messages.success(self.request, "Reservation successfully created.")
-                    return super().form_valid(form)
+                    try:
+                        # The user's own hold turns into the reservation
+                        self.object = booking.book_slot(form.instance, held=bool(holders))
+                    except booking.SlotAlreadyReserved:
+                        # Somebody else got the hours between the check above and the insert
+                        form.add_error(None, "This hour is already reserved for the selected date.")
+                    else:
+                        messages.success(self.request, "Reservation successfully created.")
+                        return HttpResponseRedirect(self.get_success_url())
 
         return super().form_invalid(form)
 
@@ -220,45 +315,147 @@ class ReservationCreateView(CreateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        field = get_object_or_404(Field, pk=self.kwargs['pk'])
+        field = self.field
+        context['field'] = field
         context['field_name'] = field.name
-        context['start_working_day'] = field.get_start_working_day_display()
-        context['start_working_hour'] = field.start_working_hour
-        context['end_working_day'] = field.get_end_working_day_display()
-        context['end_working_hour'] = field.end_working_hour
+        # Free hours for the coming week so users don't have to guess
+        today = timezone.localdate()
+        context['free_slots'] = availability.free_slots(field, today, today + datetime.timedelta(days=6), self.request.user)
+        return context
+
+
+class RecurringReservationCreateView(LoginRequiredMixin, FormView):
+    template_name = 'reservation/recurring_reservation_form.html'
+    form_class = RecurringReservationForm
+
+    def dispatch(self, request, *args, **kwargs):
+        self.field = get_object_or_404(Field, pk=self.kwargs['pk'])
+        return super().dispatch(request, *args, **kwargs)
+
+    def form_valid(self, form):
+        try:
+            reservations = booking.book_slots(self.request.user, self.field, form.cleaned_data['slot_list'])
+        except booking.SlotConflicts as error:
+            for (date, hour), reason in sorted(error.conflicts.items()):
+                form.add_error(None, f"{date} at {hour}:00: {reason}")
+            return self.form_invalid(form)
+
+        messages.success(self.request, f"{len(reservations)} reservations successfully created.")
+        return redirect('schedule')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['field'] = self.field
         return context
 
+
+def field_availability(request, pk):
+    field = get_object_or_404(Field, pk=pk)
+    today = timezone.localdate()
+    try:
+        start_date = datetime.date.fromisoformat(request.GET.get('start', today.isoformat()))
+        end_date = datetime.date.fromisoformat(request.GET.get('end', (start_date + datetime.timedelta(days=6)).isoformat()))
+    except ValueError:
+        return JsonResponse({'error': 'Dates must be in YYYY-MM-DD format.'}, status=400)
+
+    if end_date < start_date or (end_date - start_date).days >= MAX_AVAILABILITY_DAYS:
+        return JsonResponse({'error': f'The date range must cover 1 to {MAX_AVAILABILITY_DAYS} days.'}, status=400)
+
+    # Every hold counts as taken here, looking up the user would cost the session and user queries
+    slots = availability.free_slots(field, start_date, end_date)
+    return JsonResponse({
+        'field': field.pk,
+        'slots': [{'date': slot['date'].isoformat(), 'free_hours': slot['free_hours']} for slot in slots],
+    })
+
+@require_POST
+@login_required
+def hold_slot(request, pk):
+    # Called by the reservation form when the user picks a date, hour or duration
+    field = get_object_or_404(Field, pk=pk)
+    form = ReservationForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Choose a date and an hour.'}, status=400)
+    try:
+        expires_at = holds.hold_slot(
+            request.user, field, form.cleaned_data['reservation_date'], form.cleaned_data['reservation_hour'],
+            form.cleaned_data['duration'],
+        )
+    except holds.SlotUnavailable as error:
+        return JsonResponse({'error': str(error)}, status=409)
+    return JsonResponse({'expires_at': expires_at.isoformat()})
+
+def slot_events(request, pk, date):
+    # Live slot changes stream from the ASGI deployment only (async_views.slot_events), a
+    # worker thread per idle stream would be too dear. 204 tells EventSource not to reconnect.
+    return HttpResponse(status=204)
+
 def reservation_confirmation(request, pk):
-    reservation = get_object_or_404(Reservation, pk=pk)
-    return render(request, 'reservation/reservation_confirmation.html', {'reservation': reservation})
+    reservation = get_object_or_404(Reservation.objects.select_related('field'), pk=pk)
+    return render(request, 'reservation/reservation_confirmation.html', {'reservation': reservation, 'field': reservation.field})
 
 
-class ScheduleListView(LoginRequiredMixin, ListView):
+class ScheduleListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Reservation
     template_name = 'reservation/schedule_list.html'
     context_object_name = 'reservations'
+    keyset_ordering = ['reservation_date', 'reservation_hour', 'id']
+    history = False
 
     def get_queryset(self):
-        # Only display reservations for the current user, ordered by reservation date and hour
-        return Reservation.objects.filter(user=self.request.user).order_by('reservation_date', 'reservation_hour')
+        # Only display reservations for the current user, ordered by reservation date and hour.
+        # Upcoming and past reservations are separate pages, so the usual one only reads the
+        # partitions from this month on.
+        reservations = Reservation.objects.filter(user=self.request.user).select_related('field')
+        if self.history:
+            return reservations.filter(reservation_date__lt=timezone.localdate())
+        return reservations.filter(reservation_date__gte=timezone.localdate())
 
+    def get_context_data(self, **kwargs):
+        kwargs['history'] = self.history
+        return super().get_context_data(**kwargs)
 
-class FieldScheduleView(LoginRequiredMixin, ListView):
-    model = Reservation
+
+class ScheduleHistoryView(ScheduleListView):
+    keyset_ordering = ['-reservation_date', '-reservation_hour', '-id']
+    history = True
+
+
+class FieldScheduleView(LoginRequiredMixin, View):
     template_name = 'reservation/field_schedule.html'
-    context_object_name = 'reservations'
-    ordering = ['reservation_date', 'reservation_hour']
 
-    def get_queryset(self):
-        field_id = self.kwargs['field_id']
-        return Reservation.objects.filter(field_id=field_id)
+    def get(self, request, field_id):
+        # Owner only, the grid names the players who booked. Only the owner gets the link to it
+        # (field_detail.html), other users get a 404 as for a missing field.
+        field = get_object_or_404(Field, pk=field_id, field_owner=request.user)
+        span = request.GET.get('span') if request.GET.get('span') in schedule.SPANS else 'week'
+        try:
+            date = datetime.date.fromisoformat(request.GET['start'])
+        except (KeyError, ValueError):
+            date = timezone.localdate()
+
+        start, end, previous_start, next_start = schedule.schedule_span(date, span)
+        context = {
+            'field': field,
+            'span': span,
+            'start': start,
+            'end': end,
+            'previous_start': previous_start,
+            'next_start': next_start,
+            'hours': availability.HOURS,
+            'days': schedule.schedule_grid(field, start, end),
+        }
+        return render(request, self.template_name, context)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        field_id = self.kwargs['field_id']
-        field = get_object_or_404(Field, pk=field_id)
-        context['field'] = field
-        return context
+@login_required
+def export_reservations(request):
+    # The form is shown until dates are picked, then the reservations of the owner's fields stream out as CSV
+    form = ReservationExportForm(request.user, request.GET or None)
+    if form.is_valid():
+        start_date, end_date = form.cleaned_data['start_date'], form.cleaned_data['end_date']
+        reservations = exports.owner_reservations(request.user, start_date, end_date, form.cleaned_data['field'])
+        return exports.reservations_csv_response(reservations, f'reservations-{start_date}-{end_date}.csv')
+    return render(request, 'reservation/export_reservations.html', {'form': form})
 
 class ReservationCancelView(View):
     def post(self, request, pk):
@@ -288,39 +485,45 @@ class AddReviewView(LoginRequiredMixin, CreateView):
         form.instance.user = self.request.user
         field = get_object_or_404(Field, pk=self.kwargs['pk'])
         form.instance.field = field
-        return super().form_valid(form)
+        try:
+            return super().form_valid(form)
+        except IntegrityError:
+            form.add_error(None, "You have already reviewed this field.")
+            return self.form_invalid(form)
 
     def get_success_url(self):
         messages.success(self.request, "Review successfully added.")
         return reverse_lazy('field_detail', kwargs={'pk': self.kwargs['pk']})
 
 
+@method_decorator(cache_catalog_page('field:{pk}', 'review:{pk}'), name='get')
 class ReviewListView(View):
     template_name = 'review/reviews.html'
 
     def get(self, request, pk):
         field = get_object_or_404(Field, pk=pk)
-        reviews = Review.objects.filter(field=field)
+        reviews = keyset_paginate(request, Review.objects.filter(field=field).select_related('user'), ['-created_at', '-id'])
 
-        return render(request, self.template_name, {'field': field, 'reviews': reviews})
+        return render(request, self.template_name, {'field': field, 'reviews': reviews, 'page': reviews})
 
 class FieldOwnerReviews(View):
     template_name = 'review/field_owner_reviews.html'
 
     def get(self, request, pk):
         field = get_object_or_404(Field, pk=pk)
-        reviews = Review.objects.filter(field=field)
+        reviews = Review.objects.filter(field=field).select_related('user')
 
         return render(request, self.template_name, {'field': field, 'reviews': reviews})
 
 
+@method_decorator(cache_catalog_page('field:{pk}', 'event:{pk}'), name='get')
 class EventsListView(View):
     template_name = 'events/events_list.html'
 
     def get(self, request, pk):
         field = get_object_or_404(Field, pk=pk)
-        events_list = Event.objects.filter(field=field)
-        return render(request, self.template_name, {'field': field, 'events_list': events_list})
+        events_list = keyset_paginate(request, Event.objects.filter(field=field), ['-date_published', '-id'])
+        return render(request, self.template_name, {'field': field, 'events_list': events_list, 'page': events_list})
 
 
 class AddEventView(View):
@@ -344,26 +547,32 @@ class AddEventView(View):
 
         return render(request, self.template_name, {'form': form, 'field': field})
 
-class AllEventsListView(ListView):
+@method_decorator(cache_catalog_page('field', 'event'), name='get')
+class AllEventsListView(KeysetPaginationMixin, ListView):
     model = Event
     template_name = 'events/all_events_list.html'
     context_object_name = 'events_list'
-    ordering = ['-date_published']  # Order events by date_published in descending order
+    keyset_ordering = ['-date_published', '-id']  # Order events by date_published in descending order
 
     def get_queryset(self):
         return super().get_queryset().select_related('field')
 
+@method_decorator(cache_catalog_page('field', 'review'), name='get')
 class FieldListBySportView(View):
     template_name = 'field/field_list_by_sport.html'
 
     def get(self, request, sport=None):
         if sport:
-            fields = Field.objects.filter(sport__iexact=sport)
+            # Match the stored spelling exactly so the (sport, id) index can be used
+            sport_value = {value.lower(): value for value, label in Field.SPORT_CHOICES}.get(sport.lower(), sport)
+            fields = Field.objects.filter(sport=sport_value)
         else:
             fields = Field.objects.all()
+        fields = keyset_paginate(request, fields, ['id'])
 
         context = {
             'fields': fields,
+            'page': fields,
             'selected_sport': sport,  # To highlight the selected sport in the template
         }
 
@@ -371,7 +580,7 @@ class FieldListBySportView(View):
 
 @login_required
 def event_detail(request, pk):
-    event = get_object_or_404(Event, pk=pk)
+    event = get_object_or_404(Event.objects.select_related('field'), pk=pk)
     user = request.user
 
     # Check if the user is already registered for the event
@@ -379,11 +588,25 @@ def event_detail(request, pk):
 
     if request.method == 'POST':
         if not is_registered:
-            registration = UserEventRegistration(user=user, event=event)
-            registration.save()
+            try:
+                if 'waitlist' in request.POST:
+                    joined = signups.join_waitlist(user, event)
+                    if isinstance(joined, EventWaitlistEntry):
+                        messages.success(request, "You joined the waitlist.")
+                else:
+                    signups.sign_up(user, event)
+            except signups.EventFull:
+                messages.error(request, "Sorry, this event is full. You can join the waitlist.")
+            except (signups.AlreadySignedUp, signups.AlreadyWaitlisted):
+                pass
             return redirect('event_detail', pk=pk)
 
-    return render(request, 'events/event_detail.html', {'event': event, 'is_registered': is_registered})
+    waitlist_entry = None if is_registered else signups.waitlist_entry(user, event)
+    return render(request, 'events/event_detail.html', {
+        'event': event,
+        'is_registered': is_registered,
+        'waitlist_entry': waitlist_entry,
+    })
 
 
 @login_required
@@ -392,23 +615,40 @@ def registered_users_list(request, pk):
 
 
 
-    registered_users = UserEventRegistration.objects.filter(event=event)
+    registered_users = keyset_paginate(
+        request,
+        UserEventRegistration.objects.filter(event=event).select_related('user'),
+        ['registration_date', 'id'],
+    )
 
-    return render(request, 'events/registered_users_list.html', {'event': event, 'registered_users': registered_users})
+    return render(request, 'events/registered_users_list.html', {'event': event, 'registered_users': registered_users, 'page': registered_users})
 
 class SignedUpEventsListView(LoginRequiredMixin, ListView):
     template_name = 'reservation/my_signed_up_events.html'
     context_object_name = 'signed_up_events'
 
     def get_queryset(self):
-        return UserEventRegistration.objects.filter(user=self.request.user).select_related('event').order_by('event__event_date')
+        return UserEventRegistration.objects.filter(user=self.request.user).select_related('event', 'event__field').order_by('event__event_date')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['waitlist_entries'] = signups.with_waitlist_positions(
+            EventWaitlistEntry.objects.filter(user=self.request.user).select_related('event', 'event__field')
+        ).order_by('event__event_date')
+        return context
 
 @login_required
 def cancel_sign_up(request, pk):
-    event_registration = get_object_or_404(UserEventRegistration, user=request.user, event_id=pk)
-    event_registration.delete()
+    if not signups.cancel_sign_up(request.user, pk):
+        raise Http404("No sign-up for this event.")
     return redirect('my_signed_up_events')  # Redirect to the signed-up events page
 
+@login_required
+def leave_waitlist(request, pk):
+    if request.method == 'POST':
+        signups.leave_waitlist(request.user, pk)
+    return redirect('my_signed_up_events')
+
 @login_required
 def change_password(request):
     if request.method == 'POST':
@@ -429,5 +669,14 @@ def change_password(request):
 
     return render(request, 'profile/change_password.html')
 
+def metrics_view(request):
+    # Prometheus text format, summed over every worker process
+    if not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(
+        metrics.render_prometheus(metrics.collect_all(), metrics.collect_all_connections()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
 def custom_404_view(request, exception):
     return render(request, '404/404.html', status=404)
\ No newline at end of file